@@ -0,0 +1,60 @@
+"""Helpers shared by the benchmark scripts."""
+import json
+import os
+import subprocess
+import sys
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS_DIR = os.path.join(REPO_ROOT, "python_scripts")
+RESULTS_DIR = os.path.join(REPO_ROOT, "benchmarks", "results")
+
+
+def bootstrap_pipeline(scrape_date: str, env: str = "dev", extra_args: list = None):
+    """Makes the pipeline modules importable from a benchmark.
+
+    `constants` parses the command line at import time, so `sys.argv` is set to
+    what the Airflow task would pass before anything under `python_scripts` is
+    imported. Metadata paths are relative to the repo root, hence the chdir.
+    """
+    os.chdir(REPO_ROOT)
+    if SCRIPTS_DIR not in sys.path:
+        sys.path.insert(0, SCRIPTS_DIR)
+    sys.argv = ["main.py", "--scrape_date", scrape_date, "--env", env] + (
+        extra_args or []
+    )
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def append_result(path: str, record: dict):
+    """Appends one benchmark run to a JSON lines history file."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    record = {
+        "commit": git_commit(),
+        "recorded_at": datetime.now().strftime("%Y-%m-%dT%H:%M:%S"),
+        **record,
+    }
+    with open(path, "a") as f:
+        f.write(json.dumps(record) + "\n")
+    return record
+
+
+def load_results(path: str) -> list[dict]:
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def percent_change(old: float, new: float) -> str:
+    if not old:
+        return "n/a"
+    return f"{100 * (new - old) / old:+.1f}%"
@@ -0,0 +1,242 @@
+"""Offline end-to-end benchmark of `main.main`.
+
+Runs every pipeline step against moto's in-process AWS mock and a local fake
+Matrix API (see `fake_matrix_api.py`), and records wall time, peak RSS and
+bytes moved for each step. Results are appended to
+`benchmarks/results/e2e.jsonl` with the current commit, and compared against
+the last run with the same parameters so regressions show up across commits.
+
+Usage:
+    python benchmarks/e2e.py --bookings 20000 --page-size 2500 --latency-ms 50
+"""
+import argparse
+import json
+import os
+import resource
+import shlex
+import threading
+import time
+
+from common import (
+    RESULTS_DIR,
+    append_result,
+    bootstrap_pipeline,
+    load_results,
+    percent_change,
+)
+from fake_matrix_api import FakeMatrixAPI
+
+SECRETS_KEY = "api_secrets/secrets.json"
+
+
+class PeakRSS:
+    """Samples the resident set size in a background thread while a step runs."""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        try:
+            import psutil
+
+            self._process = psutil.Process()
+        except ImportError:
+            self._process = None
+
+    def _rss(self) -> int:
+        if self._process is not None:
+            return self._process.memory_info().rss
+        # ru_maxrss is the process high-water mark, in KiB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self._rss())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self._rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self._rss())
+
+
+def s3_bytes(s3_client) -> int:
+    """Total size of every object in the mocked account."""
+    total = 0
+    for bucket in s3_client.list_buckets()["Buckets"]:
+        paginator = s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=bucket["Name"]):
+            total += sum(obj["Size"] for obj in page.get("Contents", []))
+    return total
+
+
+def instrument_steps(main_module, api: FakeMatrixAPI, s3_client, results: list):
+    """Wraps each step `main.main` loads so it reports its own cost."""
+
+    def wrap(name, func):
+        def measured(*args, **kwargs):
+            api_before = api.bytes_served
+            requests_before = api.requests_served
+            s3_before = s3_bytes(s3_client)
+            start = time.perf_counter()
+            with PeakRSS() as rss:
+                func(*args, **kwargs)
+            wall = time.perf_counter() - start
+            results.append(
+                {
+                    "step": name,
+                    "wall_seconds": round(wall, 4),
+                    "peak_rss_mb": round(rss.peak / 2**20, 1),
+                    "api_bytes": api.bytes_served - api_before,
+                    "api_requests": api.requests_served - requests_before,
+                    "s3_bytes_delta": s3_bytes(s3_client) - s3_before,
+                }
+            )
+
+        measured.__name__ = func.__name__
+        return measured
+
+    load_step = main_module.load_step
+    main_module.load_step = lambda name: wrap(name, load_step(name))
+
+
+def run(args) -> dict:
+    os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+    os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+    os.environ.setdefault("AWS_SECURITY_TOKEN", "testing")
+    os.environ.setdefault("AWS_SESSION_TOKEN", "testing")
+    os.environ["AWS_DEFAULT_REGION"] = "eu-west-1"
+
+    from moto import mock_aws
+    import boto3
+
+    api = FakeMatrixAPI(
+        bookings_per_day=args.bookings,
+        n_locations=args.locations,
+        latency_ms=args.latency_ms,
+        max_page_size=args.page_size,
+        seed=args.seed,
+    )
+    steps = []
+    with api, mock_aws():
+        s3_client = boto3.client("s3", region_name="eu-west-1")
+        # Same bucket naming as constants.py
+        suffix = "" if args.env == "prod" else f"-{args.env}"
+        for bucket in ["alpha-dag-matrix", f"mojap-land{suffix}", f"mojap-raw-hist{suffix}"]:
+            s3_client.create_bucket(
+                Bucket=bucket,
+                CreateBucketConfiguration={"LocationConstraint": "eu-west-1"},
+            )
+        s3_client.put_object(
+            Bucket="alpha-dag-matrix",
+            Key=SECRETS_KEY,
+            Body=json.dumps({"username": "benchmark", "password": "benchmark"}),
+        )
+
+        # AWS clients are created at import time, so import inside the mock
+        bootstrap_pipeline(
+            args.scrape_date,
+            args.env,
+            ["--api-url", api.url] + shlex.split(args.pipeline_args),
+        )
+        import main
+        from functions import api_requests
+        from metrics import run_metrics
+
+        # The scraper stops at the first short page, so it has to ask for the
+        # page size the fake API serves
+        api_requests.BOOKINGS_PAGE_SIZE = args.page_size
+        instrument_steps(main, api, s3_client, steps)
+        start = time.perf_counter()
+        main.main()
+        total = time.perf_counter() - start
+
+    scraped = sum(
+        step["rows"]
+        for step in run_metrics.steps
+        if step["name"] == "scrape_and_write_raw_bookings_data"
+    )
+    assert scraped == args.bookings, (
+        f"Scraped {scraped} bookings, expected {args.bookings}"
+    )
+
+    return {
+        "params": {
+            "bookings": args.bookings,
+            "locations": args.locations,
+            "page_size": args.page_size,
+            "latency_ms": args.latency_ms,
+            "seed": args.seed,
+            "pipeline_args": args.pipeline_args,
+        },
+        "label": args.label,
+        "total_wall_seconds": round(total, 4),
+        "steps": steps,
+        "gauges": dict(run_metrics.gauges),
+    }
+
+
+def report(record: dict, previous: dict = None):
+    prev_steps = {s["step"]: s for s in (previous or {}).get("steps", [])}
+    print(f"\nCommit {record['commit']}  total {record['total_wall_seconds']:.2f}s")
+    if previous:
+        print(
+            f"Previous {previous['commit']}  total {previous['total_wall_seconds']:.2f}s "
+            f"({percent_change(previous['total_wall_seconds'], record['total_wall_seconds'])})"
+        )
+    header = f"{'step':<40}{'wall s':>10}{'change':>10}{'rss MB':>10}{'api MB':>10}{'s3 MB':>10}"
+    print(header)
+    print("-" * len(header))
+    for step in record["steps"]:
+        prev = prev_steps.get(step["step"], {})
+        print(
+            f"{step['step']:<40}{step['wall_seconds']:>10.3f}"
+            f"{percent_change(prev.get('wall_seconds'), step['wall_seconds']):>10}"
+            f"{step['peak_rss_mb']:>10.1f}{step['api_bytes'] / 2**20:>10.2f}"
+            f"{step['s3_bytes_delta'] / 2**20:>10.2f}"
+        )
+    for name, value in record.get("gauges", {}).items():
+        print(f"{name}: {value}")
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="End-to-end scraper benchmark")
+    parser.add_argument("--bookings", type=int, default=10000, help="Bookings per day")
+    parser.add_argument("--locations", type=int, default=5000, help="Locations in the tree")
+    parser.add_argument("--page-size", type=int, default=2500, help="API page size")
+    parser.add_argument("--latency-ms", type=float, default=0, help="Added API latency")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--scrape-date", default="2024-01-15")
+    parser.add_argument("--env", default="dev", choices=["dev", "preprod", "prod"])
+    parser.add_argument("--label", default="", help="Free text stored with the result")
+    parser.add_argument(
+        "--pipeline-args",
+        default="",
+        help="Extra arguments for main.py, e.g. \"--booking-window-hours 2\"",
+    )
+    parser.add_argument(
+        "--results",
+        default=os.path.join(RESULTS_DIR, "e2e.jsonl"),
+        help="JSON lines file the result is appended to",
+    )
+    parser.add_argument(
+        "--no-save", action="store_true", help="Report without storing the result"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    record = run(args)
+    previous = [r for r in load_results(args.results) if r["params"] == record["params"]]
+    if args.no_save:
+        record = {"commit": "unsaved", **record}
+    else:
+        record = append_result(args.results, record)
+    report(record, previous[-1] if previous else None)
@@ -0,0 +1,168 @@
+"""A local stand-in for the Matrix booking API.
+
+Serves synthetic bookings and a synthetic location tree (see `synthetic.py`)
+over HTTP, with configurable volume, page size limit and per-request latency,
+so the scraper can be run end-to-end without touching the live API.
+"""
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from synthetic import make_bookings, make_location_tree
+
+
+def _parse_time(value: str, day_end: bool = False) -> datetime:
+    """Parses the `f`/`t` query parameters, which are either a date, a
+    date and time, or `eod` (end of day)."""
+    for fmt in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d"):
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if fmt == "%Y-%m-%d" and day_end:
+            parsed += timedelta(days=1)
+        return parsed
+    raise ValueError(f"Unrecognised time parameter: {value}")
+
+
+class FakeMatrixAPI:
+    """Threaded HTTP server mimicking the Matrix endpoints used by the scraper.
+
+    Parameters
+    ----------
+    bookings_per_day :
+        Number of bookings returned for any scraped day
+    n_locations :
+        Approximate number of nodes in the location tree
+    latency_ms :
+        Delay added to every response
+    max_page_size :
+        Largest `pageSize` the server will honour
+    seed :
+        Seed for the synthetic data
+    """
+
+    def __init__(
+        self,
+        bookings_per_day: int = 10000,
+        n_locations: int = 5000,
+        latency_ms: float = 0,
+        max_page_size: int = 2500,
+        seed: int = 0,
+    ):
+        self.bookings_per_day = bookings_per_day
+        self.n_locations = n_locations
+        self.latency = latency_ms / 1000
+        self.max_page_size = max_page_size
+        self.seed = seed
+        self.bytes_served = 0
+        self.requests_served = 0
+        self._days = {}
+        self._locations_body = None
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/api/v1"
+
+    def bookings_for_day(self, day: str) -> list[dict]:
+        with self._lock:
+            if day not in self._days:
+                self._days[day] = make_bookings(
+                    self.bookings_per_day,
+                    scrape_date=day,
+                    seed=self.seed,
+                    n_locations=self.n_locations,
+                )
+            return self._days[day]
+
+    def locations_body(self) -> bytes:
+        with self._lock:
+            if self._locations_body is None:
+                tree = make_location_tree(self.n_locations, seed=self.seed)
+                self._locations_body = json.dumps(tree).encode("utf-8")
+            return self._locations_body
+
+    def booking_page(self, params: dict) -> bytes:
+        time_from = _parse_time(params["f"])
+        if params.get("t", "eod") == "eod":
+            time_to = time_from.replace(hour=0, minute=0, second=0) + timedelta(days=1)
+        else:
+            time_to = _parse_time(params["t"], day_end=True)
+        page_size = min(int(params.get("pageSize") or self.max_page_size), self.max_page_size)
+        page_num = int(params.get("pageNum") or 0)
+
+        bookings = [
+            booking
+            for booking in self.bookings_for_day(time_from.strftime("%Y-%m-%d"))
+            if _parse_time(booking["timeFrom"][:19]) < time_to
+            and _parse_time(booking["timeTo"][:19]) > time_from
+        ]
+        page = bookings[page_num * page_size:(page_num + 1) * page_size]
+        return json.dumps(page).encode("utf-8")
+
+    def _handler(self):
+        api = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def _send(self, status: int, body: bytes, cookie: str = None):
+                if api.latency:
+                    time.sleep(api.latency)
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                if cookie:
+                    self.send_header("Set-Cookie", cookie)
+                self.end_headers()
+                self.wfile.write(body)
+                with api._lock:
+                    api.bytes_served += len(body)
+                    api.requests_served += 1
+
+            def do_POST(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                self.rfile.read(length)
+                if self.path.rstrip("/") == "/api/v1/user/login":
+                    self._send(200, b"{}", cookie="SESSION=benchmark; Path=/")
+                else:
+                    self._send(404, b"{}")
+
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+                path = parsed.path.rstrip("/")
+                if path == "/api/v1/booking":
+                    self._send(200, api.booking_page(params))
+                elif path.startswith("/api/v1/org/") and path.endswith("/locations"):
+                    self._send(200, api.locations_body())
+                else:
+                    self._send(404, b"{}")
+
+        return Handler
+
+    def start(self) -> "FakeMatrixAPI":
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self) -> "FakeMatrixAPI":
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
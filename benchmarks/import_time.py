@@ -0,0 +1,159 @@
+"""Start-up cost of each pipeline step.
+
+Every Airflow task starts a fresh container and runs `main.py --function
+{step}`, so the time spent importing modules is paid once per step per day.
+For each step in `main.STEPS`, this starts a new interpreter with
+`python -X importtime`, imports `main` and loads the step (which imports the
+step's module and everything it needs), and reports:
+
+- the wall time of the whole process, median of `--repeat` runs
+- the total import time and number of modules imported, from `-X importtime`
+- the packages that took longest to import (their modules' own time)
+
+It also reports a bare interpreter and loading every step, which is what each
+task paid before steps were loaded lazily. Results are appended to
+`benchmarks/results/import_time.jsonl` and compared with the last run.
+
+Usage:
+    python benchmarks/import_time.py --repeat 5
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+from common import (
+    REPO_ROOT,
+    RESULTS_DIR,
+    SCRIPTS_DIR,
+    append_result,
+    bootstrap_pipeline,
+    load_results,
+    percent_change,
+)
+
+CHILD = """
+import sys
+sys.path.insert(0, {scripts!r})
+sys.argv = {argv!r}
+import main
+for name in {steps!r}:
+    main.load_step(name)
+"""
+
+
+def parse_importtime(stderr: str) -> dict:
+    """Total import time, module count and time per top-level package from
+    `-X importtime` output"""
+    total_us = 0
+    modules = 0
+    by_package = defaultdict(int)
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        total_us += int(self_us)
+        modules += 1
+        by_package[package] += int(self_us)
+    return {"import_us": total_us, "modules": modules, "by_package": dict(by_package)}
+
+
+def time_child(code: str, repeat: int) -> dict:
+    """Runs `code` in `repeat` fresh interpreters"""
+    env = {**os.environ, "AWS_DEFAULT_REGION": "eu-west-1"}
+    walls, runs = [], []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", code],
+            cwd=REPO_ROOT,
+            env=env,
+            capture_output=True,
+            text=True,
+        )
+        walls.append(time.perf_counter() - start)
+        if proc.returncode != 0:
+            raise RuntimeError(proc.stderr.splitlines()[-1])
+        runs.append(parse_importtime(proc.stderr))
+    median_run = sorted(runs, key=lambda run: run["import_us"])[len(runs) // 2]
+    top = sorted(median_run["by_package"].items(), key=lambda item: -item[1])[:5]
+    return {
+        "wall_seconds": round(statistics.median(walls), 4),
+        "import_seconds": round(median_run["import_us"] / 1e6, 4),
+        "modules": median_run["modules"],
+        "heaviest": [[package, round(us / 1e6, 4)] for package, us in top],
+    }
+
+
+def run(args) -> dict:
+    bootstrap_pipeline(args.scrape_date, args.env)
+    argv = sys.argv[:]
+    import main
+
+    targets = [("(interpreter)", None)] + [(name, [name]) for name in main.STEPS]
+    targets.append(("(all steps)", list(main.STEPS)))
+    steps = []
+    for name, to_load in targets:
+        code = "pass" if to_load is None else CHILD.format(
+            scripts=SCRIPTS_DIR, argv=argv, steps=to_load
+        )
+        steps.append({"step": name, **time_child(code, args.repeat)})
+        print(f"{name}: {steps[-1]['wall_seconds']:.3f}s", file=sys.stderr)
+    return {
+        "params": {"repeat": args.repeat, "python": sys.version.split()[0]},
+        "label": args.label,
+        "steps": steps,
+    }
+
+
+def report(record: dict, previous: dict = None):
+    prev_steps = {s["step"]: s for s in (previous or {}).get("steps", [])}
+    print(f"\nCommit {record['commit']}")
+    if previous:
+        print(f"Previous {previous['commit']}")
+    header = (
+        f"{'step':<40}{'wall s':>10}{'change':>10}{'import s':>10}{'modules':>9}"
+        "  heaviest packages"
+    )
+    print(header)
+    print("-" * len(header))
+    for step in record["steps"]:
+        prev = prev_steps.get(step["step"], {})
+        heaviest = ", ".join(f"{package} {seconds:.2f}" for package, seconds in step["heaviest"][:3])
+        print(
+            f"{step['step']:<40}{step['wall_seconds']:>10.3f}"
+            f"{percent_change(prev.get('wall_seconds'), step['wall_seconds']):>10}"
+            f"{step['import_seconds']:>10.3f}{step['modules']:>9}  {heaviest}"
+        )
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Start-up time of each pipeline step")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per step")
+    parser.add_argument("--scrape-date", default="2024-01-15")
+    parser.add_argument("--env", default="dev", choices=["dev", "preprod", "prod"])
+    parser.add_argument("--label", default="", help="Free text stored with the result")
+    parser.add_argument(
+        "--results",
+        default=os.path.join(RESULTS_DIR, "import_time.jsonl"),
+        help="JSON lines file the result is appended to",
+    )
+    parser.add_argument(
+        "--no-save", action="store_true", help="Report without storing the result"
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    record = run(args)
+    previous = [r for r in load_results(args.results) if r["params"] == record["params"]]
+    if args.no_save:
+        record = {"commit": "unsaved", **record}
+    else:
+        record = append_result(args.results, record)
+    report(record, previous[-1] if previous else None)
@@ -0,0 +1,127 @@
+"""Compares JSON backends on the API and raw JSONL paths.
+
+Times stdlib `json` against orjson (when installed) on:
+
+- one page of the bookings endpoint (2500 nested bookings, as returned by the
+  API and parsed by `get_payload`)
+- a full day of raw bookings as JSONL (flat records, as written by the scrape
+  step and read back by the clean step), both parsed and serialised
+
+and, when pandas is available, `pd.read_json(lines=True)` (what
+`arrow_pd_parser.reader.read` uses) against `functions.jsonl_helpers.read_jsonl`
+on the same file.
+
+Usage:
+    python benchmarks/json_decoding.py --day-rows 50000
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+from common import bootstrap_pipeline, percent_change
+from synthetic import make_bookings
+
+
+def timed(func, repeat: int) -> float:
+    """Median wall time of `repeat` runs of `func`."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def flatten(record: dict, prefix: str = "") -> dict:
+    """Flattens a nested booking the way pd.json_normalize does."""
+    flat = {}
+    for key, value in record.items():
+        name = f"{prefix}_{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        else:
+            flat[name] = value
+    return flat
+
+
+def build_cases(page_size: int, day_rows: int, tmp_dir: str) -> dict:
+    """Returns a mapping of benchmark group to {backend: callable}."""
+    bootstrap_pipeline("2024-01-15")
+    import fast_json
+
+    page = json.dumps(make_bookings(page_size, seed=1)).encode("utf-8")
+    day_records = [flatten(b) for b in make_bookings(day_rows, seed=2)]
+    day_body = b"".join(json.dumps(r).encode("utf-8") + b"\n" for r in day_records)
+    day_lines = day_body.splitlines()
+    print(
+        f"Page: {len(page) / 2**20:.1f} MiB, "
+        f"day: {len(day_body) / 2**20:.1f} MiB ({day_rows} rows), "
+        f"fast_json backend: {fast_json.BACKEND}",
+        file=sys.stderr,
+    )
+
+    cases = {
+        f"page[{page_size}] loads": {
+            "json": lambda: json.loads(page.decode("utf-8")),
+        },
+        f"day_jsonl[{day_rows}] loads": {
+            "json": lambda: [json.loads(line) for line in day_lines],
+        },
+        f"day_jsonl[{day_rows}] dumps": {
+            "json": lambda: "".join(json.dumps(r) + "\n" for r in day_records),
+        },
+    }
+    if fast_json.orjson is not None:
+        orjson = fast_json.orjson
+        cases[f"page[{page_size}] loads"]["orjson"] = lambda: orjson.loads(page)
+        cases[f"day_jsonl[{day_rows}] loads"]["orjson"] = lambda: [
+            orjson.loads(line) for line in day_lines
+        ]
+        cases[f"day_jsonl[{day_rows}] dumps"]["orjson"] = lambda: b"".join(
+            orjson.dumps(r) + b"\n" for r in day_records
+        )
+
+    try:
+        import pandas as pd
+        from functions.jsonl_helpers import read_jsonl
+    except ImportError as e:
+        print(f"Skipping dataframe benchmarks: {e}", file=sys.stderr)
+        return cases
+
+    day_path = os.path.join(tmp_dir, "bookings-raw-2024-01-15.jsonl")
+    with open(day_path, "wb") as f:
+        f.write(day_body)
+    cases[f"day_jsonl[{day_rows}] to dataframe"] = {
+        "pd.read_json": lambda: pd.read_json(
+            io.BytesIO(day_body), lines=True, orient="records"
+        ),
+        f"read_jsonl ({fast_json.BACKEND})": lambda: read_jsonl(day_path),
+    }
+    return cases
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="JSON backend benchmarks")
+    parser.add_argument("--page-size", type=int, default=2500, help="Bookings per API page")
+    parser.add_argument("--day-rows", type=int, default=50000, help="Bookings in the day file")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per benchmark")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        cases = build_cases(args.page_size, args.day_rows, tmp_dir)
+        print(f"{'benchmark':<40}{'backend':<24}{'median s':>10}{'vs first':>10}")
+        for group, backends in cases.items():
+            first = None
+            for backend, func in backends.items():
+                median = timed(func, args.repeat)
+                change = "" if first is None else percent_change(first, median)
+                first = median if first is None else first
+                print(f"{group:<40}{backend:<24}{median:>10.4f}{change:>10}")
@@ -0,0 +1,176 @@
+"""Micro-benchmarks for the per-record transform helpers.
+
+Times the hot paths of the scrape and clean steps on seeded synthetic data
+shaped like `metadata/{env}/bookings.json` and `metadata/{env}/locations.json`,
+at sizes from 1k to 1M rows. Results can be saved as a baseline and later runs
+compared against it.
+
+Usage:
+    python benchmarks/micro.py --sizes 1000,10000,100000
+    python benchmarks/micro.py --save-baseline
+    python benchmarks/micro.py --compare --fail-on-regression 0.2
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+from common import RESULTS_DIR, bootstrap_pipeline, git_commit, percent_change
+from synthetic import make_bookings, make_location_tree
+
+DEFAULT_SIZES = "1000,10000,100000,1000000"
+DEFAULT_BASELINE = os.path.join(RESULTS_DIR, "micro-baseline.json")
+
+
+def timed(func, repeat: int) -> dict:
+    """Runs `func` `repeat` times and returns the min and median wall time."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - start)
+    return {"min": min(timings), "median": statistics.median(timings)}
+
+
+def repeats_for(size: int) -> int:
+    return 5 if size <= 10000 else 3 if size <= 100000 else 1
+
+
+def build_cases(size: int, meta_path_bookings: str) -> dict:
+    """Builds the inputs for each benchmark at one size and returns a mapping
+    of benchmark name to a zero-argument callable."""
+    import pandas as pd
+    from mojap_metadata import Metadata
+    from arrow_pd_parser import caster
+
+    from column_renames import bookings_renames
+    from functions.api_helpers import (
+        camel_to_snake_case,
+        compact_dtypes,
+        compact_frame,
+        fix_faulty_time_col,
+        locations_to_frame,
+    )
+    from functions.normalise import arrow_normalise
+    from functions.api_requests import (
+        add_date_time_columns,
+        fix_faulty_time_cols,
+        rename_df,
+    )
+
+    bookings = make_bookings(size, seed=size)
+    # One tree node per row; the generator rounds to whole buildings
+    tree = make_location_tree(size, seed=size)
+
+    normalised = pd.json_normalize(bookings, sep="_")
+    column_names = list(normalised.columns)
+    names = [column_names[i % len(column_names)] for i in range(size)]
+    snake = normalised.rename(mapper=camel_to_snake_case, axis="columns")
+    renamed = rename_df(snake, bookings_renames)
+
+    metadata = Metadata.from_json(meta_path_bookings)
+    cleaned = add_date_time_columns(fix_faulty_time_cols(renamed.copy()), "2024-01-15")
+    cleaned = cleaned.reindex(columns=metadata.column_names)
+
+    return {
+        "camel_to_snake_case": lambda: [camel_to_snake_case(n) for n in names],
+        "fix_faulty_time_col": lambda: fix_faulty_time_col(renamed, "time_from"),
+        "locations_to_frame": lambda: locations_to_frame(tree),
+        "rename_df": lambda: rename_df(snake, bookings_renames),
+        "json_normalize_bookings": lambda: pd.json_normalize(bookings, sep="_"),
+        "arrow_normalise_bookings": lambda: arrow_normalise(bookings),
+        "cast_pandas_table_to_schema": lambda: caster.cast_pandas_table_to_schema(
+            cleaned, metadata
+        ),
+        "compact_dtypes": lambda: compact_dtypes(cleaned.copy(), metadata),
+        "compact_and_cast": lambda: caster.cast_pandas_table_to_schema(
+            compact_dtypes(cleaned.copy(), metadata), metadata
+        ),
+        "compact_frame_and_cast": lambda: caster.cast_pandas_table_to_schema(
+            compact_frame(
+                {name: cleaned[name].tolist() for name in cleaned.columns}, metadata
+            ),
+            metadata,
+        ),
+    }
+
+
+def run(sizes: list[int], only: list[str] = None) -> dict:
+    bootstrap_pipeline("2024-01-15")
+    from constants import meta_path_bookings
+
+    results = {}
+    for size in sizes:
+        print(f"Generating {size} rows", file=sys.stderr)
+        cases = build_cases(size, meta_path_bookings)
+        for name, func in cases.items():
+            if only and name not in only:
+                continue
+            timing = timed(func, repeats_for(size))
+            results[f"{name}[{size}]"] = timing
+            print(f"{name}[{size}]: {timing['median']:.4f}s", file=sys.stderr)
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Prints each benchmark against the baseline and returns those that are
+    slower than the baseline by more than `threshold` (a fraction)."""
+    regressions = []
+    print(f"{'benchmark':<45}{'baseline s':>12}{'current s':>12}{'change':>10}")
+    for name, timing in results.items():
+        base = baseline.get("results", {}).get(name)
+        if base is None:
+            print(f"{name:<45}{'-':>12}{timing['median']:>12.4f}{'new':>10}")
+            continue
+        change = percent_change(base["median"], timing["median"])
+        flag = ""
+        if base["median"] and timing["median"] > base["median"] * (1 + threshold):
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<45}{base['median']:>12.4f}{timing['median']:>12.4f}{change:>10}{flag}")
+    return regressions
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Transform hot path micro-benchmarks")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="Comma separated row counts")
+    parser.add_argument("--only", default="", help="Comma separated benchmark names")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="Baseline JSON file")
+    parser.add_argument("--save-baseline", action="store_true", help="Overwrite the baseline")
+    parser.add_argument("--compare", action="store_true", help="Compare against the baseline")
+    parser.add_argument(
+        "--fail-on-regression",
+        type=float,
+        default=None,
+        help="Exit non-zero if any benchmark is slower by more than this fraction",
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    only = [s for s in args.only.split(",") if s]
+    results = run(sizes, only)
+
+    regressions = []
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print(f"Comparing {git_commit()} against baseline from {baseline['commit']}")
+        threshold = args.fail_on_regression if args.fail_on_regression is not None else 0.1
+        regressions = compare(results, baseline, threshold)
+    else:
+        for name, timing in results.items():
+            print(f"{name:<45}{timing['min']:>12.4f}{timing['median']:>12.4f}")
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({"commit": git_commit(), "results": results}, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+
+    if regressions and args.fail_on_regression is not None:
+        sys.exit(1)
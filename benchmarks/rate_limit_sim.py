@@ -0,0 +1,154 @@
+"""Checks how `AdaptiveRateLimiter` reacts to the API's latency.
+
+Worker threads send requests through one limiter for a few seconds, each
+"request" sleeping for a scripted latency instead of calling the API, and the
+limiter's rate and concurrency limit are sampled as they go. Time runs
+`--speedup` times faster than in a real scrape: latencies are divided by it,
+and the limiter's rates (requests per second) and rate increase (requests per
+second, per second) are multiplied by it once and twice, so the limiter makes
+the same decisions as it would against the API, in a fraction of the time.
+The scenarios are:
+
+- steady: every response takes the same time
+- fast_first: one quick response, then steady slower ones, which used to
+  collapse the limiter to its floor for the rest of the run
+- sustained_rise: the latency jumps tenfold and stays there, which should
+  back off once and then recover as the new latency becomes the norm
+- throttled: a burst of 429s, which should back off and then recover
+
+Each scenario has a check, and the script exits with an error if any fails.
+
+Usage:
+    python benchmarks/rate_limit_sim.py --seconds 5 --speedup 10
+"""
+import argparse
+import sys
+import threading
+import time
+
+from common import SCRIPTS_DIR
+
+sys.path.insert(0, SCRIPTS_DIR)
+
+from rate_limit import AdaptiveRateLimiter  # noqa: E402
+
+# Latency of a typical page from the API, in seconds
+BASE_LATENCY = 0.1
+
+
+def steady(n: int):
+    return BASE_LATENCY, False
+
+
+def fast_first(n: int):
+    return (BASE_LATENCY / 10 if n == 0 else BASE_LATENCY), False
+
+
+def sustained_rise(n: int):
+    return (BASE_LATENCY if n < 100 else BASE_LATENCY * 10), False
+
+
+def throttled(n: int):
+    return BASE_LATENCY, 100 <= n < 110
+
+
+SCENARIOS = {
+    "steady": steady,
+    "fast_first": fast_first,
+    "sustained_rise": sustained_rise,
+    "throttled": throttled,
+}
+
+
+def simulate(script, seconds: float, workers: int, max_rate: float, speedup: float) -> dict:
+    """Runs `workers` threads through one limiter for `seconds`. `script(n)`
+    gives the latency of the n-th request and whether it was throttled.
+    Rates in the result are in real requests per second."""
+    defaults = AdaptiveRateLimiter(name="simulation")
+    limiter = AdaptiveRateLimiter(
+        min_rate=defaults.min_rate * speedup,
+        max_rate=max_rate * speedup,
+        max_concurrency=workers,
+        increase=defaults.increase * speedup**2,
+        name="simulation",
+    )
+    counter = {"sent": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+    lowest = {"rate": limiter.rate, "concurrency": limiter.concurrency}
+
+    def worker():
+        while time.monotonic() < deadline:
+            with limiter.request() as outcome:
+                with lock:
+                    n = counter["sent"]
+                    counter["sent"] += 1
+                latency, outcome["throttled"] = script(n)
+                time.sleep(latency / speedup)
+            with lock:
+                lowest["rate"] = min(lowest["rate"], limiter.rate)
+                lowest["concurrency"] = min(lowest["concurrency"], limiter.concurrency)
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        "requests": counter["sent"],
+        "lowest_rate": round(lowest["rate"] / speedup, 2),
+        "lowest_concurrency": int(lowest["concurrency"]),
+        "final_rate": round(limiter.rate / speedup, 2),
+        "final_concurrency": int(limiter.concurrency),
+    }
+
+
+def check(name: str, result: dict, max_rate: float, workers: int) -> str:
+    """What's wrong with a scenario's result, if anything"""
+    recovered = (
+        result["final_rate"] >= 0.9 * max_rate
+        and result["final_concurrency"] == workers
+    )
+    backed_off = result["lowest_rate"] < max_rate
+    if not recovered:
+        return "did not recover"
+    if name in ("steady", "fast_first") and backed_off:
+        return "backed off without congestion"
+    if name in ("sustained_rise", "throttled") and not backed_off:
+        return "did not back off"
+    return ""
+
+
+def get_arguments():
+    parser = argparse.ArgumentParser(description="Rate limiter simulation")
+    parser.add_argument("--seconds", type=float, default=5, help="Length of each scenario")
+    parser.add_argument("--speedup", type=float, default=10, help="How much faster than real time")
+    parser.add_argument("--workers", type=int, default=4, help="Concurrent requests")
+    parser.add_argument("--max-rate", type=float, default=20, help="Requests per second")
+    parser.add_argument(
+        "--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS)
+    )
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = get_arguments()
+    header = (
+        f"{'scenario':<16}{'requests':>10}{'min rate':>10}{'min conc':>10}"
+        f"{'rate':>10}{'conc':>10}  problem"
+    )
+    print(header)
+    print("-" * len(header))
+    failed = False
+    for name in args.scenarios:
+        result = simulate(
+            SCENARIOS[name], args.seconds, args.workers, args.max_rate, args.speedup
+        )
+        problem = check(name, result, args.max_rate, args.workers)
+        failed = failed or bool(problem)
+        print(
+            f"{name:<16}{result['requests']:>10}{result['lowest_rate']:>10.2f}"
+            f"{result['lowest_concurrency']:>10}{result['final_rate']:>10.2f}"
+            f"{result['final_concurrency']:>10}  {problem}"
+        )
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,202 @@
+"""Seeded generators for synthetic Matrix API payloads.
+
+The records are shaped like the raw API responses that end up in
+`metadata/{env}/bookings.json` and `metadata/{env}/locations.json` after
+`pd.json_normalize` and `camel_to_snake_case`, so the same fixtures can drive
+both the end-to-end harness and the micro-benchmarks.
+"""
+import random
+from datetime import datetime, timedelta
+
+STATUSES = ["APPROVED", "APPROVED", "APPROVED", "TENTATIVE", "CANCELLED"]
+STATUS_REASONS = ["CANCELLED_BY_OWNER", "CANCELLED_BY_ADMIN", "AUTO_CANCELLED"]
+LOCATION_KINDS = ["DESK", "DESK", "DESK", "ROOM", "CAR_PARK_SPACE"]
+CHECK_IN_STATUSES = ["NOT_REQUIRED", "CHECKED_IN", "NOT_CHECKED_IN"]
+SOURCES = ["WEB", "IOS", "ANDROID", "OUTLOOK"]
+EVENT_TYPES = {
+    "created": "CREATED",
+    "cancelled": "CANCELLED",
+    "approved": "APPROVED",
+    "checkedIn": "CHECKED_IN",
+}
+
+
+def _timestamp(rng: random.Random, value: datetime) -> str:
+    """Formats a timestamp the way the API does, including the truncated
+    variants that `fix_faulty_time_col` has to repair."""
+    roll = rng.random()
+    if roll < 0.1:
+        return value.strftime("%Y-%m-%dT%H:%M")
+    if roll < 0.4:
+        return value.strftime("%Y-%m-%dT%H:%M:%S")
+    return value.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3]
+
+
+def _audit_event(rng: random.Random, kind: str, when: datetime, n_users: int) -> dict:
+    return {
+        "created": _timestamp(rng, when),
+        "when": _timestamp(rng, when + timedelta(seconds=rng.randint(0, 60))),
+        "eventType": EVENT_TYPES[kind],
+        "eventUserId": rng.randint(1, n_users),
+    }
+
+
+def make_booking(
+    rng: random.Random,
+    booking_id: int,
+    day: datetime,
+    n_locations: int = 5000,
+    n_users: int = 20000,
+) -> dict:
+    """Generates one nested booking record for the given day."""
+    time_from = day + timedelta(minutes=15 * rng.randint(24, 72))
+    duration = timedelta(minutes=15 * rng.randint(1, 36))
+    time_to = time_from + duration
+    created = time_from - timedelta(hours=rng.randint(1, 24 * 14))
+    status = rng.choice(STATUSES)
+    owner_id = rng.randint(1, n_users)
+
+    booking = {
+        "id": booking_id,
+        "timeFrom": _timestamp(rng, time_from),
+        "timeTo": _timestamp(rng, time_to),
+        "locationId": rng.randint(1, n_locations),
+        "locationKind": rng.choice(LOCATION_KINDS),
+        "owner": {"id": owner_id},
+        "bookedBy": {"id": owner_id if rng.random() < 0.9 else rng.randint(1, n_users)},
+        "organisation": {"id": 43, "name": "Ministry of Justice"},
+        "status": status,
+        "hasStarted": True,
+        "hasEnded": True,
+        "checkInStatus": rng.choice(CHECK_IN_STATUSES),
+        "attendeeCount": rng.randint(1, 12),
+        "ownerIsAttendee": rng.random() < 0.95,
+        "source": rng.choice(SOURCES),
+        "sourceVersion": f"{rng.randint(1, 9)}.{rng.randint(0, 20)}",
+        "version": rng.randint(1, 5),
+        "hasExternalNotes": rng.random() < 0.05,
+        "isBookedOnBehalf": rng.random() < 0.1,
+        "durationMillis": int(duration.total_seconds() * 1000),
+        "possibleActions": {
+            "edit": False,
+            "cancel": False,
+            "approve": False,
+            "confirm": False,
+            "endEarly": False,
+            "changeOwner": False,
+            "start": False,
+            "viewHistory": True,
+        },
+        "audit": {"created": _audit_event(rng, "created", created, n_users)},
+    }
+    if status == "CANCELLED":
+        booking["statusReason"] = rng.choice(STATUS_REASONS)
+        booking["audit"]["cancelled"] = _audit_event(
+            rng, "cancelled", created + timedelta(hours=1), n_users
+        )
+    if status == "APPROVED" and rng.random() < 0.2:
+        booking["audit"]["approved"] = _audit_event(
+            rng, "approved", created + timedelta(minutes=5), n_users
+        )
+    if booking["checkInStatus"] == "CHECKED_IN":
+        booking["audit"]["checkedIn"] = _audit_event(rng, "checkedIn", time_from, n_users)
+    if rng.random() < 0.15:
+        booking["bookingGroup"] = {
+            "id": rng.randint(1, 10**6),
+            "type": "REPEAT",
+            "repeatKind": "DAILY",
+            "repeatStartDate": _timestamp(rng, day - timedelta(days=7)),
+            "repeatEndDate": _timestamp(rng, day + timedelta(days=30)),
+            "repeatText": "Repeats daily until Thu, 30 Nov 2023",
+            "status": status,
+            "firstBookingStatus": "APPROVED",
+        }
+    return booking
+
+
+def make_bookings(
+    n: int,
+    scrape_date: str = "2024-01-15",
+    seed: int = 0,
+    n_locations: int = 5000,
+    n_users: int = 20000,
+) -> list[dict]:
+    """Generates `n` nested booking records for `scrape_date`, reproducibly."""
+    rng = random.Random(seed)
+    day = datetime.strptime(scrape_date, "%Y-%m-%d")
+    return [
+        make_booking(rng, 10**7 + i, day, n_locations, n_users) for i in range(n)
+    ]
+
+
+def make_location_tree(n_locations: int = 5000, seed: int = 0) -> list[dict]:
+    """Generates a location hierarchy of roughly `n_locations` nodes.
+
+    The response is a list holding the organisation root, whose nested
+    `locations` arrays run building > floor > zone > desk/room, with nested-set
+    `left`/`right` values as described in the API docs.
+    """
+    rng = random.Random(seed)
+    next_id = [1]
+    counter = [0]
+    leaves_per_zone = 40
+    zones_per_floor = 5
+    floors_per_building = 5
+    n_buildings = max(1, n_locations // (leaves_per_zone * zones_per_floor * floors_per_building))
+
+    def node(kind: str, parent_id: int, name: str, qualifier: str) -> dict:
+        location_id = next_id[0]
+        next_id[0] += 1
+        counter[0] += 1
+        bookable = kind in ("DESK", "ROOM")
+        return {
+            "id": location_id,
+            "parentId": parent_id,
+            "organisationId": 43,
+            "organisation": {"id": 43, "name": "Ministry of Justice"},
+            "kind": kind,
+            "name": name,
+            "shortQualifier": qualifier.split(",")[0],
+            "longQualifier": qualifier,
+            "qualifiedName": f"{name}, {qualifier}",
+            "longName": f"{name} ({qualifier})",
+            "shortName": name,
+            "description": None,
+            "alert": None,
+            "isBookable": bookable,
+            "isFlex": bookable and rng.random() < 0.3,
+            "externalReference": None,
+            "bookingCategoryId": rng.choice([1, 2, 3]) if bookable else None,
+            "availabilityType": "AVAILABLE" if bookable else None,
+            "capacity": rng.randint(1, 12) if kind == "ROOM" else 1,
+            "minimumCapacity": 1,
+            "settings": {"timeZone": {"zoneId": "Europe/London"}},
+            "provider": {"id": 1, "notificationDaysInterval": 1.0},
+            "left": counter[0],
+            "locations": [],
+        }
+
+    def close(location: dict):
+        counter[0] += 1
+        location["right"] = counter[0]
+
+    root = node("ORG", None, "Ministry of Justice", "MoJ")
+    for b in range(n_buildings):
+        building = node("BUILDING", root["id"], f"Building {b}", "London")
+        for f in range(floors_per_building):
+            floor = node("FLOOR", building["id"], f"Floor {f}", building["name"])
+            for z in range(zones_per_floor):
+                zone = node("ZONE", floor["id"], f"Zone {z}", f"{floor['name']}, {building['name']}")
+                for d in range(leaves_per_zone):
+                    kind = "ROOM" if d % 10 == 0 else "DESK"
+                    leaf = node(kind, zone["id"], f"{kind.title()} {d}", zone["longQualifier"])
+                    close(leaf)
+                    zone["locations"].append(leaf)
+                close(zone)
+                floor["locations"].append(zone)
+            close(floor)
+            building["locations"].append(floor)
+        close(building)
+        root["locations"].append(building)
+    close(root)
+    return [root]
@@ -0,0 +1,233 @@
+"""
+Runs Athena queries and records what they cost.
+
+Every query goes through `run_athena_query`, which waits for it to finish and
+then records, from its execution statistics, the engine time, the time it
+spent queued, the bytes it scanned and where its results were written:
+
+- on the current step of the run metrics (`athena_engine_ms`,
+  `athena_queue_ms`, `athena_scanned_bytes`, and the scanned bytes as the
+  `athena.query` call's bytes)
+- in the log
+- optionally, as one JSON line per query in the --athena-history file
+
+Queries are grouped by a label, by default the query with its literals
+replaced (so adding the partition for each day is the same query). When a
+history file is kept, a query that scans much more than the median of the
+recent runs of the same label is logged as a warning.
+
+Queries are sent with boto3, to the workgroup set with `configure` (by
+default $ATHENA_WORKGROUP, or Athena's default workgroup if that isn't set).
+awswrangler, which takes most of a second to import, is only used when the
+workgroup has no results location, to find or create its default results
+bucket.
+
+The module doesn't read the pipeline's command line, so scripts without one,
+such as refresh_app_db, can use it as it is. The pipeline passes its options
+in with `configure`.
+"""
+import hashlib
+import json
+import os
+import re
+import statistics
+import time
+from datetime import datetime
+from functools import lru_cache
+
+import boto3
+
+from metrics import run_metrics
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# How many earlier runs of a query its data scanned is compared with
+HISTORY_WINDOW = 20
+# Warn when a query scans this many times the median of its earlier runs
+SCAN_JUMP_FACTOR = 2.0
+# ...and more than this, as Athena charges for at least 10 MB anyway
+SCAN_JUMP_MIN_BYTES = 10 * 1024**2
+
+# Athena runs queries sent without a workgroup in this one
+DEFAULT_WORKGROUP = "primary"
+POLL_SECONDS = 0.5
+FINAL_STATES = ("SUCCEEDED", "FAILED", "CANCELLED")
+
+
+settings = {
+    "region_name": "eu-west-1",
+    "workgroup": os.environ.get("ATHENA_WORKGROUP"),
+    "history_path": None,
+}
+
+
+class AthenaQueryFailed(Exception):
+    """An Athena query finished in the FAILED or CANCELLED state"""
+
+
+def configure(**options):
+    """Changes any of `settings`
+
+    Parameters
+    ----------
+    region_name : optional
+        Region the queries run in
+    workgroup : optional
+        Workgroup the queries run in, None for Athena's default
+    history_path : optional
+        Local JSON lines file each query's statistics are appended to
+    """
+    for key, value in options.items():
+        if key not in settings:
+            raise ValueError(f"Unknown Athena setting {key}")
+        settings[key] = value
+
+
+def query_label(query_string: str) -> str:
+    """A name for the query that is the same whatever its literal values"""
+    normalised = " ".join(query_string.lower().split())
+    normalised = re.sub(r"'[^']*'", "?", normalised)
+    normalised = re.sub(r"\b\d+\b", "?", normalised)
+    words = re.findall(r"[a-z_]+", normalised)[:3]
+    digest = hashlib.sha256(normalised.encode("utf-8")).hexdigest()[:8]
+    return "_".join(words + [digest])
+
+
+def query_stats(label: str, execution: dict) -> dict:
+    """The parts of get_query_execution's response worth keeping"""
+    stats = execution.get("Statistics", {})
+    return {
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "label": label,
+        "query_execution_id": execution.get("QueryExecutionId"),
+        "state": execution.get("Status", {}).get("State"),
+        "engine_ms": stats.get("EngineExecutionTimeInMillis", 0),
+        "queue_ms": stats.get("QueryQueueTimeInMillis", 0),
+        "total_ms": stats.get("TotalExecutionTimeInMillis", 0),
+        "scanned_bytes": stats.get("DataScannedInBytes", 0),
+        "output_location": execution.get("ResultConfiguration", {}).get("OutputLocation"),
+    }
+
+
+def read_history(path: str, label: str) -> list[dict]:
+    """The most recent runs of the query `label` in the history file"""
+    if not path or not os.path.exists(path):
+        return []
+    with open(path) as f:
+        runs = [json.loads(line) for line in f if line.strip()]
+    return [run for run in runs if run.get("label") == label][-HISTORY_WINDOW:]
+
+
+def append_history(path: str, stats: dict):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "a") as f:
+        f.write(json.dumps(stats) + "\n")
+
+
+def check_scan_jump(stats: dict, history: list[dict]):
+    """Warns if the query scanned much more than it usually does"""
+    previous = [run["scanned_bytes"] for run in history if run.get("state") == "SUCCEEDED"]
+    if not previous:
+        return
+    median = statistics.median(previous)
+    scanned = stats["scanned_bytes"]
+    if scanned > SCAN_JUMP_MIN_BYTES and scanned > median * SCAN_JUMP_FACTOR:
+        logger.warning(
+            f"Athena query {stats['label']} scanned {scanned / 1024**2:.1f} MiB, "
+            f"{scanned / max(median, 1):.1f} times the median of its last "
+            f"{len(previous)} runs ({median / 1024**2:.1f} MiB)"
+        )
+        run_metrics.add("athena_scan_jumps", 1)
+
+
+def record_query(label: str, execution: dict, history_path: str = None) -> dict:
+    """Adds a finished query's statistics to the run metrics, the log and the
+    history file"""
+    stats = query_stats(label, execution)
+    run_metrics.add("athena_engine_ms", stats["engine_ms"])
+    run_metrics.add("athena_queue_ms", stats["queue_ms"])
+    run_metrics.add("athena_scanned_bytes", stats["scanned_bytes"])
+    logger.info(
+        f"Athena query {label} {stats['state']}: "
+        f"{stats['engine_ms']} ms running, {stats['queue_ms']} ms queued, "
+        f"{stats['scanned_bytes']} bytes scanned, results in {stats['output_location']}"
+    )
+    if history_path:
+        check_scan_jump(stats, read_history(history_path, label))
+        append_history(history_path, stats)
+    return stats
+
+
+@lru_cache(maxsize=None)
+def athena_client(region_name: str):
+    return boto3.client("athena", region_name=region_name)
+
+
+@lru_cache(maxsize=None)
+def workgroup_output_location(workgroup: str, region_name: str) -> str:
+    """The workgroup's results location, or None if it doesn't have one"""
+    with run_metrics.call("athena", "get_work_group"):
+        config = athena_client(region_name).get_work_group(WorkGroup=workgroup)["WorkGroup"]
+    return config.get("Configuration", {}).get("ResultConfiguration", {}).get(
+        "OutputLocation"
+    )
+
+
+def start_query(query_string: str, workgroup: str = None, region_name: str = "eu-west-1") -> str:
+    """Starts a query in `workgroup` (None for Athena's default) and returns
+    its execution id"""
+    if workgroup_output_location(workgroup or DEFAULT_WORKGROUP, region_name) is None:
+        import awswrangler as wr
+
+        return wr.athena.start_query_execution(sql=query_string, workgroup=workgroup)
+    kwargs = {"WorkGroup": workgroup} if workgroup else {}
+    return athena_client(region_name).start_query_execution(
+        QueryString=query_string, **kwargs
+    )["QueryExecutionId"]
+
+
+def wait_for_query(query_exec_id: str, region_name: str = "eu-west-1") -> dict:
+    """Polls a query until it finishes, and returns get_query_execution's
+    response"""
+    while True:
+        execution = athena_client(region_name).get_query_execution(
+            QueryExecutionId=query_exec_id
+        )["QueryExecution"]
+        if execution["Status"]["State"] in FINAL_STATES:
+            return execution
+        time.sleep(POLL_SECONDS)
+
+
+def run_athena_query(query_string: str, label: str = None, workgroup: str = None) -> dict:
+    """Runs an Athena query and waits for it to finish
+
+    Parameters
+    ----------
+    query_string :
+        SQL to run
+    label : optional
+        Name the query is recorded under, by default from query_label
+    workgroup : optional
+        Workgroup to run the query in, by default the configured one
+
+    Returns
+    -------
+        get_query_execution's response for the query
+    """
+    region_name = settings["region_name"]
+    workgroup = workgroup or settings["workgroup"]
+    os.environ["AWS_DEFAULT_REGION"] = region_name
+    label = label or query_label(query_string)
+    with run_metrics.call("athena", "query") as call:
+        resp = wait_for_query(
+            start_query(query_string, workgroup, region_name), region_name
+        )
+        call["bytes"] = record_query(label, resp, settings["history_path"])["scanned_bytes"]
+        status = resp["Status"]
+        if status["State"] != "SUCCEEDED":
+            raise AthenaQueryFailed(
+                f"Athena query {label} {status['State']}: {status.get('StateChangeReason')}"
+            )
+    return resp
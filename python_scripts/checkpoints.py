@@ -0,0 +1,165 @@
+"""
+Page-level checkpoints for the bookings scrape.
+
+Every page fetched from the API is saved, gzipped, under a checkpoint folder
+for the scrape date. A manifest, written once before the first page, holds
+the parameters of the scrape and when it started. If the task fails part way
+through a busy day, the Airflow retry lists the pages already in the folder,
+reads them from the checkpoints and only asks the API for the ones that are
+missing. The folder is removed once the raw file has been written.
+
+Checkpoints are only for retrying a failed attempt: the bookings of a day can
+still change after it has been scraped. A folder whose manifest is older than
+`max_age`, was made with different parameters (e.g. a different page size or
+window length) or is missing is emptied before the first new page is saved,
+so its pages are fetched again.
+"""
+import gzip
+import os
+import shutil
+import threading
+from datetime import datetime, timedelta, timezone
+
+from botocore.exceptions import ClientError
+
+from fast_json import dumps, loads
+from s3_utils import (
+    delete_all_matching_s3_objects,
+    get_matching_s3_keys,
+    read_bytes_from_s3,
+    s3_path_to_bucket_key,
+    write_bytes_to_s3,
+)
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+
+def _read(path: str) -> bytes:
+    """Reads a local or s3 file, or returns None if it doesn't exist"""
+    try:
+        if path.startswith("s3://"):
+            return read_bytes_from_s3(path)
+        with open(path, "rb") as f:
+            return f.read()
+    except (FileNotFoundError, ClientError):
+        return None
+
+
+def _write(path: str, body: bytes):
+    if path.startswith("s3://"):
+        write_bytes_to_s3(path, body)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(body)
+
+
+def _list_names(root: str, prefix: str, suffix: str) -> list[str]:
+    """Names of the files in a local or s3 folder with the prefix and suffix"""
+    if root.startswith("s3://"):
+        bucket, key = s3_path_to_bucket_key(root)
+        folder = f"{key}/"
+        keys = get_matching_s3_keys(bucket, prefix=f"{folder}{prefix}", suffix=suffix)
+        return [k[len(folder):] for k in keys]
+    if not os.path.isdir(root):
+        return []
+    return [n for n in os.listdir(root) if n.startswith(prefix) and n.endswith(suffix)]
+
+
+def page_key(time_from: str, time_to: str, page_num: int) -> str:
+    """Name of a page's checkpoint, safe to use in a file name"""
+    return f"{time_from}_{time_to}_{page_num}".replace(":", "")
+
+
+class PageCheckpoints:
+    """
+    Parameters
+    ----------
+    root :
+        Local directory or s3 prefix for this scrape's checkpoints
+    params :
+        What the pages depend on, stored in the manifest
+    max_age :
+        Age past which the pages of an earlier attempt aren't reused
+    """
+
+    def __init__(self, root: str, params: dict, max_age: timedelta = timedelta(hours=12)):
+        self.root = root.rstrip("/")
+        self.params = params
+        self.max_age = max_age
+        self.pages = set()
+        self._started = False
+        self._lock = threading.Lock()
+        self._load()
+
+    @property
+    def manifest_path(self) -> str:
+        return f"{self.root}/manifest.json"
+
+    def _page_path(self, key: str) -> str:
+        return f"{self.root}/page-{key}.json.gz"
+
+    def _load(self):
+        body = _read(self.manifest_path)
+        if body is None:
+            return
+        manifest = loads(body)
+        if manifest.get("params") != self.params:
+            logger.info(
+                f"Ignoring checkpoints in {self.root}, they were made with "
+                f"{manifest.get('params')} rather than {self.params}"
+            )
+            return
+        # Manifests from before created_at was stored count as expired
+        created_at = manifest.get("created_at", "1970-01-01T00:00:00+00:00")
+        age = datetime.now(timezone.utc) - datetime.fromisoformat(created_at)
+        if age > self.max_age:
+            logger.info(f"Ignoring checkpoints in {self.root}, they are {age} old")
+            return
+        self.pages = {
+            name[len("page-"):-len(".json.gz")]
+            for name in _list_names(self.root, "page-", ".json.gz")
+        }
+        self._started = True
+        logger.info(f"Resuming from {len(self.pages)} checkpointed pages in {self.root}")
+
+    def _start(self):
+        """Empties the folder of an earlier attempt that can't be reused and
+        writes this scrape's manifest"""
+        self.clear()
+        manifest = {
+            "params": self.params,
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        }
+        _write(self.manifest_path, dumps(manifest))
+        self._started = True
+
+    def get(self, key: str) -> list:
+        """The records of a checkpointed page, or None if it isn't there"""
+        if key not in self.pages:
+            return None
+        body = _read(self._page_path(key))
+        if body is None:
+            logger.warning(f"Checkpoint {key} is in the manifest but missing")
+            return None
+        return loads(gzip.decompress(body))
+
+    def put(self, key: str, records: list):
+        """Saves a page, writing the manifest first if it's the first one"""
+        with self._lock:
+            if not self._started:
+                self._start()
+        _write(self._page_path(key), gzip.compress(dumps(records)))
+        with self._lock:
+            self.pages.add(key)
+
+    def clear(self):
+        """Removes the checkpoints once they are no longer needed"""
+        if self.root.startswith("s3://"):
+            bucket, prefix = s3_path_to_bucket_key(self.root)
+            delete_all_matching_s3_objects(bucket, prefix=f"{prefix}/")
+        else:
+            shutil.rmtree(self.root, ignore_errors=True)
+        self.pages = set()
@@ -0,0 +1,337 @@
+"""
+Compacts the daily scrape_date partitions of closed months into one large,
+sorted parquet file per month.
+
+Compacted months live in a `{table}_compacted` table partitioned by
+`scrape_month`, whose files keep `scrape_date` as an ordinary column. Each
+compaction writes a new version of the month under
+`{table}_compacted/scrape_month=YYYY-MM/v={version}/`, then repoints the Glue
+partition at it, so readers see either the old or the new version, never a
+mix.
+
+The first compaction of a table moves its daily partitions to a
+`{table}_daily` table, with the same location, and replaces `{table}` with a
+view of the compacted months and the daily partitions of the months that
+haven't been compacted. Queries of `{table}` keep seeing every day, and the
+pipeline writes and registers new days in `{table}_daily` from then on (see
+functions/table_locations.py). The name is missing for the moment between
+dropping the table and creating the view, so run the first compaction outside
+the pipeline's schedule.
+
+Usage:
+    # Compact the month containing --scrape_date
+    python python_scripts/compaction.py --env prod --scrape_date 2024-01-01
+
+    # Reload a single day of a compacted month from the pass folder
+    python python_scripts/compaction.py --env prod --scrape_date 2024-01-15 --reload-day
+"""
+import re
+from datetime import datetime
+
+import awswrangler as wr
+import boto3
+import pandas as pd
+from arrow_pd_parser import caster
+from mojap_metadata import Metadata
+from mojap_metadata.converters.glue_converter import GlueConverter
+
+import athena
+from athena import run_athena_query
+from constants import (
+    athena_history_path,
+    athena_workgroup,
+    db_location,
+    db_name,
+    meta_path_bookings,
+    meta_path_locations,
+    region_name,
+)
+from functions.data_validation import (
+    list_s3_files,
+    read_cleaned_data,
+    read_and_write_cleaned_data,
+)
+from functions.general_helpers import get_command_line_arguments
+from functions.parquet_helpers import read_parquet_options, write_parquet
+from functions.table_locations import (
+    compacted_table_name,
+    daily_table,
+    get_compacted_partition,
+    partition_folder,
+    table_root,
+)
+from glue_schema import get_table, migrate_table, table_input
+from metrics import run_metrics
+from s3_utils import delete_all_matching_s3_objects, s3_path_to_bucket_key
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+META_PATH = {
+    "bookings": meta_path_bookings,
+    "locations": meta_path_locations,
+}
+
+# Compacted files hold a month of data, so use bigger row groups than the daily files
+COMPACTED_ROW_GROUP_SIZE = 1_048_576
+
+glue_client = boto3.client("glue", region_name=region_name)
+
+athena.configure(
+    region_name=region_name,
+    workgroup=athena_workgroup,
+    history_path=athena_history_path,
+)
+
+
+def compacted_location(table: str) -> str:
+    return f"{db_location}/{compacted_table_name(table)}"
+
+
+def compacted_metadata(table: str) -> Metadata:
+    """The table's metadata with a scrape_month partition added"""
+    metadata = Metadata.from_json(META_PATH[table])
+    metadata.name = compacted_table_name(table)
+    metadata.update_column(
+        {
+            "name": "scrape_month",
+            "type": "string",
+            "description": "Month (YYYY-MM) of the scrape dates in this partition",
+        }
+    )
+    metadata.partitions = ["scrape_month"]
+    return metadata
+
+
+def move_to_daily_table(table: str, live: dict):
+    """Moves the table `table` and its partitions to `{table}_daily`, leaving
+    the data where it is
+
+    Each step can be repeated, so a move that failed part way through is
+    finished by the next compaction.
+    """
+    daily = f"{table}_daily"
+    if get_table(glue_client, db_name, daily) is None:
+        with run_metrics.call("glue", "create_table"):
+            glue_client.create_table(
+                DatabaseName=db_name, TableInput={**table_input(live), "Name": daily}
+            )
+    partitions = [
+        {
+            key: value
+            for key, value in partition.items()
+            if key in ("Values", "StorageDescriptor", "Parameters")
+        }
+        for page in glue_client.get_paginator("get_partitions").paginate(
+            DatabaseName=db_name, TableName=table
+        )
+        for partition in page["Partitions"]
+    ]
+    # Partitions that were already moved are reported back, not raised
+    for i in range(0, len(partitions), 100):
+        with run_metrics.call("glue", "batch_create_partition"):
+            glue_client.batch_create_partition(
+                DatabaseName=db_name,
+                TableName=daily,
+                PartitionInputList=partitions[i:i + 100],
+            )
+    with run_metrics.call("glue", "delete_table"):
+        glue_client.delete_table(DatabaseName=db_name, Name=table)
+    daily_table.cache_clear()
+    table_root.cache_clear()
+    logger.info(f"Moved {db_name}.{table} and {len(partitions)} partitions to {daily}")
+
+
+def ensure_compacted_table(table: str):
+    """Creates or migrates the compacted table, and makes `{table}` a view of
+    the compacted months and the daily partitions"""
+    metadata = compacted_metadata(table)
+    migrate_table(
+        GlueConverter().generate_from_meta(
+            metadata, database_name=db_name, table_location=compacted_location(table)
+        ),
+        glue_client=glue_client,
+    )
+    live = get_table(glue_client, db_name, table)
+    if live is not None and live.get("TableType") != "VIRTUAL_VIEW":
+        move_to_daily_table(table, live)
+
+    columns = ", ".join(
+        f'"{name}"' for name in Metadata.from_json(META_PATH[table]).column_names
+    )
+    run_athena_query(
+        f"""create or replace view {db_name}.{table} as
+        select {columns} from {db_name}.{daily_table(table)}
+        where substr(cast(scrape_date as varchar), 1, 7) not in (
+            select scrape_month from "{db_name}"."{metadata.name}$partitions"
+        )
+        union all
+        select {columns} from {db_name}.{metadata.name}"""
+    )
+
+
+def daily_files_for_month(table: str, month: str) -> dict:
+    """Maps each scrape_date in the month to its daily parquet files"""
+    files = list_s3_files(f"{table_root(table)}/")
+    days = {}
+    for file in files:
+        match = re.search(r"scrape_date=(\d{4}-\d{2}-\d{2})/", file)
+        if match and match.group(1).startswith(month):
+            days.setdefault(match.group(1), []).append(file)
+    return days
+
+
+def read_parquet_files(files: list[str], metadata: Metadata) -> pd.DataFrame:
+    """Reads parquet files one at a time, so files written with older schemas
+    are aligned to the metadata rather than failing the read."""
+    frames = []
+    for file in files:
+        with run_metrics.call("s3", "get"):
+            frames.append(wr.s3.read_parquet(file).reindex(columns=metadata.column_names))
+    if not frames:
+        return pd.DataFrame(columns=metadata.column_names)
+    return pd.concat(frames, ignore_index=True)
+
+
+def write_compacted_version(table: str, month: str, df: pd.DataFrame) -> str:
+    """Writes a month to a new version folder and returns the folder"""
+    metadata = Metadata.from_json(META_PATH[table])
+    options = read_parquet_options(META_PATH[table])
+    options["sort_by"] = ["scrape_date"] + list(options.get("sort_by") or [])
+    options["row_group_size"] = COMPACTED_ROW_GROUP_SIZE
+
+    df = caster.cast_pandas_table_to_schema(df, metadata)
+    version = datetime.now().strftime("%Y%m%dT%H%M%S")
+    folder = f"{compacted_location(table)}/scrape_month={month}/v={version}/"
+    write_parquet(df, f"{folder}part-0.parquet", metadata, options)
+    run_metrics.add_rows(len(df))
+    logger.info(f"Wrote {len(df)} rows of {table} for {month} to {folder}")
+    return folder
+
+
+def swap_compacted_partition(table: str, month: str, folder: str, existing: dict):
+    """Points the month's partition at the new version in one Glue call"""
+    with run_metrics.call("glue", "get_table"):
+        table_sd = glue_client.get_table(
+            DatabaseName=db_name, Name=compacted_table_name(table)
+        )["Table"]["StorageDescriptor"]
+    partition_input = {
+        "Values": [month],
+        "StorageDescriptor": {**table_sd, "Location": folder},
+    }
+    if existing is None:
+        with run_metrics.call("glue", "create_partition"):
+            glue_client.create_partition(
+                DatabaseName=db_name,
+                TableName=compacted_table_name(table),
+                PartitionInput=partition_input,
+            )
+    else:
+        with run_metrics.call("glue", "update_partition"):
+            glue_client.update_partition(
+                DatabaseName=db_name,
+                TableName=compacted_table_name(table),
+                PartitionValueList=[month],
+                PartitionInput=partition_input,
+            )
+    logger.info(f"{compacted_table_name(table)} {month} now reads from {folder}")
+
+
+def delete_folder(folder: str):
+    bucket, prefix = s3_path_to_bucket_key(folder)
+    with run_metrics.call("s3", "delete"):
+        delete_all_matching_s3_objects(bucket, prefix)
+
+
+def drop_daily_partitions(table: str, days: dict):
+    """Removes compacted days from the daily table, catalog first so the
+    `{table}` view never sees a day twice."""
+    values = [{"Values": [day]} for day in sorted(days)]
+    for i in range(0, len(values), 25):
+        with run_metrics.call("glue", "batch_delete_partition"):
+            glue_client.batch_delete_partition(
+                DatabaseName=db_name,
+                TableName=daily_table(table),
+                PartitionsToDelete=values[i:i + 25],
+            )
+    for day in days:
+        delete_folder(f"{partition_folder(table, day)}/")
+
+
+def compact_month(table: str, month: str):
+    """Compacts the daily partitions of a closed month into one file
+
+    Days still in the daily table replace any rows for the same day already in
+    the compacted month, so a month can be compacted again after late
+    reloads.
+
+    Parameters
+    ----------
+    table :
+        Table name, bookings or locations
+    month :
+        Month to compact, as YYYY-MM
+    """
+    if month >= datetime.now().strftime("%Y-%m"):
+        raise ValueError(f"{month} is not a closed month, refusing to compact it")
+
+    ensure_compacted_table(table)
+    metadata = Metadata.from_json(META_PATH[table])
+    days = daily_files_for_month(table, month)
+    existing = get_compacted_partition(table, month)
+    if not days:
+        logger.info(f"No daily {table} partitions to compact for {month}")
+        return
+
+    df = read_parquet_files([f for files in days.values() for f in files], metadata)
+    if existing is not None:
+        previous = read_parquet_files(
+            list_s3_files(existing["StorageDescriptor"]["Location"]), metadata
+        )
+        kept = ~previous["scrape_date"].astype(str).str[:10].isin(days)
+        df = pd.concat([previous[kept], df], ignore_index=True)
+
+    folder = write_compacted_version(table, month, df)
+    swap_compacted_partition(table, month, folder, existing)
+    drop_daily_partitions(table, days)
+    if existing is not None:
+        delete_folder(existing["StorageDescriptor"]["Location"])
+
+
+def reload_day(table: str, scrape_date: str):
+    """Reloads one day from the pass folder
+
+    If the day's month has been compacted, the month is rewritten with that
+    day's rows replaced and swapped in. Otherwise the day is written to the
+    daily table as usual.
+    """
+    month = scrape_date[:7]
+    existing = get_compacted_partition(table, month)
+    if existing is None:
+        read_and_write_cleaned_data(scrape_date, table)
+        return
+
+    metadata = Metadata.from_json(META_PATH[table])
+    day_df, _ = read_cleaned_data(scrape_date, table)
+    previous = read_parquet_files(
+        list_s3_files(existing["StorageDescriptor"]["Location"]), metadata
+    )
+    kept = previous["scrape_date"].astype(str).str[:10] != scrape_date
+    df = pd.concat([previous[kept], day_df], ignore_index=True)
+
+    folder = write_compacted_version(table, month, df)
+    swap_compacted_partition(table, month, folder, existing)
+    delete_folder(existing["StorageDescriptor"]["Location"])
+
+
+if __name__ == "__main__":
+    args = get_command_line_arguments()
+    scrape_date = datetime.strptime(args.scrape_date, "%Y-%m-%d").strftime("%Y-%m-%d")
+    for table in ["bookings", "locations"]:
+        with run_metrics.step(f"compaction_{table}"):
+            if args.reload_day:
+                reload_day(table, scrape_date)
+            else:
+                compact_month(table, args.compact_month or scrape_date[:7])
+    run_metrics.emit(args.metrics_path, args.prometheus_textfile, args.statsd)
@@ -1,17 +1,39 @@
+import os
 from functions.general_helpers import get_command_line_arguments
 from dateutil.parser import parse
 
 # Get command line arguments
 args = get_command_line_arguments()
 
+
+def env_paths(env: str) -> dict:
+    """Database, bucket and metadata locations for an environment"""
+    suffix = "" if env == "prod" else f"-{env}"
+    db_location = f"s3://alpha-dag-matrix/db/{env}"
+    land_bucket = f"mojap-land{suffix}"
+    return {
+        "env": env,
+        "db_name": f"matrix_{env}",
+        "db_location": db_location,
+        "meta_path_bookings": f"metadata/{env}/bookings.json",
+        "meta_path_locations": f"metadata/{env}/locations.json",
+        "meta_path_joined_rooms": f"metadata/{env}/joined_rooms.json",
+        "land_bucket": land_bucket,
+        "land_location": f"s3://{land_bucket}/corporate/matrix",
+        "raw_hist_bucket": f"mojap-raw-hist{suffix}",
+    }
+
+
+paths = env_paths(args.env)
+
 """ 
 Database constants 
 """
 
 # Database name
-db_name = f"matrix_{args.env}"
+db_name = paths["db_name"]
 
-db_location = f"s3://alpha-dag-matrix/db/{args.env}"
+db_location = paths["db_location"]
 
 region_name = "eu-west-1"
 
@@ -21,30 +43,70 @@ Database tables
 
 # Bookings
 
-meta_path_bookings = f"metadata/{args.env}/bookings.json"
+meta_path_bookings = paths["meta_path_bookings"]
 table_location_bookings = f"{db_location}/bookings"
 column_renames = ""
 
 # Locations
-meta_path_locations = f"metadata/{args.env}/locations.json"
+meta_path_locations = paths["meta_path_locations"]
 table_location_locations = f"{db_location}/locations"
 
 # Joined rooms
-meta_path_joined_rooms = f"metadata/{args.env}/joined_rooms.json"
+meta_path_joined_rooms = paths["meta_path_joined_rooms"]
 table_location_joined_rooms = f"{db_location}/joined_rooms"
 
 """paths"""
-suffix = "" if args.env == "prod" else f"-{args.env}"
 
 # Land locations
-land_bucket = f"mojap-land{suffix}"
-land_location = f"s3://{land_bucket}/corporate/matrix"
+land_bucket = paths["land_bucket"]
+land_location = paths["land_location"]
 
 # Raw history locations
-raw_hist_bucket = f"mojap-raw-hist{suffix}"
+raw_hist_bucket = paths["raw_hist_bucket"]
+
+# Pages of an unfinished scrape. Kept out of land, where they would be taken
+# for raw files waiting to be validated
+checkpoint_location = (
+    args.checkpoint_path or f"s3://{raw_hist_bucket}/corporate/matrix/checkpoints"
+).rstrip("/")
+
+# Matrix API
+api_url = args.api_url.rstrip("/")
+
+# Recorded API responses
+response_cache_mode = args.response_cache
+response_cache_path = (
+    args.response_cache_path or f"s3://{raw_hist_bucket}/corporate/matrix/api_cache"
+)
 
 """parsed args"""
 
 scrape_date = parse(args.scrape_date).strftime("%Y-%m-%d")
 env = args.env
 function_to_run = args.function
+locations_mode = args.locations_mode
+conditional_locations = bool(args.conditional_locations)
+normaliser = args.normaliser
+booking_window_hours = args.booking_window_hours
+scrape_workers = args.scrape_workers
+max_request_rate = args.max_request_rate
+use_checkpoints = args.checkpoints
+checkpoint_max_age_hours = args.checkpoint_max_age_hours
+validator = args.validator
+clean_batch_rows = args.clean_batch_rows
+fan_out_envs = args.fan_out_envs
+skip_scrape = bool(args.skip_scrape)
+
+"""metrics"""
+
+metrics_path = args.metrics_path
+prometheus_textfile = args.prometheus_textfile
+statsd_address = args.statsd
+athena_history_path = args.athena_history
+athena_workgroup = args.athena_workgroup or os.environ.get("ATHENA_WORKGROUP")
+
+"""profiling"""
+
+profile = bool(args.profile)
+profile_output = f"{args.profile_output.rstrip('/')}/{env}/{scrape_date}"
+profile_top = args.profile_top
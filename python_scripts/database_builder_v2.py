@@ -9,6 +9,10 @@ from typing import Optional
 from logging import getLogger
 
 from functions.general_helpers import get_command_line_arguments
+from functions.table_locations import daily_table
+from glue_schema import migrate_tables
+from metrics import run_metrics
+from profiling import maybe_profile
 
 from constants import (
     db_name,
@@ -487,7 +491,8 @@ def delete_database_data(db_path):
 
     # Delete all objects in path
     logger.info(f"Deleting objects with path '{db_path}'")
-    wr.s3.delete_objects(db_path)
+    with run_metrics.call("s3", "delete"):
+        wr.s3.delete_objects(db_path)
 
 
 def rebuild_database(
@@ -510,7 +515,8 @@ def rebuild_database(
     # Try to delete the database
     try:
         # Delete database
-        wr.catalog.delete_database(name=database_name)
+        with run_metrics.call("glue", "delete_database"):
+            wr.catalog.delete_database(name=database_name)
         logger.info(f"Delete database {database_name}")
 
         # Optionally delete underlying data
@@ -531,7 +537,8 @@ def rebuild_database(
     if rename_db:
         database_name=rename_db
     logger.info(f"Add database '{database_name}' to Glue catalog")
-    wr.catalog.create_database(name=database_name, exist_ok=True)
+    with run_metrics.call("glue", "create_database"):
+        wr.catalog.create_database(name=database_name, exist_ok=True)
 
 
 if __name__ == "__main__":
@@ -567,16 +574,42 @@ if __name__ == "__main__":
     # Client
     glue_client = boto3.client("glue", region_name='eu-west-1')
 
-    # Delete and re-create database
-    rebuild_database(database_name="matrix_prod", rename_db=db_name)
+    profile_output = f"{args.profile_output.rstrip('/')}/{args.env}/database_builder_v2"
 
-    # Bookings table
-    glue_client.create_table(**schema_bookings)
+    if args.migrate:
+        # Update the existing tables in place, keeping their partitions. Once
+        # compaction has made a table's name a view, the daily partitions are
+        # in {table}_daily
+        for schema in (schema_bookings, schema_locations):
+            schema["TableInput"]["Name"] = daily_table(schema["TableInput"]["Name"])
+        with run_metrics.step("migrate_tables"):
+            if not args.dry_run:
+                with run_metrics.call("glue", "create_database"):
+                    wr.catalog.create_database(name=db_name, exist_ok=True)
+            migrate_tables(
+                [schema_bookings, schema_locations],
+                dry_run=bool(args.dry_run),
+                glue_client=glue_client,
+            )
+    else:
+        # Delete and re-create database
+        with maybe_profile("rebuild_database", args.profile, profile_output, args.profile_top):
+            rebuild_database(database_name="matrix_prod", rename_db=db_name)
 
-    # Locations table
-    glue_client.create_table(**schema_locations)
+            # Bookings table
+            with run_metrics.call("glue", "create_table") as call:
+                resp = glue_client.create_table(**schema_bookings)
+                call["retries"] = resp["ResponseMetadata"].get("RetryAttempts", 0)
 
-    # Joined rooms
-    # glue_client.create_table(**schema_joined_rooms)
+            # Locations table
+            with run_metrics.call("glue", "create_table") as call:
+                resp = glue_client.create_table(**schema_locations)
+                call["retries"] = resp["ResponseMetadata"].get("RetryAttempts", 0)
 
-    #rebuild_all_s3_data_from_raw()
+            # Joined rooms
+            # glue_client.create_table(**schema_joined_rooms)
+
+    # with maybe_profile("rebuild_all_s3_data_from_raw", args.profile, profile_output, args.profile_top):
+    #     rebuild_all_s3_data_from_raw()
+
+    run_metrics.emit(args.metrics_path, args.prometheus_textfile, args.statsd)
@@ -0,0 +1,91 @@
+"""
+Runs the steps after the scrape in several environments at once.
+
+With --fan-out-envs, main.py scrapes the API once and writes the raw files
+into each environment's land bucket (`scrape_and_write_raw_data_to_envs`).
+Everything after that (validation, cleaning, partitions) depends on the
+environment through `constants`, so each environment's steps are run by a
+child `main.py --env {env} --skip-scrape` process, in parallel. The children
+get the same options as the parent, and their metrics files get the
+environment added to their names.
+"""
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from constants import fan_out_envs
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+MAIN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "main.py")
+
+# Options the parent sets differently for each child, and how many values they take
+ENV_OPTIONS = {"--env": 1, "-e": 1, "--fan-out-envs": None, "--skip-scrape": 0}
+PER_ENV_FILES = ("--metrics-path", "--prometheus-textfile")
+
+
+def _with_env(path: str, env: str) -> str:
+    root, ext = os.path.splitext(path)
+    return f"{root}-{env}{ext}"
+
+
+def child_argv(argv: list[str], env: str) -> list[str]:
+    """The parent's command line arguments, for the child running `env`"""
+    child = []
+    i = 0
+    while i < len(argv):
+        arg = argv[i]
+        name, has_value, value = arg.partition("=")
+        if name in ENV_OPTIONS:
+            n_values = ENV_OPTIONS[name]
+            i += 1
+            if has_value:
+                continue
+            if n_values is None:
+                while i < len(argv) and not argv[i].startswith("-"):
+                    i += 1
+            else:
+                i += n_values
+            continue
+        if name in PER_ENV_FILES:
+            if not has_value:
+                i += 1
+                value = argv[i]
+            child.append(f"{name}={_with_env(value, env)}")
+        else:
+            child.append(arg)
+        i += 1
+    return child + ["--env", env, "--skip-scrape"]
+
+
+def run_in_env(env: str, argv: list[str]) -> int:
+    """Runs the steps after the scrape for one environment, and returns the
+    child's exit code"""
+    command = [sys.executable, MAIN_PATH] + child_argv(argv, env)
+    logger.info(f"Running {' '.join(command)}")
+    return subprocess.run(command).returncode
+
+
+def run_steps_in_envs(scrape_date: str, envs=None, argv=None):
+    """Runs the steps after the scrape for each environment in parallel
+
+    Parameters
+    ----------
+    scrape_date :
+        Date being processed. Only used for logging, the children get it
+        from the command line
+    envs : optional
+        Environments to run, by default --fan-out-envs
+    argv : optional
+        Command line to pass on, by default this process's
+    """
+    envs = envs or fan_out_envs
+    argv = sys.argv[1:] if argv is None else argv
+    with ThreadPoolExecutor(max_workers=len(envs)) as executor:
+        codes = dict(zip(envs, executor.map(lambda env: run_in_env(env, argv), envs)))
+    failed = [env for env, code in codes.items() if code != 0]
+    assert not failed, logger.error(f"Steps for {scrape_date} failed in {failed}")
+    logger.info(f"Steps for {scrape_date} finished in {envs}")
@@ -0,0 +1,62 @@
+"""
+JSON encoding and decoding with orjson when it's installed, falling back to
+the standard library otherwise.
+
+orjson parses straight from bytes and is several times faster than `json`
+on the Matrix responses and raw JSONL files. Both backends give the same
+Python objects, so callers don't need to know which one is in use.
+"""
+import json
+import math
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+BACKEND = "orjson" if orjson is not None else "json"
+
+
+def loads(data):
+    """Parses a JSON document from bytes or str"""
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, (bytes, bytearray, memoryview)):
+        data = bytes(data).decode("utf-8")
+    return json.loads(data)
+
+
+def _clean(value):
+    # NaN is not valid JSON, write it as null like pandas does
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def dumps(obj, default=None) -> bytes:
+    """Serialises an object to UTF-8 JSON bytes, without whitespace.
+
+    `default` is called for objects neither backend can serialise natively
+    and should return something that can be.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj, default=default)
+    if isinstance(obj, dict):
+        obj = {key: _clean(value) for key, value in obj.items()}
+    return json.dumps(
+        obj, default=default, separators=(",", ":"), ensure_ascii=False
+    ).encode("utf-8")
+
+
+def loads_lines(body: bytes) -> list:
+    """Parses JSON lines, skipping blank lines"""
+    return [loads(line) for line in body.splitlines() if line.strip()]
+
+
+def dumps_lines(records, default=None) -> bytes:
+    """Serialises an iterable of objects to JSON lines"""
+    return b"".join(dumps(record, default=default) + b"\n" for record in records)
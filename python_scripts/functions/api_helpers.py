@@ -1,12 +1,19 @@
 import requests
-import json
 import pandas as pd
 import re
 import s3_utils as s3_utils
+from fast_json import loads
+from metrics import run_metrics
+from rate_limit import matrix_limiter
+from response_cache import matrix_cache
 from logging import getLogger
 
 logger = getLogger(__name__)
 
+# Responses that mean the API wants us to slow down
+RETRY_STATUSES = (429, 503)
+MAX_RETRIES = 5
+
 
 def read_json(file_path: str) -> dict:
     """Reads a json file in as a dictionary
@@ -21,20 +28,26 @@ def read_json(file_path: str) -> dict:
         dictionary representing the json file
     """
     f = open(file_path)
-    return json.loads(f.read())
+    return loads(f.read())
 
 
 def get_secrets() -> dict:
     return s3_utils.read_json_from_s3("alpha-dag-matrix/api_secrets/secrets.json")
 
 
-def matrix_authenticate(session: requests.Session) -> requests.Session:
+def matrix_authenticate(
+    session: requests.Session,
+    url: str = "https://app.matrixbooking.com/api/v1/user/login",
+) -> requests.Session:
+    if matrix_cache.replaying:
+        logger.info("Replaying cached responses, not logging in")
+        return session
     secrets = get_secrets()
     username = secrets["username"]
     password = secrets["password"]
 
-    url = "https://app.matrixbooking.com/api/v1/user/login"
-    session.post(url, json={"username": username, "password": password})
+    with run_metrics.call("matrix", "login"):
+        session.post(url, json={"username": username, "password": password})
     return session
 
 
@@ -54,31 +67,164 @@ def make_booking_params(
     return params
 
 
-def extract_locations(json_list):
-    all_locations = []
+def flatten_record(record: dict, sep: str = "_", skip: tuple = ()) -> dict:
+    """Flattens nested dictionaries into one level, joining keys with `sep`
+    the same way pd.json_normalize does. Lists are left as they are.
+
+    Parameters
+    ----------
+    record :
+        Possibly nested dictionary
+    sep : optional
+        Separator between parent and child keys, by default "_"
+    skip : optional
+        Top-level keys to leave out
+
+    Returns
+    -------
+        Flat dictionary
+    """
+    flat = {}
+    stack = [("", record)]
+    while stack:
+        prefix, value = stack.pop()
+        for key, item in value.items():
+            if not prefix and key in skip:
+                continue
+            name = f"{prefix}{sep}{key}" if prefix else key
+            if isinstance(item, dict):
+                # Empty dictionaries produce no columns, as in pd.json_normalize
+                if item:
+                    stack.append((name, item))
+            else:
+                flat[name] = item
+    return flat
+
+
+def iter_locations(json_list: list[dict]):
+    """Walks the location hierarchy and yields one flat record per location
+
+    The top-level entries of the response are not yielded themselves, only
+    the locations nested under them. Each record has the `locations` array of
+    its children and the nested `organisation` dropped (`organisationId` is
+    kept), `parentId` filled in from the hierarchy if the API didn't supply
+    it, and a `depth` (1 for the top-level entries' children).
+    The walk uses an explicit stack rather than recursion, and doesn't modify
+    the input.
 
-    for json_data in json_list:
-        extract_locations_recursive(json_data, all_locations)
+    Parameters
+    ----------
+    json_list :
+        Response from the org locations endpoint
 
-    for json_data in json_list:
-        if "organisation" in json_data:
-            del json_data["organisationId"]
+    Yields
+    ------
+        Flat location records in the same (depth-first) order as the API
+    """
+    stack = [
+        (location, parent.get("id"), 1)
+        for parent in reversed(json_list)
+        for location in reversed(parent.get("locations") or [])
+    ]
+    while stack:
+        location, parent_id, depth = stack.pop()
+        record = flatten_record(location, skip=("locations", "organisation"))
+        if record.get("parentId") is None:
+            record["parentId"] = parent_id
+        record["depth"] = depth
+        yield record
+        for child in reversed(location.get("locations") or []):
+            stack.append((child, location.get("id"), depth + 1))
+
+
+def locations_to_frame(json_list: list[dict]) -> pd.DataFrame:
+    """Builds the flattened locations dataframe column by column from
+    iter_locations, with snake case column names"""
+    columns = {}
+    n_rows = 0
+    for record in iter_locations(json_list):
+        for key, value in record.items():
+            column = columns.get(key)
+            if column is None:
+                column = columns[key] = [None] * n_rows
+            column.append(value)
+        n_rows += 1
+        for column in columns.values():
+            if len(column) < n_rows:
+                column.append(None)
+    return pd.DataFrame(
+        {camel_to_snake_case(key): values for key, values in columns.items()}
+    )
 
-    return all_locations
 
+def retry_after(resp: requests.Response, attempt: int) -> float:
+    """Seconds to wait before retrying a throttled request: the Retry-After
+    header if the API sent one in seconds, otherwise exponential backoff"""
+    header = resp.headers.get("Retry-After")
+    try:
+        return max(float(header), 0)
+    except (TypeError, ValueError):
+        return min(2**attempt, 60)
 
-def extract_locations_recursive(json_data, result):
-    if "locations" in json_data:
-        for location in json_data["locations"]:
-            result.append(location)
-            extract_locations_recursive(location, result)
 
+def get_response(
+    session,
+    url,
+    parameters,
+    headers=None,
+    limiter=matrix_limiter,
+    max_retries=MAX_RETRIES,
+    cache=matrix_cache,
+) -> tuple[int, dict, bytes]:
+    """GETs a response from the API, paced by the shared rate limiter
 
-def get_payload(session, url, parameters):
-    resp = session.get(url=url, cookies=session.cookies, params=parameters)
+    Requests rejected with a 429 or 503 are retried, after the Retry-After
+    delay, up to `max_retries` times. The retries are counted in the run
+    metrics.
+
+    When the response cache is replaying, the response is read from the
+    cache instead (with no headers), and when it is recording, successful
+    responses are saved to it.
+
+    Returns
+    -------
+        The status code, response headers and body
+    """
+    if cache.replaying:
+        with run_metrics.call("matrix", "replay") as call:
+            body = cache.get(url, parameters)
+            assert body is not None, logger.error(
+                f"No cached response for GET {url} {parameters} in {cache.root}"
+            )
+            call["bytes"] = len(body)
+        return 200, {}, body
+
+    with run_metrics.call("matrix", "get") as call:
+        for attempt in range(max_retries + 1):
+            with limiter.request() as outcome:
+                resp = session.get(
+                    url=url, cookies=session.cookies, params=parameters, headers=headers
+                )
+                outcome["throttled"] = resp.status_code in RETRY_STATUSES
+            if resp.status_code not in RETRY_STATUSES or attempt == max_retries:
+                break
+            wait = retry_after(resp, attempt)
+            logger.warning(
+                f"GET {resp.url} returned {resp.status_code}, retrying in {wait:.1f}s"
+            )
+            call["retries"] += 1
+            limiter.pause(wait)
+        call["bytes"] = len(resp.content)
     logger.debug(f"GET {resp.url}")
     logger.debug(f"response status code: {resp.status_code}")
-    return resp.json()
+    if cache.recording and resp.status_code == 200:
+        cache.put(url, parameters, resp.content)
+    return resp.status_code, resp.headers, resp.content
+
+
+def get_payload(session, url, parameters, **kwargs):
+    """GETs a JSON response from the API, see get_response"""
+    return loads(get_response(session, url, parameters, **kwargs)[2])
 
 
 def split_s3_path(s3_path: str) -> tuple[str]:
@@ -135,3 +281,99 @@ def fix_faulty_time_col(df, col):
 
     column.loc[missing_parts] = column.loc[missing_parts].apply(format_timestamp)
     return column
+
+
+def compact_column(
+    column: pd.Series, col_type: str, max_category_ratio: float = 0.5
+) -> pd.Series:
+    """Converts one column to a compact pandas dtype for its metadata type
+
+    See compact_dtypes. A column that doesn't convert cleanly is returned as
+    it is.
+    """
+    try:
+        if col_type == "bool":
+            if pd.api.types.infer_dtype(column, skipna=True) == "boolean":
+                return column.astype("boolean")
+        elif col_type.startswith("int"):
+            return column.astype(f"I{col_type[1:]}")
+        elif col_type in ("string", "large_string"):
+            n_unique = column.nunique(dropna=True)
+            if n_unique <= max_category_ratio * len(column):
+                return column.astype("category")
+            if pd.api.types.infer_dtype(column, skipna=True) == "string":
+                return column.astype("string[pyarrow]")
+    except (TypeError, ValueError) as e:
+        logger.debug(f"Leaving {column.name} as {column.dtype}: {e}")
+    return column
+
+
+def compact_dtypes(
+    df: pd.DataFrame, metadata, max_category_ratio: float = 0.5
+) -> pd.DataFrame:
+    """Shrinks the columns described in the metadata to compact pandas dtypes
+
+    bool columns become nullable booleans, integer columns nullable integers,
+    and string columns categoricals when their values repeat (at most
+    `max_category_ratio` distinct values per row), or arrow-backed strings
+    otherwise. Columns that don't convert cleanly are left as they are, so the
+    values written out are unchanged.
+
+    This only shrinks the frame from here on: the frame being converted
+    already exists, so it doesn't lower the peak. To build a frame with
+    compact dtypes in the first place, use compact_frame.
+
+    Parameters
+    ----------
+    df :
+        Dataframe to convert, modified in place
+    metadata :
+        mojap Metadata with the column types
+    max_category_ratio : optional
+        Largest ratio of distinct values to rows for a categorical, by default 0.5
+
+    Returns
+    -------
+        The converted dataframe
+    """
+    if len(df) == 0:
+        return df
+    for col in metadata.columns:
+        name = col["name"]
+        if name in df.columns:
+            df[name] = compact_column(df[name], col["type"], max_category_ratio)
+    return df
+
+
+def compact_frame(
+    columns: dict, metadata, max_category_ratio: float = 0.5
+) -> pd.DataFrame:
+    """Builds a dataframe with compact dtypes from lists of column values
+
+    Each column is converted (as in read_jsonl, then compact_column) on its
+    own, and its list is dropped from `columns` once it has been, so the
+    whole frame never exists with object dtypes.
+
+    Parameters
+    ----------
+    columns :
+        Column name to list of values, emptied as the frame is built
+    metadata :
+        mojap Metadata with the column types
+    max_category_ratio : optional
+        See compact_dtypes
+
+    Returns
+    -------
+        Dataframe with the columns in the order given
+    """
+    types = {col["name"]: col["type"] for col in metadata.columns}
+    frame = {}
+    for name in list(columns):
+        column = pd.Series(columns.pop(name), dtype=object, name=name).convert_dtypes(
+            infer_objects=True, convert_floating=False
+        )
+        if name in types and len(column):
+            column = compact_column(column, types[name], max_category_ratio)
+        frame[name] = column
+    return pd.DataFrame(frame)
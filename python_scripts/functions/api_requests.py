@@ -1,108 +1,358 @@
 import pandas as pd
 import requests
-from datetime import datetime
-from arrow_pd_parser import writer
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from mojap_metadata import Metadata
 
+from functions.jsonl_helpers import write_jsonl
+from functions.normalise import normalise_records
+from functions import locations_fingerprint
 from functions.api_helpers import (
     get_payload,
+    get_response,
     make_booking_params,
     matrix_authenticate,
-    extract_locations,
+    locations_to_frame,
     fix_faulty_time_col,
-    camel_to_snake_case,
 )
-from constants import land_location, meta_path_bookings
+from constants import (
+    api_url,
+    booking_window_hours,
+    checkpoint_location,
+    checkpoint_max_age_hours,
+    env_paths,
+    fan_out_envs,
+    land_location,
+    max_request_rate,
+    meta_path_bookings,
+    normaliser,
+    response_cache_mode,
+    response_cache_path,
+    scrape_workers,
+    use_checkpoints,
+)
 
+from fast_json import loads
 from column_renames import bookings_renames, location_renames
+from metrics import run_metrics
+from checkpoints import PageCheckpoints, page_key
+from rate_limit import matrix_limiter
+from response_cache import matrix_cache
 
 from logging import getLogger
 
 logger = getLogger(__name__)
 
+# Every request to the API in the process goes through the one limiter
+matrix_limiter.configure(
+    max_rate=max_request_rate, max_concurrency=max(scrape_workers, 1)
+)
+matrix_cache.configure(root=response_cache_path, mode=response_cache_mode)
+
+BOOKINGS_PAGE_SIZE = 2500
+
+# Bounds on the length of a booking window
+MIN_BOOKING_WINDOW = timedelta(minutes=15)
+MAX_BOOKING_WINDOW = timedelta(days=1)
+
+
+def login() -> requests.Session:
+    ses = requests.session()
+    matrix_authenticate(ses, f"{api_url}/user/login")
+    return ses
+
+
+def fetch_page(
+    ses: requests.Session,
+    url: str,
+    time_from: str,
+    time_to: str,
+    page_num: int,
+    page_size: int,
+    checkpoints: PageCheckpoints = None,
+) -> list[dict]:
+    """One page of bookings, from the checkpoints if it's there, otherwise
+    from the API (saving it to the checkpoints)"""
+    key = page_key(time_from, time_to, page_num)
+    if checkpoints is not None:
+        data = checkpoints.get(key)
+        if data is not None:
+            run_metrics.add("checkpointed_pages", 1)
+            return data
+    params = make_booking_params(
+        time_from,
+        time_to,
+        pageNum=page_num,
+        pageSize=page_size,
+    )
+    data = get_payload(ses, url, params)
+    run_metrics.add("pages", 1)
+    if checkpoints is not None:
+        checkpoints.put(key, data)
+    return data
+
+
+def scrape_window(
+    ses: requests.Session,
+    url: str,
+    time_from: str,
+    time_to: str,
+    page_size: int,
+    start_page: int = 0,
+    checkpoints: PageCheckpoints = None,
+) -> list[dict]:
+    """Pages through the bookings between `time_from` and `time_to`, from
+    `start_page` until a page comes back less than full
+
+    Returns
+    -------
+        The bookings, in the order the API returned them
+    """
+    bookings = []
+    i = start_page
+    rowcount = page_size
+    while rowcount == page_size:
+        logger.info(f"Scraping page {i} of {time_from} to {time_to}")
+        data = fetch_page(ses, url, time_from, time_to, i, page_size, checkpoints)
+        rowcount = len(data)
+        logger.info(f"Records scraped: {rowcount}")
+        bookings.extend(data)
+        i += 1
+    return bookings
+
+
+def window_counts(bookings: list[dict], time_from: str) -> tuple[int, int]:
+    """Splits a window's bookings into those that started before the window,
+    which every earlier window overlapping them also returned, and those
+    that started in it
+
+    Returns
+    -------
+        The number of bookings carried over and the number that are new
+    """
+    carried = sum(1 for booking in bookings if (booking.get("timeFrom") or "")[:16] < time_from)
+    return carried, len(bookings) - carried
+
+
+def next_window_length(results: list[tuple], page_size: int) -> timedelta:
+    """Length of the next windows, from the windows just scraped
+
+    A window returns the bookings carried over from before it plus those
+    that start in it. Windows are sized so that this fits in one page. When
+    the carried-over bookings alone fill half a page or more, making windows
+    shorter would mostly fetch the same long bookings again, so windows are
+    instead sized for one page of new bookings.
+
+    Parameters
+    ----------
+    results :
+        (window length, bookings carried over, new bookings) of each window
+        just scraped
+    page_size :
+        Rows per page
+
+    Returns
+    -------
+        The length, between MIN_BOOKING_WINDOW and MAX_BOOKING_WINDOW
+    """
+    hours = sum((length for length, _, _ in results), timedelta()) / timedelta(hours=1)
+    carried = sum(c for _, c, _ in results) / len(results)
+    new_per_hour = sum(n for _, _, n in results) / hours
+    room = page_size - carried
+    if room < page_size / 2:
+        room = page_size
+    if new_per_hour == 0:
+        return MAX_BOOKING_WINDOW
+    length = timedelta(hours=room / new_per_hour)
+    return max(MIN_BOOKING_WINDOW, min(length, MAX_BOOKING_WINDOW))
+
+
+def plan_windows(start: datetime, end: datetime, length: timedelta, n: int) -> list[tuple]:
+    """Up to `n` consecutive windows of `length` from `start`, the last one
+    ending at `end` at the latest"""
+    windows = []
+    while start < end and len(windows) < n:
+        windows.append((start, min(start + length, end)))
+        start = windows[-1][1]
+    return windows
+
+
+def scrape_windows(
+    ses: requests.Session,
+    url: str,
+    start: datetime,
+    end: datetime,
+    first_length: timedelta,
+    page_size: int,
+    max_workers: int,
+    checkpoints: PageCheckpoints = None,
+) -> list[dict]:
+    """Scrapes [start, end) in time windows, `max_workers` at a time
+
+    The windows are scraped in waves of `max_workers` consecutive windows.
+    The first wave's windows are `first_length` long, and every later wave's
+    length comes from the row counts of the wave before (next_window_length),
+    so windows grow where there are few bookings and shrink where there are
+    many, but not below the point where they would only return the same
+    long bookings again. A window whose first page is full is paged through.
+    The windows only depend on what the API returned, so a retry or a replay
+    asks for the same pages.
+
+    Bookings overlapping more than one window are returned by each of them,
+    so the results are de-duplicated by id, keeping the first window's copy.
+    The rows downloaded and the duplicates among them are added to the run
+    metrics, and the duplicate ratio is a gauge.
+    """
+    bookings = {}
+    downloaded = 0
+    n_windows = 0
+    length = first_length
+
+    def fetch(window):
+        time_from, time_to = (t.strftime("%Y-%m-%dT%H:%M") for t in window)
+        return scrape_window(
+            ses,
+            url,
+            time_from,
+            time_to,
+            page_size,
+            checkpoints=checkpoints,
+        )
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while start < end:
+            windows = plan_windows(start, end, length, max_workers)
+            wave = []
+            for window, window_bookings in zip(windows, executor.map(fetch, windows)):
+                carried, new = window_counts(
+                    window_bookings, window[0].strftime("%Y-%m-%dT%H:%M")
+                )
+                wave.append((window[1] - window[0], carried, new))
+                downloaded += len(window_bookings)
+                for booking in window_bookings:
+                    bookings.setdefault(booking["id"], booking)
+            n_windows += len(windows)
+            start = windows[-1][1]
+            length = next_window_length(wave, page_size)
+            logger.info(
+                f"Scraped {len(windows)} windows up to {start}, "
+                f"next windows are {length} long"
+            )
+
+    duplicates = downloaded - len(bookings)
+    run_metrics.add("booking_windows", n_windows)
+    run_metrics.add("booking_rows_downloaded", downloaded)
+    run_metrics.add("booking_duplicates", duplicates)
+    run_metrics.gauge("booking_duplicate_ratio", round(duplicates / max(downloaded, 1), 4))
+    logger.info(
+        f"Retrieved {len(bookings)} bookings from {n_windows} windows "
+        f"({duplicates} duplicates)"
+    )
+    return list(bookings.values())
+
 
 def scrape_days_from_api(
-    start_date: str, end_date: str
+    start_date: str,
+    end_date: str,
+    checkpoints: PageCheckpoints = None,
+    ses: requests.Session = None,
 ) -> tuple[pd.DataFrame, pd.DataFrame, str]:
     """
     Scrapes the matrix API for a given period
     Writes outputs to raw-history bucket with folder
 
+    With --booking-window-hours, the period is scraped concurrently in
+    windows that start that many hours long, see scrape_windows.
+
     Parameters:
         start_date: Start date in format %Y-%m-%d
         end_date: End date in format %Y-%m-%d
             can also be 'eod' to denote end of day
+        checkpoints: Pages already fetched by an earlier attempt, which
+            fetched pages are also added to (optional)
+        ses: Session that has already logged in (optional)
     """
 
-    url = "https://app.matrixbooking.com/api/v1/booking"
-    page_size = 2500
-
-    bookings = []
+    url = f"{api_url}/booking"
+    page_size = BOOKINGS_PAGE_SIZE
 
     # Authenticate session with API
-    ses = requests.session()
-    matrix_authenticate(ses)
-
-    # Derive booking parameters
-    params = make_booking_params(
-        start_date,
-        end_date,
-        pageNum=0,
-        pageSize=page_size,
-    )
-
-    # Scrape the first page of data
-    logger.info("Scraping page 0")
-    data = get_payload(ses, url, params)
-    rowcount = len(data)
-    logger.info(f"Records scraped: {rowcount}")
-
-    # Pull out the bookings and location data seperately
-    bookings = data
-
-    i = 1
-    total_rows = rowcount
-    while rowcount == page_size:
-        logger.info(f"Scraping page {i}")
-        params = make_booking_params(
+    if ses is None:
+        ses = login()
+
+    if booking_window_hours:
+        start = datetime.strptime(start_date, "%Y-%m-%d")
+        last_day = start if end_date == "eod" else datetime.strptime(end_date, "%Y-%m-%d")
+        bookings = scrape_windows(
+            ses,
+            url,
+            start,
+            last_day + timedelta(days=1),
+            timedelta(hours=booking_window_hours),
+            page_size,
+            scrape_workers,
+            checkpoints,
+        )
+    else:
+        bookings = scrape_window(
+            ses,
+            url,
             start_date,
             end_date,
-            pageNum=i,
-            pageSize=page_size,
+            page_size,
+            checkpoints=checkpoints,
         )
-        data = get_payload(ses, url, params)
-        rowcount = len(data)
-        logger.info(f"Records scraped: {rowcount}")
-        if rowcount > 0:
-            bookings.extend(data)
-        i += 1
-        total_rows += rowcount
-
-    logger.info(f"Retrieved {total_rows} bookings")
+        logger.info(f"Retrieved {len(bookings)} bookings")
 
-    raw_bookings = pd.json_normalize(bookings, sep="_").rename(
-        mapper=camel_to_snake_case, axis="columns"
+    raw_bookings = normalise_records(
+        bookings,
+        Metadata.from_json(meta_path_bookings),
+        bookings_renames,
+        normaliser,
     )
 
     return raw_bookings
 
 
-def scrape_locations_from_api(start_date: str) -> pd.DataFrame:
-    ses = requests.session()
-    matrix_authenticate(ses)
+def scrape_locations_from_api(
+    start_date: str, ses: requests.Session = None
+) -> pd.DataFrame:
+    if ses is None:
+        ses = login()
     params = {"f": start_date, "t": "eod"}
-    url = "https://app.matrixbooking.com/api/v1/org/43/locations"
+    url = f"{api_url}/org/43/locations"
     logger.info("Scraping locations info")
     raw_locations = get_payload(ses, url, params)
-    unnest_locs = extract_locations(raw_locations)
-    raw_unpacked_locations = (
-        pd.json_normalize(unnest_locs, sep="_")
-        .drop(columns=["locations", "organisation_id"])
-        .rename(mapper=camel_to_snake_case, axis="columns")
-    )
+    run_metrics.add("pages", 1)
+    raw_unpacked_locations = locations_to_frame(raw_locations)
     return raw_unpacked_locations
 
 
+def scrape_changed_locations_from_api(
+    start_date: str, ses: requests.Session = None
+) -> pd.DataFrame:
+    """Like scrape_locations_from_api, but returns None if the locations haven't changed since the last scrape
+
+    See functions/locations_fingerprint.py
+    """
+    if ses is None:
+        ses = login()
+    params = {"f": start_date, "t": "eod"}
+    url = f"{api_url}/org/43/locations"
+    previous = locations_fingerprint.previous_fingerprint(start_date)
+    logger.info("Scraping locations info")
+    status, headers, body = get_response(
+        ses, url, params, headers=locations_fingerprint.conditional_headers(previous)
+    )
+    run_metrics.add("pages", 1)
+    if locations_fingerprint.check_unchanged(start_date, previous, status, headers, body):
+        logger.info(
+            f"Locations unchanged since {previous['source_date']}, not reloading them"
+        )
+        return None
+    return locations_to_frame(loads(body))
+
+
 def rename_df(df: pd.DataFrame, renames: dict) -> pd.DataFrame:
     """_summary_
 
@@ -132,15 +382,16 @@ def rename_df(df: pd.DataFrame, renames: dict) -> pd.DataFrame:
     return df
 
 
-def fix_faulty_time_cols(df):
-    """_summary_
+def fix_faulty_time_cols(df, meta_path: str = meta_path_bookings):
+    """Fixes the timestamp columns of the bookings metadata at `meta_path`
+    (by default this environment's)
 
     Returns
     -------
     _type_
         _description_
     """
-    bookings_metadata = Metadata.from_json(meta_path_bookings)
+    bookings_metadata = Metadata.from_json(meta_path)
     for col in bookings_metadata:
         if "timestamp" in col["type"]:
             if col["name"] in df.columns:
@@ -155,7 +406,13 @@ def add_date_time_columns(df, scrape_date):
     return df
 
 
-def write_raw_data_to_s3(df: pd.DataFrame, renames: dict, raw_loc: str, name: str):
+def write_raw_data_to_s3(
+    df: pd.DataFrame,
+    renames: dict,
+    raw_loc: str,
+    name: str,
+    meta_path: str = meta_path_bookings,
+):
     """_summary_
 
     Parameters
@@ -166,25 +423,104 @@ def write_raw_data_to_s3(df: pd.DataFrame, renames: dict, raw_loc: str, name: st
         _description_
     start_date : _type_
         _description_
+    meta_path : optional
+        Bookings metadata whose timestamp columns are fixed, by default this
+        environment's
     """
     df = rename_df(df, renames)
-    df = fix_faulty_time_cols(df)
-    writer.write(
-        df,
-        raw_loc,
-    )
+    df = fix_faulty_time_cols(df, meta_path)
+    size = write_jsonl(df, raw_loc)
+    run_metrics.add_rows(len(df))
+    run_metrics.add("bytes", size)
     logger.info(f"Raw {name} data written to {raw_loc}.")
 
 
+def bookings_checkpoints(start_date: str, end_date: str) -> PageCheckpoints:
+    """Page checkpoints for a bookings scrape, or None if they're turned off
+    or the responses are being replayed"""
+    if not use_checkpoints or matrix_cache.replaying:
+        return None
+    return PageCheckpoints(
+        f"{checkpoint_location}/bookings/{start_date}",
+        {
+            "start_date": start_date,
+            "end_date": end_date,
+            "page_size": BOOKINGS_PAGE_SIZE,
+            "booking_window_hours": booking_window_hours,
+        },
+        max_age=timedelta(hours=checkpoint_max_age_hours),
+    )
+
+
+def raw_file_path(land: str, name: str, start_date: str) -> str:
+    """Where the raw file for a table and day is written in land"""
+    return f"{land}/{name}/{start_date}/{name}-raw-{start_date}.jsonl"
+
+
 def scrape_and_write_raw_bookings_data(start_date):
-    raw_bookings_loc = f"{land_location}/bookings/{start_date}/bookings-raw-{start_date}.jsonl"
-    bookings = scrape_days_from_api(start_date, "eod")
+    raw_bookings_loc = raw_file_path(land_location, "bookings", start_date)
+    checkpoints = bookings_checkpoints(start_date, "eod")
+    bookings = scrape_days_from_api(start_date, "eod", checkpoints)
     bookings = add_date_time_columns(bookings, start_date)
     write_raw_data_to_s3(bookings, bookings_renames, raw_bookings_loc, "bookings")
+    if checkpoints is not None:
+        checkpoints.clear()
 
 
 def scrape_and_write_raw_locations_data(start_date):
-    raw_locations_loc = f"{land_location}/locations/{start_date}/locations-raw-{start_date}.jsonl"
-    locations = scrape_locations_from_api(start_date)
+    raw_locations_loc = raw_file_path(land_location, "locations", start_date)
+    if locations_fingerprint.enabled():
+        locations = scrape_changed_locations_from_api(start_date)
+        if locations is None:
+            return
+    else:
+        locations = scrape_locations_from_api(start_date)
     locations = add_date_time_columns(locations, start_date)
     write_raw_data_to_s3(locations, location_renames, raw_locations_loc, "locations")
+
+
+def scrape_and_write_raw_data_to_envs(start_date, envs=None):
+    """Scrapes bookings and locations once and writes the raw files to the
+    land bucket of each environment
+
+    Parameters
+    ----------
+    start_date :
+        Date to scrape
+    envs : optional
+        Environments to write to, by default --fan-out-envs
+    """
+    envs = envs or fan_out_envs
+
+    ses = login()
+    checkpoints = bookings_checkpoints(start_date, "eod")
+    bookings = add_date_time_columns(
+        scrape_days_from_api(start_date, "eod", checkpoints, ses), start_date
+    )
+    locations = add_date_time_columns(
+        scrape_locations_from_api(start_date, ses), start_date
+    )
+
+    def write_env(env):
+        paths = env_paths(env)
+        # Each environment gets its own copy, as the time columns are fixed
+        # in place, following that environment's metadata
+        write_raw_data_to_s3(
+            bookings.copy(),
+            bookings_renames,
+            raw_file_path(paths["land_location"], "bookings", start_date),
+            "bookings",
+            paths["meta_path_bookings"],
+        )
+        write_raw_data_to_s3(
+            locations.copy(),
+            location_renames,
+            raw_file_path(paths["land_location"], "locations", start_date),
+            "locations",
+            paths["meta_path_bookings"],
+        )
+
+    with ThreadPoolExecutor(max_workers=len(envs)) as executor:
+        list(executor.map(write_env, envs))
+    if checkpoints is not None:
+        checkpoints.clear()
@@ -1,20 +1,37 @@
 import awswrangler as wr
+import copy
 import logging
+import multiprocessing
 import os
 import re
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from mojap_metadata import Metadata
-from arrow_pd_parser import writer, reader, caster
+from arrow_pd_parser import caster
 from constants import (
-    db_location,
-    db_name,
+    clean_batch_rows,
     land_bucket,
     meta_path_bookings,
     meta_path_locations,
     raw_hist_bucket,
-    region_name,
+    validator,
 )
 from context_filter import ContextFilter
+from metrics import run_metrics
+from functions.api_helpers import compact_frame
+from functions.jsonl_helpers import iter_jsonl_columns
+from functions.locations_fingerprint import (
+    locations_unchanged,
+    rebuild_reused_partitions,
+    reuse_locations_partition,
+)
+from functions.table_locations import partition_folder, table_root
+from functions.parquet_helpers import (
+    read_parquet_options,
+    write_parquet,
+    write_parquet_batches,
+)
+from functions.vectorised_validation import run_vectorised_validation
 from dataengineeringutils3.s3 import get_filepaths_from_s3_folder
 from data_linter import validation
 from typing import Any, Optional, Tuple
@@ -43,6 +60,9 @@ BASE_CONFIG = {
     "all-must-pass": False,
 }
 
+# Land root used when one config covers several tables or dates
+LAND_ROOT = "s3://{bucket}/corporate/matrix/"
+
 TABLE_CONFIG = {
     "required": True,
     "allow-unexpected-data": True,
@@ -55,6 +75,12 @@ META_PATH = {
 }
 
 
+def list_s3_files(s3_folder: str) -> list[str]:
+    """get_filepaths_from_s3_folder, recorded in the run metrics"""
+    with run_metrics.call("s3", "list"):
+        return get_filepaths_from_s3_folder(s3_folder)
+
+
 def extract_timestamp(table_name: str, file_path: str) -> int:
     """From a filepath (transformed by data_linter), return the epoch timestamp in filename
 
@@ -106,11 +132,48 @@ def get_latest_file(table_name: str, file_paths: list[str]) -> str:
     return final_path
 
 
-def create_config(scrape_date, table):
+def _as_list(value) -> list:
+    return [value] if value is None or isinstance(value, str) else list(value)
+
+
+def create_config(scrape_dates, tables):
+    """Builds a data_linter config for one or more tables and scrape dates
+
+    Each call returns a new config, so configs can be built and used
+    concurrently. With a single table and date, land-base-path is that day's
+    land folder as before. With several, it's the land root and each table
+    gets a pattern matching its files for the given dates.
+
+    The log folder is `log/{table}/{date}/` for a single table and date, and
+    otherwise `log/{tables joined by -}/{first date}_{last date}/` (one date
+    if they're the same), e.g. `log/bookings-locations/2024-01-15/` for
+    validate_raw_data.
+
+    Parameters
+    ----------
+    scrape_dates :
+        Scrape date, or list of scrape dates
+    tables :
+        Table name, or list of table names
+
+    Returns
+    -------
+        data_linter config
+    """
+    scrape_dates = _as_list(scrape_dates)
+    tables = _as_list(tables)
     buckets = {"land": land_bucket, "raw-hist": raw_hist_bucket}
-    config = BASE_CONFIG
-    config["land-base-path"] = config["land-base-path"].format(
-        bucket=buckets["land"], table=table, scrape_date=scrape_date,
+    config = copy.deepcopy(BASE_CONFIG)
+    single = len(tables) == 1 and len(scrape_dates) == 1
+    if single:
+        land_base_path = config["land-base-path"]
+        log_table, log_date = tables[0], scrape_dates[0]
+    else:
+        land_base_path = LAND_ROOT
+        log_table = "-".join(tables)
+        log_date = "_".join(sorted({min(scrape_dates), max(scrape_dates)}))
+    config["land-base-path"] = land_base_path.format(
+        bucket=buckets["land"], table=tables[0], scrape_date=scrape_dates[0],
     )
     config["fail-base-path"] = config["fail-base-path"].format(
         bucket=buckets["raw-hist"]
@@ -120,67 +183,250 @@ def create_config(scrape_date, table):
     )
     config["log-base-path"] = config["log-base-path"].format(
         bucket=buckets["raw-hist"],
-        table=table,
-        scrape_date=scrape_date,
+        table=log_table,
+        scrape_date=log_date,
     )
     config["tables"] = {}
-    config["tables"][table] = TABLE_CONFIG
-
-    config["tables"][table]["metadata"] = META_PATH[table]
+    for table in tables:
+        config["tables"][table] = {**TABLE_CONFIG, "metadata": META_PATH[table]}
+        if not single:
+            dates = "|".join(re.escape(date) for date in scrape_dates)
+            config["tables"][table]["pattern"] = f"^{table}/({dates})/{table}-raw-"
     return config
 
 
-def validate_data(scrape_date, table):
-    """Validates the data from the API given a start date."""
-    config = create_config(scrape_date, table)
+def validate_data(scrape_dates, tables):
+    """Validates the data from the API for the given dates and tables in a
+    single data_linter run."""
+    config = create_config(scrape_dates, tables)
     logger.info(
         f"looking for data at: {config['land-base-path']}"
     )
-    validation.run_validation(config)
+    with run_metrics.call("data_linter", "run_validation"):
+        validation.run_validation(config)
+
+
+def _files_for(files: list[str], base_path: str, table: str, scrape_date) -> list[str]:
+    """The files of a table and date among those listed under base_path
+
+    Only raw files are matched, by their name ({table}-raw-{date}...) and by
+    being directly under base_path, {table}/ (pass and fail) or
+    {table}/{date}/ (the land root). Anything else under the land root, such
+    as leftover checkpoints, isn't taken for one of this table's.
+    """
+    table, scrape_date = re.escape(table), re.escape(scrape_date)
+    pattern = re.compile(f"^(?:{table}/(?:{scrape_date}/)?)?{table}-raw-{scrape_date}")
+    return [file for file in files if pattern.match(file.replace(base_path, ""))]
+
+
+def assert_no_files(scrape_dates, tables):
+    """Checks each table and date has moved from land to pass, listing each
+    folder once however many tables and dates there are"""
+    config = create_config(scrape_dates, tables)
+    land_files = list_s3_files(config["land-base-path"])
+    pass_files = list_s3_files(config["pass-base-path"])
+    fail_files = list_s3_files(config["fail-base-path"])
+    failed = []
+    for table in _as_list(tables):
+        for scrape_date in _as_list(scrape_dates):
+            land = _files_for(land_files, config["land-base-path"], table, scrape_date)
+            passed = _files_for(pass_files, config["pass-base-path"], table, scrape_date)
+            fail = _files_for(fail_files, config["fail-base-path"], table, scrape_date)
+            if land or fail or not passed:
+                failed.append((table, scrape_date, fail))
+    assert not failed, logger.error(
+        "Failed to validate data for "
+        + ", ".join(f"{table} {date}, see one of {fail}" for table, date, fail in failed)
+    )
+    logger.info(
+        f"Latest ingest validated against schema for {_as_list(scrape_dates)}"
+    )
 
-def assert_no_files(scrape_date, table):
+
+def _validate_run(dates: list[str], tables: list[str]) -> dict:
+    """Validates one run of days in a validate_days worker process
+
+    Returns
+    -------
+        The calls the run made, for the parent's run metrics
+    """
+    # data_linter logs to one buffer per process and uploads all of it as
+    # each run's log, so empty it first or the log would repeat earlier runs
+    validation.log_stringio.seek(0)
+    validation.log_stringio.truncate()
+    with run_metrics.step("validate_run") as step:
+        validate_data(dates, tables)
+        assert_no_files(dates, tables)
+    return step["calls"]
+
+
+def validate_days(scrape_dates, tables=("bookings", "locations"), days_per_run=7, max_workers=4):
+    """Validates many days, e.g. for a backfill
+
+    The dates are split into runs of `days_per_run` days, each validated
+    with one data_linter run covering every table. Runs go concurrently in
+    up to `max_workers` processes, as data_linter keeps its log in module
+    globals, so runs in threads would upload each other's logs. Failures are
+    collected and reported together once all runs have finished.
+    """
+    scrape_dates = sorted(_as_list(scrape_dates))
+    tables = _as_list(tables)
+    runs = [
+        scrape_dates[i:i + days_per_run]
+        for i in range(0, len(scrape_dates), days_per_run)
+    ]
+
+    errors = []
+    # Workers are started fresh rather than forked, so they don't inherit
+    # this process's AWS clients or data_linter log
+    with ProcessPoolExecutor(
+        max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = {executor.submit(_validate_run, dates, tables): dates for dates in runs}
+        for future in as_completed(futures):
+            try:
+                run_metrics.merge_calls(future.result())
+            except Exception as e:
+                errors.append((futures[future], e))
+    assert not errors, logger.error(
+        f"Failed to validate {sum(len(dates) for dates, _ in errors)} days: "
+        + "; ".join(f"{dates[0]} to {dates[-1]}: {e!r}" for dates, e in errors)
+    )
+    logger.info(f"Validated {len(scrape_dates)} days for {tables}")
+
+
+def validate_data_vectorised(scrape_date, table):
+    """Validates the data from the API in-process, see vectorised_validation.
+    The outcome comes from the results, so the folders don't need listing
+    afterwards."""
     config = create_config(scrape_date, table)
-    land_files = get_filepaths_from_s3_folder(config["land-base-path"])
+    logger.info(
+        f"looking for data at: {config['land-base-path']}"
+    )
     land_files = [
         file
-        for file in land_files
-        if re.search(
-            f"{table}.*{scrape_date}",
-            file.replace(config["land-base-path"], ""),
-        )
-    ]
-    pass_files = get_filepaths_from_s3_folder(config["pass-base-path"])
-    pass_files = [
-        file
-        for file in pass_files
-        if re.search(
-            f"{table}.*{scrape_date}",
-            file.replace(config["pass-base-path"], ""),
-        )
+        for file in list_s3_files(config["land-base-path"])
+        if re.search(f"{table}.*{scrape_date}.*\\.jsonl$", file)
     ]
-    fail_files = get_filepaths_from_s3_folder(config["fail-base-path"])
-    fail_files = [
-        file
-        for file in fail_files
-        if re.search(
-            f"{table}.*{scrape_date}",
-            file.replace(config["fail-base-path"], ""),
-        )
-    ]
-    assert (not land_files and not fail_files) and pass_files, logger.error(
-        f"Failed to validate data for {scrape_date}, see one of {fail_files}"
+    results = run_vectorised_validation(config, land_files)
+    failed = [result.archived_path for result in results if not result.valid]
+    assert results and not failed, logger.error(
+        f"Failed to validate data for {scrape_date}, see one of {failed}"
     )
     logger.info(f"Latest ingest validated against schema for {scrape_date}")
 
 
+def validate_table_data(scrape_date, table):
+    if validator == "vectorised":
+        validate_data_vectorised(scrape_date, table)
+    else:
+        validate_data(scrape_date, table)
+        assert_no_files(scrape_date, table)
+
+
+def validate_raw_data(scrape_date):
+    """Validates both tables for the day, in one data_linter run"""
+    tables = ["bookings", "locations"]
+    if locations_unchanged(scrape_date):
+        tables.remove("locations")
+    if validator == "vectorised":
+        for table in tables:
+            validate_data_vectorised(scrape_date, table)
+    else:
+        validate_data(scrape_date, tables)
+        assert_no_files(scrape_date, tables)
+
+
 def validate_bookings_data(scrape_date):
-    validate_data(scrape_date, "bookings")
-    assert_no_files(scrape_date, "bookings")
+    validate_table_data(scrape_date, "bookings")
 
 
 def validate_locations_data(scrape_date):
-    validate_data(scrape_date, "locations")
-    assert_no_files(scrape_date, "locations")
+    if locations_unchanged(scrape_date):
+        logger.info(f"Locations for {scrape_date} unchanged, nothing to validate")
+        return
+    validate_table_data(scrape_date, "locations")
+
+
+def cleaned_file_path(start_date: str, name: str, latest: bool = True) -> str:
+    """The validated file for a day in the pass folder
+
+    Parameters
+    ----------
+    start_date :
+        Start date of this data scrape
+    name :
+        Table name, bookings or locations
+    latest : optional
+        Use the latest file for the day if there are several, by default True
+
+    Returns
+    -------
+        s3 path of the file
+    """
+    config = create_config(start_date, name)
+
+    files = list_s3_files(f"{config['pass-base-path']}{name}/")
+
+    start_date_files = [file for file in files if f"{name}-raw-{start_date}" in file]
+    if latest:
+        filepath = get_latest_file(name, start_date_files)
+    else:
+        filepath = start_date_files[0]
+    logger.info(f"File to read in: {filepath}")
+    return filepath
+
+
+def read_cleaned_data(
+    start_date: str,
+    name: str,
+    latest: bool = True,
+) -> Tuple[Any, Metadata]:
+    """Reads the validated data for a day from the pass folder, and casts it
+    to the table's metadata
+
+    Parameters
+    ----------
+    start_date :
+        Start date of this data scrape
+    name :
+        Table name, bookings or locations
+    latest : optional
+        Use the latest file for the day if there are several, by default True
+
+    Returns
+    -------
+        The cast dataframe and the table metadata
+    """
+    filepath = cleaned_file_path(start_date, name, latest)
+    metadata = Metadata.from_json(META_PATH[name])
+    return next(read_cleaned_batches(filepath, metadata)), metadata
+
+
+def read_cleaned_batches(filepath: str, metadata: Metadata, batch_size: int = None):
+    """Reads a validated file, keeping only the metadata's columns in its
+    order, and casts it to the metadata
+
+    Each column is given a compact dtype (see compact_frame) as the frame is
+    built, before the cast.
+
+    Parameters
+    ----------
+    filepath :
+        s3 path of the file
+    metadata :
+        Table metadata
+    batch_size : optional
+        Most rows in a batch, by default the whole file is one batch
+
+    Yields
+    ------
+        Cast dataframes
+    """
+    for columns in iter_jsonl_columns(filepath, metadata.column_names, batch_size):
+        df = compact_frame(columns, metadata)
+        run_metrics.add_rows(len(df))
+        yield caster.cast_pandas_table_to_schema(df, metadata)
 
 
 def read_and_write_cleaned_data(
@@ -188,6 +434,7 @@ def read_and_write_cleaned_data(
     name: str,
     skip_write_s3: bool = False,
     latest: bool = True,
+    batch_size: int = None,
 ):
     """Reads the clean data from s3, and writes to the database location
     in parquet format
@@ -198,65 +445,62 @@ def read_and_write_cleaned_data(
         Start date of this data scrape
     skip_write_s3 : optional
         Write to s3 or not, by default False
+    batch_size : optional
+        Read, cast and write this many rows at a time rather than the whole
+        day at once, which bounds the memory used. By default --clean-batch-rows
     """
-    config = create_config(start_date, name)
-
-    files = get_filepaths_from_s3_folder(f"{config['pass-base-path']}{name}/")
-
-    start_date_files = [file for file in files if f"{name}-raw-{start_date}" in file]
-    metapath = config["tables"][name]["metadata"]
-    if latest:
-        filepath = get_latest_file(name, start_date_files)
-    else:
-        filepath = start_date_files[0]
-    logger.info(f"File to read in: {filepath}")
-    metadata = Metadata.from_json(metapath)
-    df = reader.read(filepath)
-    df = df.reindex(columns=metadata.column_names)
-    df = df[metadata.column_names]
-    df = caster.cast_pandas_table_to_schema(df, metadata)
+    output_path = f"{partition_folder(name, start_date)}/{start_date}.parquet"
+    options = read_parquet_options(META_PATH[name])
+    batch_size = clean_batch_rows if batch_size is None else batch_size
+    if batch_size:
+        filepath = cleaned_file_path(start_date, name, latest)
+        metadata = Metadata.from_json(META_PATH[name])
+        batches = read_cleaned_batches(filepath, metadata, batch_size)
+        if skip_write_s3:
+            for _ in batches:
+                pass
+        else:
+            write_parquet_batches(batches, output_path, metadata, options)
+            logger.info(f"{name} data for {start_date} written to s3.")
+        return
+
+    df, metadata = read_cleaned_data(start_date, name, latest)
     if not skip_write_s3:
         # Write out dataframe, ensuring conformance with metadata
-        writer.write(
-            df,
-            f"{db_location}/{name}/scrape_date={start_date}/{start_date}.parquet",
-            metadata=metadata,
-        )
+        write_parquet(df, output_path, metadata, options)
         logger.info(f"{name} data for {start_date} written to s3.")
 
 
-def refresh_new_partition(database_name: str, table_name: str, scrape_date: str):
-    os.environ['AWS_DEFAULT_REGION'] = region_name
-    query_string = f"""alter table awsdatacatalog.{database_name}.{table_name} 
-                add if not exists partition (scrape_date = '{scrape_date}')"""
-    logger.info(f"Athena Query: adding {scrape_date} partition to \
-                {database_name}.{table_name}")
-    query_exec_id = wr.athena.start_query_execution(sql=query_string)
-    resp = wr.athena.wait_query(query_exec_id)
-    return resp
-
 def read_and_write_cleaned_bookings(start_date):
     read_and_write_cleaned_data(start_date, "bookings")
 
 def read_and_write_cleaned_locations(start_date):
+    if locations_unchanged(start_date):
+        reuse_locations_partition(start_date)
+        return
     read_and_write_cleaned_data(start_date, "locations")
 
-def refresh_new_partition_bookings(start_date):
-    resp = refresh_new_partition(database_name=db_name,
-                          table_name="bookings",
-                          scrape_date=start_date)
-    return resp
+def rebuild_all_s3_data_from_raw(db_root: str = None) -> dict:
+    """Rewrites every day of both tables from the pass folder, and the days
+    whose locations were reused from an earlier day (see
+    locations_fingerprint.py)
 
-def refresh_new_partition_locations(start_date):
-    resp = refresh_new_partition(database_name=db_name,
-                          table_name="locations",
-                          scrape_date=start_date)
-    return resp
+    Parameters
+    ----------
+    db_root : optional
+        Write to `{db_root}/{table}` rather than to the live tables, e.g. for
+        a shadow build
 
-def rebuild_all_s3_data_from_raw():
+    Returns
+    -------
+        Rows written for each day, by table
+    """
+    rows = {}
     for name in ["bookings", "locations"]:
+        rows[name] = {}
+        output_root = f"{db_root}/{name}" if db_root else table_root(name)
         config = create_config(None, name)
-        files = get_filepaths_from_s3_folder(config["pass-base-path"])
+        files = list_s3_files(config["pass-base-path"])
         for file in files:
             match = re.search(r"{name}".format(name=name) + r"-raw-(\d{4})-(\d{2})-(\d{2})-\d+-[0-9]+\.jsonl", file)
             if match:
@@ -275,16 +519,19 @@ def rebuild_all_s3_data_from_raw():
                     filepath = start_date_files[-1]
                     logger.info(f"File to read in: {filepath}")
                     metadata = Metadata.from_json(metapath)
-                    df = reader.read(filepath)
-                    df = df.reindex(columns=metadata.column_names)
-                    df = df[metadata.column_names]
-                    df = caster.cast_pandas_table_to_schema(df, metadata)
+                    df = next(read_cleaned_batches(filepath, metadata))
                     # Write out dataframe, ensuring conformance with metadata
-                    writer.write(
+                    write_parquet(
                         df,
-                        f"{db_location}/{name}/scrape_date={start_date}/{start_date}.parquet",
-                        metadata=metadata,
+                        f"{output_root}/scrape_date={start_date}/{start_date}.parquet",
+                        metadata,
+                        read_parquet_options(metapath),
                     )
+                    rows[name][start_date] = len(df)
                     logger.info(f"{name} data for {start_date} written to s3.")
                 except Exception as e:
                     logger.info(f"No files found to rebuild. Error: {e}")
+        if name == "locations":
+            # Days with unchanged locations have no pass file
+            rows[name].update(rebuild_reused_partitions(output_root, rows[name]))
+    return rows
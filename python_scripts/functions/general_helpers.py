@@ -26,6 +26,20 @@ def get_command_line_arguments():
         help="Environment (preproduction or production) to store results in. Takes values preprod or prod",
     )
 
+    # Scraping once for several environments
+    parser.add_argument(
+        "--fan-out-envs",
+        type=str,
+        nargs="+",
+        choices=["dev", "preprod", "prod"],
+        help="Scrape once and write, validate and load the data into each of these environments",
+    )
+    parser.add_argument(
+        "--skip-scrape",
+        action=argparse.BooleanOptionalAction,
+        help="If passed, the scrape steps are skipped, e.g. when a fan-out run has already written the raw files",
+    )
+
     # Writing to s3
     parser.add_argument(
         "--skip-write-s3",
@@ -37,4 +51,208 @@ def get_command_line_arguments():
         "--function", type=str, help="Name of the function to run (optional)"
     )
 
+    # Matrix API base url, overridden to point at a local fake API when benchmarking
+    parser.add_argument(
+        "--api-url",
+        type=str,
+        default="https://app.matrixbooking.com/api/v1",
+        help="Base url of the Matrix API (default is the live API)",
+    )
+
+    # Run metrics
+    parser.add_argument(
+        "--metrics-path",
+        type=str,
+        help="Local or s3 path to write the JSON run metrics summary to (optional)",
+    )
+    parser.add_argument(
+        "--prometheus-textfile",
+        type=str,
+        help="Path of a Prometheus textfile to write the run metrics to (optional)",
+    )
+    parser.add_argument(
+        "--athena-history",
+        type=str,
+        help="Local JSON lines file to append each Athena query's statistics to, "
+        "used to warn when a query scans much more than usual (optional)",
+    )
+    parser.add_argument(
+        "--athena-workgroup",
+        type=str,
+        help="Athena workgroup to run queries in (default $ATHENA_WORKGROUP, "
+        "or Athena's default workgroup)",
+    )
+    parser.add_argument(
+        "--statsd",
+        type=str,
+        help="host:port of a StatsD server to send the run metrics to (optional)",
+    )
+
+    # Profiling
+    parser.add_argument(
+        "--profile",
+        action=argparse.BooleanOptionalAction,
+        help="If passed, each step run is profiled (CPU and memory)",
+    )
+    parser.add_argument(
+        "--profile-output",
+        type=str,
+        default="profiles",
+        help="Local directory or s3 prefix to write profiles to (default ./profiles)",
+    )
+    parser.add_argument(
+        "--profile-top",
+        type=int,
+        default=25,
+        help="Number of hotspots to list in each profile summary",
+    )
+
+    # How the locations table is stored
+    parser.add_argument(
+        "--locations-mode",
+        type=str,
+        choices=["snapshot", "scd2"],
+        default="snapshot",
+        help="snapshot stores every day's locations, scd2 only stores changes",
+    )
+    parser.add_argument(
+        "--conditional-locations",
+        action=argparse.BooleanOptionalAction,
+        help="If passed, unchanged locations are copied from the previous "
+        "partition instead of being reloaded (snapshot mode only)",
+    )
+
+    # Scraping bookings in time windows
+    parser.add_argument(
+        "--booking-window-hours",
+        type=float,
+        default=0,
+        help="Scrape bookings in concurrent windows of this many hours (0 to page through the day)",
+    )
+    parser.add_argument(
+        "--scrape-workers",
+        type=int,
+        default=4,
+        help="Number of booking windows to scrape at once",
+    )
+
+    # Pacing of the requests made to the API
+    parser.add_argument(
+        "--max-request-rate",
+        type=float,
+        default=20.0,
+        help="Most requests per second sent to the API, the rate adapts below this",
+    )
+
+    # Resuming an interrupted scrape
+    parser.add_argument(
+        "--checkpoints",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Save each page of bookings as it's fetched, so a retry only fetches the missing pages (default on)",
+    )
+    parser.add_argument(
+        "--checkpoint-path",
+        type=str,
+        help="Local directory or s3 prefix for the page checkpoints (default is under the raw-hist bucket)",
+    )
+    parser.add_argument(
+        "--checkpoint-max-age-hours",
+        type=float,
+        default=12,
+        help="Page checkpoints older than this are fetched again rather than reused",
+    )
+
+    # Record/replay of API responses
+    parser.add_argument(
+        "--response-cache",
+        type=str,
+        choices=["off", "record", "replay"],
+        default="off",
+        help="record saves every API response, replay reads them back instead of calling the API",
+    )
+    parser.add_argument(
+        "--response-cache-path",
+        type=str,
+        help="Local directory or s3 prefix of the response cache (default is under the raw-hist bucket)",
+    )
+
+    # Memory used by the clean step
+    parser.add_argument(
+        "--clean-batch-rows",
+        type=int,
+        default=0,
+        help="Read, cast and write the cleaned data this many rows at a time (0 for the whole day at once)",
+    )
+
+    # How nested booking records are flattened into columns
+    parser.add_argument(
+        "--normaliser",
+        type=str,
+        choices=["pandas", "arrow"],
+        default="pandas",
+        help="pandas uses pd.json_normalize, arrow flattens a pyarrow table",
+    )
+
+    # How the raw files are validated before they're moved to pass
+    parser.add_argument(
+        "--validator",
+        type=str,
+        choices=["data_linter", "vectorised"],
+        default="data_linter",
+        help="vectorised checks the columns in-process instead of using data_linter",
+    )
+
+    # Backfill validation (validate_backfill.py)
+    parser.add_argument(
+        "--end-date",
+        type=str,
+        help="Last scrape date (%Y-%m-%d) to validate, from --scrape_date",
+    )
+    parser.add_argument(
+        "--validate-workers",
+        type=int,
+        default=4,
+        help="Number of data_linter runs to do at once",
+    )
+    parser.add_argument(
+        "--days-per-run",
+        type=int,
+        default=7,
+        help="Number of days each data_linter run covers",
+    )
+
+    # Compaction (compaction.py)
+    parser.add_argument(
+        "--compact-month",
+        type=str,
+        help="Month to compact, as %Y-%m (default is the month of --scrape_date)",
+    )
+    parser.add_argument(
+        "--reload-day",
+        action=argparse.BooleanOptionalAction,
+        help="If passed, compaction.py reloads --scrape_date instead of compacting",
+    )
+
+    # Shadow builds (shadow_build.py)
+    parser.add_argument(
+        "--rollback",
+        action=argparse.BooleanOptionalAction,
+        help="If passed, shadow_build.py points the tables back at the version "
+        "the last build replaced",
+    )
+
+    # Schema migrations (database_builder_v2.py, see glue_schema.py)
+    parser.add_argument(
+        "--migrate",
+        action=argparse.BooleanOptionalAction,
+        help="If passed, database_builder_v2.py adds new columns to the existing "
+        "tables instead of dropping and recreating the database",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action=argparse.BooleanOptionalAction,
+        help="With --migrate, only log the schema changes",
+    )
+
     return parser.parse_args()
@@ -0,0 +1,143 @@
+import datetime
+import os
+
+import numpy as np
+import pandas as pd
+
+from fast_json import dumps_lines, loads, loads_lines
+from s3_utils import iter_lines_from_s3, read_bytes_from_s3, write_bytes_to_s3
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+
+def read_jsonl_records(input_path: str) -> list[dict]:
+    """Reads a local or s3 JSONL file into a list of dictionaries"""
+    if input_path.startswith("s3://"):
+        body = read_bytes_from_s3(input_path)
+    else:
+        with open(input_path, "rb") as f:
+            body = f.read()
+    return loads_lines(body)
+
+
+def read_jsonl(input_path: str) -> pd.DataFrame:
+    """Reads a JSONL file into a dataframe
+
+    Drop-in for `arrow_pd_parser.reader.read` on JSONL files without metadata:
+    dtypes are converted the same way (nullable integers, strings and
+    booleans, floats left as they are), but the lines are parsed with
+    fast_json rather than pandas' JSON reader.
+
+    Parameters
+    ----------
+    input_path :
+        Local path or s3 path of the JSONL file
+
+    Returns
+    -------
+        Dataframe with one row per line
+    """
+    df = pd.DataFrame.from_records(read_jsonl_records(input_path))
+    return df.convert_dtypes(infer_objects=True, convert_floating=False)
+
+
+def iter_jsonl_lines(input_path: str):
+    """Yields the lines of a local or s3 JSONL file, without reading the
+    whole file into memory"""
+    if input_path.startswith("s3://"):
+        yield from iter_lines_from_s3(input_path)
+    else:
+        with open(input_path, "rb") as f:
+            yield from f
+
+
+def iter_jsonl_columns(input_path: str, columns: list[str], batch_size: int = None):
+    """Reads a JSONL file as lists of column values, `batch_size` rows at a
+    time
+
+    Only `columns` are kept from each record as it is parsed, so fields that
+    aren't wanted are never held in memory, and every batch has the same
+    columns in the same order (missing fields are None).
+
+    Parameters
+    ----------
+    input_path :
+        Local path or s3 path of the JSONL file
+    columns :
+        Columns to keep
+    batch_size : optional
+        Most rows in a batch. By default the whole file is one batch, which
+        is yielded even if the file is empty.
+
+    Yields
+    ------
+        Dictionaries of column name to list of values
+    """
+    batch = {col: [] for col in columns}
+    n_rows = 0
+    for line in iter_jsonl_lines(input_path):
+        if not line.strip():
+            continue
+        record = loads(line)
+        for col, values in batch.items():
+            values.append(record.get(col))
+        n_rows += 1
+        if n_rows == batch_size:
+            yield batch
+            batch = {col: [] for col in columns}
+            n_rows = 0
+    if n_rows or not batch_size:
+        yield batch
+
+
+def _json_default(value):
+    if value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _dates_to_strings(df: pd.DataFrame) -> pd.DataFrame:
+    """Writes date and datetime columns as strings, as arrow_pd_parser's
+    JSONL writer does"""
+    for col in df.columns:
+        non_null = df[col].dropna()
+        if pd.api.types.is_datetime64_any_dtype(df[col]) or (
+            len(non_null) > 0
+            and isinstance(non_null.iloc[0], (datetime.datetime, datetime.date))
+        ):
+            df = df.assign(**{col: df[col].astype(pd.StringDtype())})
+    return df
+
+
+def write_jsonl(df: pd.DataFrame, output_path: str) -> int:
+    """Writes a dataframe to a local or s3 JSONL file
+
+    Drop-in for `arrow_pd_parser.writer.write` on JSONL files. Missing values
+    are written as null.
+
+    Parameters
+    ----------
+    df :
+        Dataframe to write
+    output_path :
+        Local path or s3 path of the file to write
+
+    Returns
+    -------
+        Size of the written file in bytes
+    """
+    records = _dates_to_strings(df).to_dict(orient="records")
+    body = dumps_lines(records, default=_json_default)
+    if output_path.startswith("s3://"):
+        write_bytes_to_s3(output_path, body)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        with open(output_path, "wb") as f:
+            f.write(body)
+    return len(body)
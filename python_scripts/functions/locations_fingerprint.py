@@ -0,0 +1,264 @@
+"""
+Conditional fetch of the locations hierarchy.
+
+The locations endpoint returns the whole hierarchy on every run, although it
+rarely changes. With --conditional-locations, a fingerprint of each day's
+response is kept at
+`s3://{raw_hist_bucket}/corporate/matrix/fingerprints/locations/{date}.json`:
+its ETag and Last-Modified headers when the API sends them, a hash of the
+body, and the scrape date whose partition holds that data.
+
+The next run sends If-None-Match/If-Modified-Since from the previous
+fingerprint. On a 304, or a body with the same hash, the response is not
+normalised, no raw file is written and the locations validation is skipped.
+The clean step then rewrites the previous partition with the new scrape
+date, straight from its parquet file (or its compacted month's file, see
+compaction.py), rather than reading the raw data. Those
+days have no file in the pass folder, so rebuild_all_s3_data_from_raw
+recreates them from their source day's rebuilt partition, using the
+fingerprints' source dates.
+Only the snapshot locations mode is handled;
+scd2 mode only stores changes anyway.
+"""
+import hashlib
+import io
+import re
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from constants import (
+    conditional_locations,
+    locations_mode,
+    meta_path_locations,
+    raw_hist_bucket,
+)
+from fast_json import dumps, loads
+from functions.parquet_helpers import read_parquet_options, write_parquet_table
+from functions.table_locations import get_compacted_partition, partition_folder
+from metrics import run_metrics
+from s3_utils import (
+    get_matching_s3_keys,
+    get_object_size,
+    read_bytes_from_s3,
+    s3_path_to_bucket_key,
+    write_bytes_to_s3,
+)
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+FINGERPRINT_PREFIX = "corporate/matrix/fingerprints/locations/"
+
+
+def enabled() -> bool:
+    return conditional_locations and locations_mode == "snapshot"
+
+
+def fingerprint_path(scrape_date: str) -> str:
+    return f"s3://{raw_hist_bucket}/{FINGERPRINT_PREFIX}{scrape_date}.json"
+
+
+def partition_path(scrape_date: str) -> str:
+    return f"{partition_folder('locations', scrape_date)}/{scrape_date}.parquet"
+
+
+def locations_partition_files(scrape_date: str) -> list:
+    """The parquet files holding the locations loaded for `scrape_date`: its
+    daily partition, or its month's files once compaction.py has compacted
+    the month. Empty if there are none."""
+    if get_object_size(partition_path(scrape_date)) is not None:
+        return [partition_path(scrape_date)]
+    partition = get_compacted_partition("locations", scrape_date[:7])
+    if partition is None:
+        return []
+    bucket, prefix = s3_path_to_bucket_key(partition["StorageDescriptor"]["Location"])
+    return [
+        f"s3://{bucket}/{key}"
+        for key in get_matching_s3_keys(bucket, prefix, ".parquet")
+    ]
+
+
+def read_locations_partition(scrape_date: str) -> pa.Table:
+    """The locations loaded for `scrape_date`. A compacted month's files hold
+    every day of the month, so only that day's rows are kept."""
+    tables = []
+    for path in locations_partition_files(scrape_date):
+        table = pq.read_table(io.BytesIO(read_bytes_from_s3(path)))
+        if path != partition_path(scrape_date):
+            day = pc.utf8_slice_codeunits(
+                pc.cast(table["scrape_date"], pa.string()), 0, 10
+            )
+            table = table.filter(pc.equal(day, scrape_date))
+        tables.append(table)
+    return pa.concat_tables(tables)
+
+
+def read_fingerprint(scrape_date: str) -> dict:
+    """The fingerprint written for a scrape date, or None"""
+    if get_object_size(fingerprint_path(scrape_date)) is None:
+        return None
+    return loads(read_bytes_from_s3(fingerprint_path(scrape_date)))
+
+
+def previous_fingerprint(scrape_date: str) -> dict:
+    """The fingerprint of the latest scrape date before `scrape_date`, or None
+
+    A fingerprint whose partition doesn't exist (e.g. the clean step of that
+    day never ran) is ignored, so missing data is never reused.
+    """
+    dates = [
+        match.group(1)
+        for key in get_matching_s3_keys(raw_hist_bucket, FINGERPRINT_PREFIX, ".json")
+        for match in [re.search(r"(\d{4}-\d{2}-\d{2})\.json$", key)]
+        if match and match.group(1) < scrape_date
+    ]
+    if not dates:
+        return None
+    fingerprint = read_fingerprint(max(dates))
+    if not locations_partition_files(fingerprint["source_date"]):
+        logger.info(
+            f"No locations partition for {fingerprint['source_date']}, "
+            "so not comparing with it"
+        )
+        return None
+    return fingerprint
+
+
+def conditional_headers(fingerprint: dict) -> dict:
+    """Request headers that let the API answer 304 if nothing has changed"""
+    headers = {}
+    if fingerprint and fingerprint.get("etag"):
+        headers["If-None-Match"] = fingerprint["etag"]
+    if fingerprint and fingerprint.get("last_modified"):
+        headers["If-Modified-Since"] = fingerprint["last_modified"]
+    return headers
+
+
+def payload_hash(body: bytes) -> str:
+    return hashlib.sha256(body).hexdigest()
+
+
+def check_unchanged(
+    scrape_date: str, previous: dict, status: int, headers: dict, body: bytes
+) -> bool:
+    """Decides whether the response matches the previous fingerprint, and
+    writes the fingerprint for `scrape_date`"""
+    unchanged = previous is not None and (
+        status == 304 or payload_hash(body) == previous.get("sha256")
+    )
+    if status == 304:
+        # Nothing new to hash, carry the previous fingerprint forward
+        fingerprint = {**previous, "unchanged": True}
+    else:
+        fingerprint = {
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "sha256": payload_hash(body),
+            "source_date": previous["source_date"] if unchanged else scrape_date,
+            "unchanged": unchanged,
+        }
+    write_bytes_to_s3(fingerprint_path(scrape_date), dumps(fingerprint))
+    run_metrics.add("locations_unchanged", int(unchanged))
+    return unchanged
+
+
+def locations_unchanged(scrape_date: str) -> bool:
+    """Whether the scrape for `scrape_date` found the same locations as the
+    day before, so there is no raw file to validate or clean"""
+    if not enabled():
+        return False
+    fingerprint = read_fingerprint(scrape_date)
+    return bool(fingerprint and fingerprint.get("unchanged"))
+
+
+def reused_days() -> dict:
+    """Maps each scrape date whose unchanged locations were reused to the
+    scrape date whose partition they were reused from"""
+    days = {}
+    for key in get_matching_s3_keys(raw_hist_bucket, FINGERPRINT_PREFIX, ".json"):
+        match = re.search(r"(\d{4}-\d{2}-\d{2})\.json$", key)
+        if match:
+            fingerprint = read_fingerprint(match.group(1))
+            if fingerprint.get("unchanged"):
+                days[match.group(1)] = fingerprint["source_date"]
+    return days
+
+
+def restamp_partition(table: pa.Table, scrape_date: str) -> pa.Table:
+    """A partition's rows with the scrape date and ingestion timestamp of
+    `scrape_date`
+
+    The file can't simply be copied, as each row carries its scrape date and
+    ingestion timestamp, so those two columns are replaced and the rest are
+    kept as they are, without going through pandas.
+    """
+    values = {
+        "scrape_date": datetime.strptime(scrape_date, "%Y-%m-%d").date(),
+        "ingestion_timestamp": datetime.now(),
+    }
+    for name, value in values.items():
+        index = table.schema.get_field_index(name)
+        if index >= 0:
+            field = table.schema.field(index)
+            column = pa.array([value] * table.num_rows, type=field.type)
+            table = table.set_column(index, field, column)
+    return table
+
+
+def reuse_locations_partition(scrape_date: str):
+    """Writes the partition for `scrape_date` from the partition the
+    unchanged locations were loaded into"""
+    source_date = read_fingerprint(scrape_date)["source_date"]
+    table = read_locations_partition(source_date)
+    run_metrics.add_rows(table.num_rows)
+    write_parquet_table(
+        restamp_partition(table, scrape_date),
+        partition_path(scrape_date),
+        read_parquet_options(meta_path_locations),
+    )
+    logger.info(f"locations data for {scrape_date} reused from {source_date}.")
+
+
+def rebuild_reused_partitions(output_root: str, rebuilt: dict) -> dict:
+    """Writes the partitions of the days whose locations were reused, from
+    their source days' rebuilt partitions
+
+    Those days have no file in the pass folder, so rebuilding from it alone
+    would leave them out.
+
+    Parameters
+    ----------
+    output_root :
+        Folder the locations table was rebuilt into
+    rebuilt :
+        Rows written for each day rebuilt from the pass folder
+
+    Returns
+    -------
+        Rows written for each reused day
+    """
+    rows = {}
+    options = read_parquet_options(meta_path_locations)
+    for scrape_date, source_date in sorted(reused_days().items()):
+        if scrape_date in rebuilt:
+            continue
+        if source_date not in rebuilt:
+            logger.info(
+                f"No rebuilt locations for {source_date}, "
+                f"so {scrape_date} can't be reused from it"
+            )
+            continue
+        source = f"{output_root}/scrape_date={source_date}/{source_date}.parquet"
+        table = pq.read_table(io.BytesIO(read_bytes_from_s3(source)))
+        write_parquet_table(
+            restamp_partition(table, scrape_date),
+            f"{output_root}/scrape_date={scrape_date}/{scrape_date}.parquet",
+            options,
+        )
+        rows[scrape_date] = table.num_rows
+        logger.info(f"locations data for {scrape_date} reused from {source_date}.")
+    return rows
@@ -0,0 +1,245 @@
+"""
+Change-only (SCD2) storage for the daily locations snapshots.
+
+The locations endpoint returns the whole hierarchy every day, although it
+rarely changes. In scd2 mode each day's locations are compared with the state
+as of the previous change, and only inserted, updated and deleted locations
+are written to `locations_changes`, partitioned by `change_date`.
+
+`locations_history` derives `valid_from`/`valid_to` for each version of a
+location from the change dates, and `locations_current` shows the versions
+that are still valid.
+
+The state after each change is kept at
+`{db_location}/locations_changes_state/as_of=YYYY-MM-DD/state.parquet`, so
+re-running a day diffs against the state before that day and gives the same
+result.
+"""
+import re
+from datetime import datetime
+
+import awswrangler as wr
+import boto3
+import pandas as pd
+from mojap_metadata import Metadata
+from mojap_metadata.converters.glue_converter import GlueConverter
+
+from athena import run_athena_query
+from constants import db_location, db_name, meta_path_locations, region_name
+from functions.data_validation import (
+    list_s3_files,
+    read_cleaned_data,
+)
+from functions.partitions import refresh_new_partition
+from functions.parquet_helpers import read_parquet_options, write_parquet
+from metrics import run_metrics
+from s3_utils import delete_all_matching_s3_objects, s3_path_to_bucket_key
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+CHANGES_TABLE = "locations_changes"
+CHANGES_LOCATION = f"{db_location}/{CHANGES_TABLE}"
+STATE_LOCATION = f"{db_location}/{CHANGES_TABLE}_state"
+
+# Columns that change every day without the location changing
+NON_BUSINESS_COLUMNS = ["scrape_date", "ingestion_timestamp"]
+
+
+def changes_metadata() -> Metadata:
+    """Locations metadata with the change columns, partitioned by change_date"""
+    metadata = Metadata.from_json(meta_path_locations)
+    metadata.name = CHANGES_TABLE
+    metadata.remove_column("scrape_date")
+    metadata.update_column(
+        {
+            "name": "change_type",
+            "type": "string",
+            "description": "insert, update or delete",
+        }
+    )
+    metadata.update_column(
+        {
+            "name": "row_hash",
+            "type": "string",
+            "description": "Hash of the location's attributes, used to detect updates",
+        }
+    )
+    metadata.update_column(
+        {
+            "name": "change_date",
+            "type": "date64",
+            "description": "Scrape date on which the change was first seen",
+        }
+    )
+    return metadata
+
+
+def business_columns(metadata: Metadata) -> list[str]:
+    return [c for c in metadata.column_names if c not in NON_BUSINESS_COLUMNS]
+
+
+def add_row_hash(df: pd.DataFrame, columns: list[str]) -> pd.DataFrame:
+    """Hashes the attributes of each location. Values are hashed as strings so
+    the hash doesn't depend on the dtypes the frame was read with."""
+    df = df.copy()
+    df["row_hash"] = (
+        pd.util.hash_pandas_object(df[columns].astype("string"), index=False)
+        .astype("uint64")
+        .astype(str)
+    )
+    return df
+
+
+def diff_locations(previous: pd.DataFrame, current: pd.DataFrame) -> pd.DataFrame:
+    """Finds the inserted, updated and deleted locations
+
+    Parameters
+    ----------
+    previous :
+        State before this scrape, with row_hash
+    current :
+        This scrape's locations, with row_hash
+
+    Returns
+    -------
+        Changed rows with a change_type column. Deleted rows carry the
+        previous attributes.
+    """
+    previous_hashes = previous.set_index("id")["row_hash"]
+    current_hashes = current.set_index("id")["row_hash"]
+
+    inserted = current[~current["id"].isin(previous_hashes.index)]
+    common = current[current["id"].isin(previous_hashes.index)]
+    updated = common[
+        common["row_hash"].values != previous_hashes.loc[common["id"]].values
+    ]
+    deleted = previous[~previous["id"].isin(current_hashes.index)]
+
+    return pd.concat(
+        [
+            inserted.assign(change_type="insert"),
+            updated.assign(change_type="update"),
+            deleted.assign(change_type="delete"),
+        ],
+        ignore_index=True,
+    )
+
+
+def state_dates() -> list[str]:
+    files = list_s3_files(f"{STATE_LOCATION}/")
+    dates = set()
+    for file in files:
+        match = re.search(r"as_of=(\d{4}-\d{2}-\d{2})/", file)
+        if match:
+            dates.add(match.group(1))
+    return sorted(dates)
+
+
+def read_state(as_of: str, columns: list[str]) -> pd.DataFrame:
+    if as_of is None:
+        return pd.DataFrame(columns=columns + ["row_hash"])
+    with run_metrics.call("s3", "get"):
+        return wr.s3.read_parquet(f"{STATE_LOCATION}/as_of={as_of}/state.parquet")
+
+
+def ensure_changes_table():
+    """Creates the changes table and the history and current views if needed"""
+    glue_client = boto3.client("glue", region_name=region_name)
+    metadata = changes_metadata()
+    metadata.partitions = ["change_date"]
+    schema = GlueConverter().generate_from_meta(
+        metadata, database_name=db_name, table_location=CHANGES_LOCATION
+    )
+    try:
+        with run_metrics.call("glue", "create_table"):
+            glue_client.create_table(**schema)
+        logger.info(f"Created {db_name}.{CHANGES_TABLE}")
+    except glue_client.exceptions.AlreadyExistsException:
+        return
+
+    run_athena_query(
+        f"""create or replace view {db_name}.locations_history as
+        select * from (
+            select c.*,
+            change_date as valid_from,
+            lead(change_date) over (partition by id order by change_date) as valid_to
+            from {db_name}.{CHANGES_TABLE} as c
+        )
+        where change_type <> 'delete'"""
+    )
+    run_athena_query(
+        f"""create or replace view {db_name}.locations_current as
+        select * from {db_name}.locations_history where valid_to is null"""
+    )
+
+
+def read_and_write_locations_changes(start_date: str):
+    """Writes the locations that changed since the previous state
+
+    Parameters
+    ----------
+    start_date :
+        Scrape date of the locations snapshot in the pass folder
+    """
+    ensure_changes_table()
+    df, metadata = read_cleaned_data(start_date, "locations")
+    columns = business_columns(metadata)
+    current = add_row_hash(df, columns).drop_duplicates("id", keep="last")
+
+    dates = state_dates()
+    later = [d for d in dates if d > start_date]
+    if later:
+        raise ValueError(
+            f"Locations state already exists for {later}, after {start_date}. "
+            "Changes must be applied in date order."
+        )
+    earlier = [d for d in dates if d < start_date]
+    previous = read_state(earlier[-1] if earlier else None, columns)
+
+    changes = diff_locations(previous, current)
+    counts = changes["change_type"].value_counts().to_dict()
+    logger.info(f"Location changes for {start_date}: {counts or 'none'}")
+    run_metrics.add_rows(len(changes))
+    if changes.empty:
+        # Clear anything left by an earlier run of the same day
+        for folder in (
+            f"{CHANGES_LOCATION}/change_date={start_date}/",
+            f"{STATE_LOCATION}/as_of={start_date}/",
+        ):
+            delete_all_matching_s3_objects(*s3_path_to_bucket_key(folder))
+        return
+
+    changes["change_date"] = datetime.strptime(start_date, "%Y-%m-%d").date()
+    changes["ingestion_timestamp"] = df["ingestion_timestamp"].max()
+    out_metadata = changes_metadata()
+    changes = changes.reindex(columns=out_metadata.column_names)
+    options = read_parquet_options(meta_path_locations)
+    write_parquet(
+        changes,
+        f"{CHANGES_LOCATION}/change_date={start_date}/{start_date}.parquet",
+        out_metadata,
+        options,
+    )
+
+    # The new state is everything in this snapshot
+    state_metadata = Metadata.from_json(meta_path_locations)
+    state_metadata.update_column({"name": "row_hash", "type": "string"})
+    write_parquet(
+        current.reindex(columns=state_metadata.column_names),
+        f"{STATE_LOCATION}/as_of={start_date}/state.parquet",
+        state_metadata,
+        options,
+    )
+    logger.info(f"Location changes for {start_date} written to s3.")
+
+
+def refresh_locations_changes_partition(start_date: str):
+    # Days without changes have no partition folder, which Athena treats as empty
+    return refresh_new_partition(
+        database_name=db_name,
+        table_name=CHANGES_TABLE,
+        scrape_date=start_date,
+        partition_column="change_date",
+    )
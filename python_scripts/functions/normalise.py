@@ -0,0 +1,161 @@
+import pandas as pd
+import pyarrow as pa
+from mojap_metadata import Metadata
+
+from functions.api_helpers import camel_to_snake_case
+from metrics import run_metrics
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+
+def pandas_normalise(records: list[dict], sep: str = "_") -> pd.DataFrame:
+    """Flattens nested records with pd.json_normalize, with snake case names"""
+    return pd.json_normalize(records, sep=sep).rename(
+        mapper=camel_to_snake_case, axis="columns"
+    )
+
+
+def flatten_struct_table(table: pa.Table, sep: str = "_") -> pa.Table:
+    """Flattens struct columns until none are left, joining the parent and
+    child field names with `sep`. List columns are left as they are."""
+    while any(pa.types.is_struct(field.type) for field in table.schema):
+        table = table.flatten()
+    return table.rename_columns([name.replace(".", sep) for name in table.column_names])
+
+
+def _record_keys(record: dict, prefix: str, sep: str) -> list[str]:
+    """Flattened keys of a record in pd.json_normalize order, which puts
+    nested fields after the scalar fields at the same level"""
+    keys = []
+    nested = []
+    for key, value in record.items():
+        name = f"{prefix}{sep}{key}" if prefix else key
+        if isinstance(value, dict):
+            nested.append((name, value))
+        else:
+            keys.append(name)
+    for name, value in nested:
+        keys.extend(_record_keys(value, name, sep))
+    return keys
+
+
+def json_normalize_order(records: list[dict], n_columns: int, sep: str = "_") -> list[str]:
+    """Column names in the order pd.json_normalize would give them, by first
+    appearance across the records. Stops reading records once `n_columns`
+    names have been seen."""
+    order = {}
+    for record in records:
+        for key in _record_keys(record, "", sep):
+            order.setdefault(key, None)
+        if len(order) >= n_columns:
+            break
+    return list(order)
+
+
+def arrow_normalise(records: list[dict], sep: str = "_") -> pd.DataFrame:
+    """Flattens nested records through a pyarrow table
+
+    The records are converted to a single struct array in one pass, the
+    structs are flattened column by column without copying, and only the
+    flat table is converted to pandas. This gives the same columns, in the
+    same order, as pandas_normalise for far less time and memory on records
+    with nested audit objects. String columns come back as `string[pyarrow]`,
+    and list fields as Python lists.
+
+    Records whose fields can't be given a single Arrow type (e.g. a field
+    that is a number in some records and text in others) fall back to
+    pandas_normalise.
+
+    Parameters
+    ----------
+    records :
+        Nested records as returned by the API
+    sep : optional
+        Separator between parent and child keys, by default "_"
+
+    Returns
+    -------
+        Flat dataframe with snake case column names
+    """
+    if not records:
+        return pd.DataFrame()
+    try:
+        struct_array = pa.array(records)
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        logger.warning(f"Falling back to pd.json_normalize: {e}")
+        return pandas_normalise(records, sep)
+
+    table = flatten_struct_table(pa.Table.from_struct_array(struct_array), sep)
+    # Arrow sorts struct fields by name, put them back in the API's order
+    names = set(table.column_names)
+    order = [n for n in json_normalize_order(records, len(names), sep) if n in names]
+    table = table.select(order + [n for n in table.column_names if n not in order])
+    table = table.rename_columns([camel_to_snake_case(n) for n in table.column_names])
+    # to_pandas would give numpy arrays for list fields, keep them as Python
+    # lists (of dicts, for lists of objects) as pd.json_normalize does
+    lists = {
+        name: table.column(name).to_pylist()
+        for name, field_type in zip(table.column_names, table.schema.types)
+        if pa.types.is_list(field_type) or pa.types.is_large_list(field_type)
+    }
+    df = table.to_pandas(
+        types_mapper={pa.string(): pd.StringDtype("pyarrow")}.get,
+        split_blocks=True,
+        self_destruct=True,
+    )
+    for name, values in lists.items():
+        df[name] = pd.Series(values, index=df.index, dtype=object)
+    return df
+
+
+NORMALISERS = {
+    "pandas": pandas_normalise,
+    "arrow": arrow_normalise,
+}
+
+
+def unknown_columns(columns: list[str], metadata: Metadata, renames: dict) -> list[str]:
+    """Columns of a normalised frame that aren't in the table's metadata once
+    renamed, i.e. fields the API has added since the metadata was written"""
+    expected = set(metadata.column_names)
+    return sorted(c for c in columns if renames.get(c, c) not in expected)
+
+
+def normalise_records(
+    records: list[dict],
+    metadata: Metadata,
+    renames: dict,
+    normaliser: str = "pandas",
+) -> pd.DataFrame:
+    """Flattens nested API records into a dataframe and reports unknown fields
+
+    Parameters
+    ----------
+    records :
+        Nested records as returned by the API
+    metadata :
+        mojap Metadata of the table the records are for
+    renames :
+        Column renames applied before the metadata is checked
+    normaliser : optional
+        "pandas" or "arrow", by default "pandas"
+
+    Returns
+    -------
+        Flat dataframe with snake case column names. Unknown fields are kept,
+        as they are allowed in the raw data.
+    """
+    if normaliser not in NORMALISERS:
+        raise ValueError(
+            f"Unknown normaliser {normaliser}, expected one of {list(NORMALISERS)}"
+        )
+    df = NORMALISERS[normaliser](records)
+    unknown = unknown_columns(df.columns, metadata, renames)
+    run_metrics.add("unknown_fields", len(unknown))
+    if unknown:
+        logger.warning(
+            f"{len(unknown)} fields not in {metadata.name} metadata: {unknown}",
+        )
+    return df
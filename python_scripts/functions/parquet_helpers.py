@@ -0,0 +1,184 @@
+import json
+import os
+import tempfile
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from mojap_metadata import Metadata
+from mojap_metadata.converters.arrow_converter import ArrowConverter
+
+from metrics import run_metrics
+from s3_utils import upload_file_to_s3, write_bytes_to_s3
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+DEFAULT_PARQUET_OPTIONS = {
+    "sort_by": [],
+    "compression": "snappy",
+    "compression_level": None,
+    "row_group_size": None,
+    "write_statistics": True,
+    "dictionary_columns": None,
+}
+
+
+def read_parquet_options(meta_path: str) -> dict:
+    """Reads the parquet write options that sit alongside a table's metadata
+
+    For `metadata/{env}/bookings.json` these are in
+    `metadata/{env}/bookings_parquet.json`. Any option not set there falls back
+    to DEFAULT_PARQUET_OPTIONS.
+
+    Parameters
+    ----------
+    meta_path :
+        Path of the table's metadata JSON
+
+    Returns
+    -------
+        Dictionary of parquet write options
+    """
+    options = dict(DEFAULT_PARQUET_OPTIONS)
+    options_path = meta_path.replace(".json", "_parquet.json")
+    if os.path.exists(options_path):
+        with open(options_path) as f:
+            options.update(json.load(f))
+    else:
+        logger.info(f"No parquet options at {options_path}, using defaults")
+    return options
+
+
+def sort_for_layout(df: pd.DataFrame, options: dict) -> pd.DataFrame:
+    """Sorts the dataframe by the `sort_by` columns, so row group statistics
+    are tight and Athena can skip row groups when filtering on them."""
+    sort_by = [col for col in options.get("sort_by") or [] if col in df.columns]
+    if not sort_by:
+        return df
+    return df.sort_values(sort_by, kind="stable", na_position="last", ignore_index=True)
+
+
+def parquet_writer_kwargs(options: dict, schema: pa.Schema) -> dict:
+    """Translates the parquet options into pyarrow.parquet writer arguments"""
+    dictionary_columns = options.get("dictionary_columns")
+    if dictionary_columns is None:
+        use_dictionary = True
+    else:
+        use_dictionary = [col for col in dictionary_columns if col in schema.names]
+    kwargs = {
+        "compression": options.get("compression") or "snappy",
+        "use_dictionary": use_dictionary,
+        "write_statistics": options.get("write_statistics", True),
+    }
+    if options.get("compression_level") is not None:
+        kwargs["compression_level"] = options["compression_level"]
+    return kwargs
+
+
+def to_arrow_table(df: pd.DataFrame, metadata: Metadata) -> pa.Table:
+    """Converts a dataframe already cast to the metadata into an arrow table
+    with the metadata's schema."""
+    schema = ArrowConverter().generate_from_meta(metadata)
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+
+def write_parquet(
+    df: pd.DataFrame, output_path: str, metadata: Metadata, options: dict
+) -> int:
+    """Writes a dataframe to a parquet file laid out for Athena
+
+    Rows are sorted by the `sort_by` columns and written in row groups of
+    `row_group_size` rows, with the configured codec, dictionary encoding for
+    the `dictionary_columns` and min/max statistics on every column.
+
+    Parameters
+    ----------
+    df :
+        Dataframe cast to the metadata
+    output_path :
+        Local path or s3 path of the file to write
+    metadata :
+        mojap Metadata of the table
+    options :
+        Parquet options, see read_parquet_options
+
+    Returns
+    -------
+        Size of the written file in bytes
+    """
+    table = to_arrow_table(sort_for_layout(df, options), metadata)
+    return write_parquet_table(table, output_path, options)
+
+
+def write_parquet_table(table: pa.Table, output_path: str, options: dict) -> int:
+    """Writes an arrow table to a local or s3 parquet file with the
+    configured layout. The rows are written in the order they are in."""
+    sink = pa.BufferOutputStream()
+    pq.write_table(
+        table,
+        sink,
+        row_group_size=options.get("row_group_size"),
+        **parquet_writer_kwargs(options, table.schema),
+    )
+    body = sink.getvalue().to_pybytes()
+    if output_path.startswith("s3://"):
+        write_bytes_to_s3(output_path, body)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+        with open(output_path, "wb") as f:
+            f.write(body)
+    run_metrics.add("bytes", len(body))
+    return len(body)
+
+
+def write_parquet_batches(
+    batches, output_path: str, metadata: Metadata, options: dict
+) -> int:
+    """Writes dataframes to one parquet file, a batch at a time
+
+    Each batch is sorted by the `sort_by` columns and appended as one or
+    more row groups, so only one batch has to be in memory at once. Rows are
+    sorted within a batch, not across the file. An s3 output is written to a
+    local temporary file first and then uploaded.
+
+    Parameters
+    ----------
+    batches :
+        Iterable of dataframes cast to the metadata
+    output_path :
+        Local path or s3 path of the file to write
+    metadata :
+        mojap Metadata of the table
+    options :
+        Parquet options, see read_parquet_options
+
+    Returns
+    -------
+        Size of the written file in bytes
+    """
+    schema = ArrowConverter().generate_from_meta(metadata)
+    to_s3 = output_path.startswith("s3://")
+    if to_s3:
+        fd, local_path = tempfile.mkstemp(suffix=".parquet")
+        os.close(fd)
+    else:
+        local_path = output_path
+        os.makedirs(os.path.dirname(os.path.abspath(local_path)), exist_ok=True)
+    try:
+        with pq.ParquetWriter(
+            local_path, schema, **parquet_writer_kwargs(options, schema)
+        ) as writer:
+            for df in batches:
+                table = pa.Table.from_pandas(
+                    sort_for_layout(df, options), schema=schema, preserve_index=False
+                )
+                writer.write_table(table, row_group_size=options.get("row_group_size"))
+        size = os.path.getsize(local_path)
+        if to_s3:
+            upload_file_to_s3(local_path, output_path)
+    finally:
+        if to_s3:
+            os.remove(local_path)
+    run_metrics.add("bytes", size)
+    return size
@@ -0,0 +1,49 @@
+"""
+Registers each day's partitions with Athena.
+
+Kept apart from data_validation, so the partition refresh steps don't have to
+import the validation and cleaning libraries.
+"""
+import athena
+from athena import run_athena_query
+from constants import athena_history_path, athena_workgroup, db_name, region_name
+from functions.table_locations import daily_table
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# Every Athena query in the process runs with the pipeline's options
+athena.configure(
+    region_name=region_name,
+    workgroup=athena_workgroup,
+    history_path=athena_history_path,
+)
+
+
+def refresh_new_partition(
+    database_name: str,
+    table_name: str,
+    scrape_date: str,
+    partition_column: str = "scrape_date",
+):
+    query_string = f"""alter table awsdatacatalog.{database_name}.{table_name} 
+                add if not exists partition ({partition_column} = '{scrape_date}')"""
+    logger.info(f"Athena Query: adding {scrape_date} partition to \
+                {database_name}.{table_name}")
+    resp = run_athena_query(query_string)
+    return resp
+
+
+def refresh_new_partition_bookings(start_date):
+    resp = refresh_new_partition(database_name=db_name,
+                          table_name=daily_table("bookings"),
+                          scrape_date=start_date)
+    return resp
+
+
+def refresh_new_partition_locations(start_date):
+    resp = refresh_new_partition(database_name=db_name,
+                          table_name=daily_table("locations"),
+                          scrape_date=start_date)
+    return resp
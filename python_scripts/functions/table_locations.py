@@ -0,0 +1,67 @@
+"""
+Where each table's daily partitions are written.
+
+Tables normally read from `{db_location}/{table}`, but after a shadow build
+(see shadow_build.py) they read from a versioned folder instead. Anything
+that writes or lists a table's partitions asks for its location here, so new
+days land wherever the live table points.
+
+Once a table's first month has been compacted (see compaction.py), its name
+is a view of the daily partitions and the compacted months, and the daily
+partitions belong to `{table}_daily`. `daily_table` gives the Glue table that
+holds them either way.
+"""
+from functools import lru_cache
+
+import boto3
+
+from constants import db_location, db_name, region_name
+from glue_schema import get_table
+from metrics import run_metrics
+
+glue_client = boto3.client("glue", region_name=region_name)
+
+
+@lru_cache(maxsize=None)
+def daily_table(name: str) -> str:
+    """The Glue table holding the daily partitions of the table `name`
+
+    The answer is cached for the rest of the run.
+    """
+    if get_table(glue_client, db_name, f"{name}_daily") is not None:
+        return f"{name}_daily"
+    return name
+
+
+@lru_cache(maxsize=None)
+def table_root(name: str) -> str:
+    """The live location of the table `name`, without a trailing slash
+
+    Falls back to `{db_location}/{name}` if the table isn't in Glue yet. The
+    answer is cached for the rest of the run.
+    """
+    table = get_table(glue_client, db_name, daily_table(name))
+    if table is None:
+        return f"{db_location}/{name}"
+    return table["StorageDescriptor"]["Location"].rstrip("/")
+
+
+def partition_folder(name: str, scrape_date: str) -> str:
+    return f"{table_root(name)}/scrape_date={scrape_date}"
+
+
+def compacted_table_name(name: str) -> str:
+    return f"{name}_compacted"
+
+
+def get_compacted_partition(name: str, month: str) -> dict:
+    """The Glue partition for a compacted month, or None if not compacted yet"""
+    try:
+        with run_metrics.call("glue", "get_partition"):
+            return glue_client.get_partition(
+                DatabaseName=db_name,
+                TableName=compacted_table_name(name),
+                PartitionValues=[month],
+            )["Partition"]
+    except glue_client.exceptions.EntityNotFoundException:
+        return None
@@ -0,0 +1,266 @@
+"""
+In-process validation of the raw JSONL files against the table metadata.
+
+An alternative to `data_linter.validation.run_validation` for the configs
+built by `data_validation.create_config`. The land file is read once, every
+column is checked with whole-column pandas operations (type, nullability,
+enum, pattern, min/max and datetime format), and the result is returned
+directly. The file is then copied to the pass or fail folder and a log
+written, with the same names data_linter uses, so the clean step and
+`get_latest_file` work either way.
+"""
+import os
+from dataclasses import asdict, dataclass, field
+from datetime import datetime
+
+import pandas as pd
+from mojap_metadata import Metadata
+
+from fast_json import dumps
+from functions.jsonl_helpers import read_jsonl_records
+from metrics import run_metrics
+from s3_utils import copy_s3_object, delete_s3_object, write_bytes_to_s3
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+DEFAULT_DATE_FORMAT = "%Y-%m-%d"
+DEFAULT_DATETIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+SAMPLE_SIZE = 5
+
+
+@dataclass
+class ColumnFailure:
+    column: str
+    test: str
+    failed_rows: int
+    sample: list = field(default_factory=list)
+
+
+@dataclass
+class ValidationResult:
+    table: str
+    original_path: str
+    rows: int = 0
+    failures: list = field(default_factory=list)
+    archived_path: str = None
+
+    @property
+    def valid(self) -> bool:
+        return not self.failures
+
+    def to_dict(self) -> dict:
+        return {"valid": self.valid, **asdict(self)}
+
+
+def _failure(column: str, test: str, col: pd.Series, failed: pd.Series):
+    """A ColumnFailure for the rows flagged in `failed`, or None if there
+    are none"""
+    failed = failed.fillna(False).astype(bool)
+    n_failed = int(failed.sum())
+    if not n_failed:
+        return None
+    sample = col[failed].head(SAMPLE_SIZE).astype(str).tolist()
+    return ColumnFailure(column, test, n_failed, sample)
+
+
+def _present(col: pd.Series) -> pd.Series:
+    """Rows with a value, treating empty strings as missing as data_linter does"""
+    return col.notna() & (col.astype(str) != "")
+
+
+def type_test(col: pd.Series, meta_col: dict) -> pd.Series:
+    """Rows whose value can't be cast to the column's type"""
+    col_type = meta_col["type"]
+    present = _present(col)
+    if col_type.startswith("int"):
+        numeric = pd.to_numeric(col.where(present), errors="coerce")
+        return present & (numeric.isna() | (numeric % 1 != 0))
+    if col_type.startswith(("float", "decimal")):
+        return present & pd.to_numeric(col.where(present), errors="coerce").isna()
+    if col_type.startswith("bool"):
+        return present & ~col.isin([True, False, "true", "false", "True", "False"])
+    if col_type.startswith(("timestamp", "date")):
+        default = DEFAULT_DATE_FORMAT if col_type.startswith("date") else DEFAULT_DATETIME_FORMAT
+        parsed = pd.to_datetime(
+            col.where(present),
+            format=meta_col.get("datetime_format", default),
+            errors="coerce",
+        )
+        failed = present & parsed.isna()
+        if col_type.startswith("date"):
+            failed |= parsed.notna() & (parsed != parsed.dt.normalize())
+        return failed
+    return pd.Series(False, index=col.index)
+
+
+def nullable_test(col: pd.Series, meta_col: dict) -> pd.Series:
+    return col.isna()
+
+
+def enum_test(col: pd.Series, meta_col: dict) -> pd.Series:
+    allowed = col.isin(meta_col["enum"])
+    if meta_col.get("nullable", True):
+        allowed |= col.isna()
+    return ~allowed
+
+
+def pattern_test(col: pd.Series, meta_col: dict) -> pd.Series:
+    present = col.notna()
+    return present & ~col.where(present).astype(str).str.match(meta_col["pattern"])
+
+
+def min_max_test(col: pd.Series, meta_col: dict) -> pd.Series:
+    numeric = pd.to_numeric(col, errors="coerce")
+    failed = pd.Series(False, index=col.index)
+    if meta_col.get("minimum") is not None:
+        failed |= numeric < meta_col["minimum"]
+    if meta_col.get("maximum") is not None:
+        failed |= numeric > meta_col["maximum"]
+    return failed
+
+
+def min_max_length_test(col: pd.Series, meta_col: dict) -> pd.Series:
+    lengths = col.where(col.notna()).astype(str).str.len().where(col.notna())
+    failed = pd.Series(False, index=col.index)
+    if meta_col.get("minLength") is not None:
+        failed |= lengths < meta_col["minLength"]
+    if meta_col.get("maxLength") is not None:
+        failed |= lengths > meta_col["maxLength"]
+    return failed
+
+
+def column_tests(meta_col: dict) -> dict:
+    """The tests that apply to a metadata column"""
+    tests = {"type": type_test}
+    if meta_col.get("nullable") is False:
+        tests["nullable"] = nullable_test
+    if "enum" in meta_col:
+        tests["enum"] = enum_test
+    if "pattern" in meta_col:
+        tests["pattern"] = pattern_test
+    if "minimum" in meta_col or "maximum" in meta_col:
+        tests["min_max"] = min_max_test
+    if "minLength" in meta_col or "maxLength" in meta_col:
+        tests["min_max_length"] = min_max_length_test
+    return tests
+
+
+def validate_frame(
+    df: pd.DataFrame, metadata: Metadata, table_params: dict, result: ValidationResult
+) -> ValidationResult:
+    """Checks a raw dataframe against the metadata
+
+    Parameters
+    ----------
+    df :
+        Raw data, uncast
+    metadata :
+        mojap Metadata of the table
+    table_params :
+        The table's entry in the data_linter config, for allow-missing-cols
+        and allow-unexpected-data
+    result :
+        Result to add the failures to
+
+    Returns
+    -------
+        The result, with its failures filled in
+    """
+    result.rows = len(df)
+    meta_cols = [c for c in metadata.columns if c["name"] not in metadata.partitions]
+    meta_names = [c["name"] for c in meta_cols]
+    missing = [name for name in meta_names if name not in df.columns]
+    unexpected = [name for name in df.columns if name not in meta_names]
+
+    if len(missing) == len(meta_names):
+        result.failures.append(
+            ColumnFailure("*", "no columns in common with the metadata", result.rows)
+        )
+        return result
+    if missing and not table_params.get("allow-missing-cols", False):
+        result.failures.append(ColumnFailure("*", "missing columns", result.rows, missing))
+    if unexpected and not table_params.get("allow-unexpected-data", False):
+        result.failures.append(
+            ColumnFailure("*", "unexpected columns", result.rows, unexpected)
+        )
+
+    for meta_col in meta_cols:
+        name = meta_col["name"]
+        if name not in df.columns:
+            continue
+        for test_name, test in column_tests(meta_col).items():
+            failure = _failure(name, test_name, df[name], test(df[name], meta_col))
+            if failure is not None:
+                result.failures.append(failure)
+    return result
+
+
+def out_path(base_path: str, table: str, ts: int, file_path: str, filenum: int) -> str:
+    """Where data_linter would archive the file,
+    `{table}/{stem}-{filenum}-{ts}.{ext}`"""
+    stem, ext = os.path.basename(file_path).split(".", 1)
+    return os.path.join(base_path, table, f"{stem}-{filenum}-{ts}.{ext}")
+
+
+def run_vectorised_validation(config: dict, land_files: list[str]) -> list[ValidationResult]:
+    """Validates the land files for the single table in a data_linter config
+
+    Files that pass are copied to the pass folder and removed from land if
+    `remove-tables-on-pass` is set. Files that fail are copied to the fail
+    folder and left in land. A log of each result is written under
+    `log-base-path`.
+
+    Parameters
+    ----------
+    config :
+        Config from data_validation.create_config
+    land_files :
+        The table's files in `land-base-path`
+
+    Returns
+    -------
+        One ValidationResult per file
+    """
+    table, table_params = next(iter(config["tables"].items()))
+    metadata = Metadata.from_json(table_params["metadata"])
+    ts = int(datetime.utcnow().timestamp())
+
+    results = []
+    for file_path in land_files:
+        result = ValidationResult(table=table, original_path=file_path)
+        try:
+            df = pd.DataFrame.from_records(read_jsonl_records(file_path))
+            validate_frame(df, metadata, table_params, result)
+        except ValueError as e:
+            # Raised by the JSON parser on a malformed line
+            result.failures.append(ColumnFailure("*", "parse", 0, [str(e)]))
+        run_metrics.add_rows(result.rows)
+        results.append(result)
+
+    # Only touch S3 once every file has been checked
+    for filenum, result in enumerate(results):
+        if result.valid:
+            result.archived_path = out_path(
+                config["pass-base-path"], table, ts, result.original_path, filenum
+            )
+            copy_s3_object(result.original_path, result.archived_path)
+            if config.get("remove-tables-on-pass"):
+                delete_s3_object(result.original_path)
+            logger.info(f"{result.original_path} passed validation")
+        else:
+            result.archived_path = out_path(
+                config["fail-base-path"], table, ts, result.original_path, filenum
+            )
+            copy_s3_object(result.original_path, result.archived_path)
+            logger.error(
+                f"{result.original_path} failed validation: "
+                f"{[(f.column, f.test, f.failed_rows) for f in result.failures]}",
+                extra={"context": "VALIDATION"},
+            )
+        log_path = os.path.join(
+            config["log-base-path"], "tables", table, f"log-{table}-{filenum}-{ts}.json"
+        )
+        write_bytes_to_s3(log_path, dumps(result.to_dict(), default=str))
+    return results
@@ -0,0 +1,186 @@
+"""
+Schema migrations for the Glue tables.
+
+`migrate_table` compares the schema generated from a table's mojap Metadata
+(by GlueConverter) with the live Glue table. Added columns, and changed
+column or table descriptions, are applied with `update_table`, which keeps
+the table's location, parameters and partitions, so nothing has to be
+re-registered and queries keep working throughout. The data is parquet (or
+JSON in raw_hist), which Athena reads by column name, so the existing
+partitions simply return nulls for the new columns.
+
+Anything else (a removed column, a changed column type or different partition
+keys) would make the existing data unreadable, so it is refused, and the table
+has to be rebuilt instead (see database_builder_v2.py). A table that doesn't
+exist yet is created.
+
+Usage:
+    # Show what would change in matrix_prod
+    python python_scripts/database_builder_v2.py --env prod --migrate --dry-run
+
+    # Apply it
+    python python_scripts/database_builder_v2.py --env prod --migrate
+"""
+import boto3
+
+from metrics import run_metrics
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+# Keys of get_table's output that update_table accepts in its TableInput
+TABLE_INPUT_KEYS = (
+    "Name",
+    "Description",
+    "Owner",
+    "LastAccessTime",
+    "LastAnalyzedTime",
+    "Retention",
+    "StorageDescriptor",
+    "PartitionKeys",
+    "ViewOriginalText",
+    "ViewExpandedText",
+    "TableType",
+    "Parameters",
+    "TargetTable",
+)
+
+
+class IncompatibleSchemaChange(ValueError):
+    """The schema change can't be applied without rebuilding the table"""
+
+
+def get_table(glue_client, database_name: str, table_name: str) -> dict:
+    """The live Glue table, or None if it doesn't exist"""
+    try:
+        with run_metrics.call("glue", "get_table"):
+            return glue_client.get_table(DatabaseName=database_name, Name=table_name)[
+                "Table"
+            ]
+    except glue_client.exceptions.EntityNotFoundException:
+        return None
+
+
+def diff_columns(live: list[dict], wanted: list[dict]) -> dict:
+    """Compares two lists of Glue columns
+
+    Returns
+    -------
+        Lists of the column names that were added, removed, had their type
+        changed or had their comment changed in `wanted`
+    """
+    live_by_name = {col["Name"]: col for col in live}
+    wanted_names = {col["Name"] for col in wanted}
+    diff = {"added": [], "removed": [], "retyped": [], "redescribed": []}
+    for col in wanted:
+        old = live_by_name.get(col["Name"])
+        if old is None:
+            diff["added"].append(col["Name"])
+        elif old["Type"] != col["Type"]:
+            diff["retyped"].append(col["Name"])
+        elif old.get("Comment", "") != col.get("Comment", ""):
+            diff["redescribed"].append(col["Name"])
+    diff["removed"] = [col["Name"] for col in live if col["Name"] not in wanted_names]
+    return diff
+
+
+def table_input(table: dict) -> dict:
+    """The parts of a get_table response that can be passed back to update_table"""
+    return {key: value for key, value in table.items() if key in TABLE_INPUT_KEYS}
+
+
+def migrate_table(schema: dict, dry_run: bool = False, glue_client=None) -> dict:
+    """Brings a live Glue table in line with its generated schema
+
+    Parameters
+    ----------
+    schema :
+        Output of GlueConverter.generate_from_meta, i.e. create_table's
+        arguments
+    dry_run : optional
+        Only log the changes, don't apply them
+    glue_client : optional
+        By default a new eu-west-1 client
+
+    Returns
+    -------
+        The column diff, empty if the table was created
+
+    Raises
+    ------
+    IncompatibleSchemaChange
+        If columns were removed or retyped, or the partition keys changed
+    """
+    glue_client = glue_client or boto3.client("glue", region_name="eu-west-1")
+    database_name = schema["DatabaseName"]
+    wanted = schema["TableInput"]
+    name = f"{database_name}.{wanted['Name']}"
+
+    live = get_table(glue_client, database_name, wanted["Name"])
+    if live is None:
+        logger.info(f"{name} doesn't exist, creating it")
+        if not dry_run:
+            with run_metrics.call("glue", "create_table"):
+                glue_client.create_table(**schema)
+        return {}
+
+    diff = diff_columns(
+        live["StorageDescriptor"]["Columns"], wanted["StorageDescriptor"]["Columns"]
+    )
+    live_keys = [(col["Name"], col["Type"]) for col in live.get("PartitionKeys", [])]
+    wanted_keys = [(col["Name"], col["Type"]) for col in wanted.get("PartitionKeys", [])]
+    if diff["removed"] or diff["retyped"] or live_keys != wanted_keys:
+        raise IncompatibleSchemaChange(
+            f"{name} can't be migrated in place: removed {diff['removed']}, "
+            f"retyped {diff['retyped']}, partition keys {live_keys} -> {wanted_keys}. "
+            "Rebuild the table instead."
+        )
+
+    new_description = wanted.get("Description", "") != live.get("Description", "")
+    if not (diff["added"] or diff["redescribed"] or new_description):
+        logger.info(f"{name} is up to date")
+        return diff
+
+    logger.info(
+        f"{'Would update' if dry_run else 'Updating'} {name}: "
+        f"adding {diff['added']}, new descriptions for {diff['redescribed']}"
+        f"{' and the table' if new_description else ''}"
+    )
+    if not dry_run:
+        # Keep everything about the live table (location, serde, parameters,
+        # partition keys) apart from the columns and descriptions
+        updated = table_input(live)
+        updated["Description"] = wanted.get("Description", "")
+        updated["StorageDescriptor"] = {
+            **live["StorageDescriptor"],
+            "Columns": wanted["StorageDescriptor"]["Columns"],
+        }
+        with run_metrics.call("glue", "update_table"):
+            glue_client.update_table(DatabaseName=database_name, TableInput=updated)
+        run_metrics.add("columns_added", len(diff["added"]))
+    return diff
+
+
+def migrate_tables(schemas: list[dict], dry_run: bool = False, glue_client=None) -> dict:
+    """Runs migrate_table for each schema, after checking that none of them
+    needs a rebuild, so a database is never left half migrated
+
+    Returns
+    -------
+        The column diff of each table, by table name
+    """
+    glue_client = glue_client or boto3.client("glue", region_name="eu-west-1")
+    # Check everything first
+    diffs = {
+        schema["TableInput"]["Name"]: migrate_table(
+            schema, dry_run=True, glue_client=glue_client
+        )
+        for schema in schemas
+    }
+    if dry_run:
+        return diffs
+    return {
+        schema["TableInput"]["Name"]: migrate_table(schema, glue_client=glue_client)
+        for schema in schemas
+    }
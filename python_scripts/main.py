@@ -1,18 +1,22 @@
-from functions.api_requests import (
-    scrape_and_write_raw_bookings_data,
-    scrape_and_write_raw_locations_data,
-)
+import importlib
 import logging
 from context_filter import ContextFilter
-from functions.data_validation import (
-    validate_bookings_data,
-    validate_locations_data,
-    read_and_write_cleaned_bookings,
-    read_and_write_cleaned_locations,
-    refresh_new_partition_bookings,
-    refresh_new_partition_locations
+from constants import (
+    scrape_date,
+    env,
+    function_to_run,
+    locations_mode,
+    fan_out_envs,
+    skip_scrape,
+    metrics_path,
+    prometheus_textfile,
+    statsd_address,
+    profile,
+    profile_output,
+    profile_top,
 )
-from constants import scrape_date, function_to_run
+from metrics import run_metrics
+from profiling import maybe_profile
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -29,35 +33,71 @@ for handler in root_logger.handlers:
     handler.addFilter(ContextFilter())
 
 
+# Where each step lives. A step's module is only imported when the step runs,
+# so a task that runs one step doesn't pay for importing the libraries the
+# others need (see benchmarks/import_time.py)
+STEPS = {
+    "scrape_and_write_raw_bookings_data": "functions.api_requests",
+    "scrape_and_write_raw_locations_data": "functions.api_requests",
+    "scrape_and_write_raw_data_to_envs": "functions.api_requests",
+    "run_steps_in_envs": "fan_out",
+    "validate_raw_data": "functions.data_validation",
+    "validate_bookings_data": "functions.data_validation",
+    "validate_locations_data": "functions.data_validation",
+    "read_and_write_cleaned_bookings": "functions.data_validation",
+    "read_and_write_cleaned_locations": "functions.data_validation",
+    "refresh_new_partition_bookings": "functions.partitions",
+    "refresh_new_partition_locations": "functions.partitions",
+    "read_and_write_locations_changes": "functions.locations_scd2",
+    "refresh_locations_changes_partition": "functions.locations_scd2",
+}
+
+
+def load_step(name: str):
+    """Imports the module a step lives in and returns the step"""
+    assert name in STEPS, logger.error(
+        f"Unknown function {name}, expected one of {list(STEPS)}"
+    )
+    return getattr(importlib.import_module(STEPS[name]), name)
+
+
+def run_step(name: str):
+    logger.info(f"Running function: {name}")
+    with run_metrics.step(name):
+        with maybe_profile(name, profile, profile_output, profile_top):
+            func = load_step(name)
+            func(scrape_date)
+
+
 def main():
-    functions = [
-        scrape_and_write_raw_bookings_data,
-        scrape_and_write_raw_locations_data,
-        validate_bookings_data,
-        validate_locations_data,
-        read_and_write_cleaned_bookings,
-        read_and_write_cleaned_locations,
-        refresh_new_partition_bookings,
-        refresh_new_partition_locations,
+    steps = [
+        "scrape_and_write_raw_bookings_data",
+        "scrape_and_write_raw_locations_data",
+        "validate_raw_data",
+        "read_and_write_cleaned_bookings",
+        "read_and_write_cleaned_locations",
+        "refresh_new_partition_bookings",
+        "refresh_new_partition_locations",
     ]
-    if not function_to_run:
-        for func in functions:
-            logger.info(f"Running function: {func.__name__}")
-            func(scrape_date)
-    else:
-        function_map = {
-            "scrape_and_write_raw_bookings_data": scrape_and_write_raw_bookings_data,
-            "scrape_and_write_raw_locations_data": scrape_and_write_raw_locations_data,
-            "validate_bookings_data": validate_bookings_data,
-            "validate_locations_data": validate_locations_data,
-            "read_and_write_cleaned_bookings": read_and_write_cleaned_bookings,
-            "read_and_write_cleaned_locations": read_and_write_cleaned_locations,
-            "refresh_new_partition_bookings": refresh_new_partition_bookings,
-            "refresh_new_partition_locations": refresh_new_partition_locations,
-        }
-        run_function = function_map.get(function_to_run)
-        logger.info(f"Running function: {function_to_run}")
-        run_function(scrape_date)
+    if locations_mode == "scd2":
+        steps = [
+            {
+                "read_and_write_cleaned_locations": "read_and_write_locations_changes",
+                "refresh_new_partition_locations": "refresh_locations_changes_partition",
+            }.get(step, step)
+            for step in steps
+        ]
+    if skip_scrape:
+        steps = [step for step in steps if not step.startswith("scrape_")]
+    if fan_out_envs:
+        # Scrape once here, then each environment runs the rest in a child process
+        steps = ["scrape_and_write_raw_data_to_envs", "run_steps_in_envs"]
+    run_metrics.set_labels(env=env, scrape_date=scrape_date)
+    try:
+        for step in [function_to_run] if function_to_run else steps:
+            run_step(step)
+    finally:
+        run_metrics.emit(metrics_path, prometheus_textfile, statsd_address)
 
 
 if __name__ == "__main__":
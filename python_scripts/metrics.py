@@ -0,0 +1,239 @@
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+
+def _empty_call_totals() -> dict:
+    return {"count": 0, "seconds": 0.0, "bytes": 0, "retries": 0, "errors": 0}
+
+
+class RunMetrics:
+    """
+    Collects timings and volumes for one pipeline run.
+
+    Steps are recorded with `step`, and every external call (Matrix HTTP, S3,
+    Athena, Glue) made while a step is running is attributed to it through
+    `call`. Steps run one after another, but calls within a step may come from
+    worker threads, so the current step is process-wide rather than per thread.
+    """
+
+    def __init__(self):
+        self.run_id = uuid.uuid4().hex
+        self.labels = {}
+        self.started_at = time.time()
+        self.steps = []
+        self.gauges = {}
+        self._current = None
+        self._lock = threading.Lock()
+
+    def set_labels(self, **labels):
+        self.labels.update(labels)
+
+    def _new_step(self, name: str) -> dict:
+        return {
+            "name": name,
+            "status": "running",
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "duration_seconds": None,
+            "rows": 0,
+            "bytes": 0,
+            "pages": 0,
+            "calls": {},
+        }
+
+    @contextmanager
+    def step(self, name: str):
+        """Times a pipeline step and makes it the target of `call` and `add`."""
+        record = self._new_step(name)
+        with self._lock:
+            self.steps.append(record)
+            self._current = record
+        start = time.perf_counter()
+        try:
+            yield record
+            record["status"] = "success"
+        except BaseException:
+            record["status"] = "failed"
+            raise
+        finally:
+            record["duration_seconds"] = round(time.perf_counter() - start, 4)
+            with self._lock:
+                self._current = None
+
+    def _step_for_update(self) -> dict:
+        # Calls made outside a step (e.g. from the database builder scripts)
+        # are grouped under a catch-all step
+        if self._current is None:
+            if not self.steps or self.steps[-1]["name"] != "__unscoped__":
+                self.steps.append(self._new_step("__unscoped__"))
+            return self.steps[-1]
+        return self._current
+
+    def add(self, field: str, value: float):
+        """Adds to a counter (rows, bytes, pages, ...) on the current step."""
+        with self._lock:
+            step = self._step_for_update()
+            step[field] = step.get(field, 0) + value
+
+    def add_rows(self, rows: int):
+        self.add("rows", rows)
+
+    def gauge(self, name: str, value: float):
+        with self._lock:
+            self.gauges[name] = value
+
+    @contextmanager
+    def call(self, service: str, operation: str):
+        """
+        Times one external call. The caller can fill in `bytes` and `retries`
+        on the yielded dict once it knows them.
+        """
+        record = {"bytes": 0, "retries": 0}
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield record
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                step = self._step_for_update()
+                totals = step["calls"].setdefault(
+                    f"{service}.{operation}", _empty_call_totals()
+                )
+                totals["count"] += 1
+                totals["seconds"] = round(totals["seconds"] + elapsed, 4)
+                totals["bytes"] += record["bytes"] or 0
+                totals["retries"] += record["retries"] or 0
+                totals["errors"] += int(failed)
+
+    def merge_calls(self, calls: dict):
+        """Adds call totals recorded in another process, e.g. a worker, to
+        the current step"""
+        with self._lock:
+            step = self._step_for_update()
+            for name, other in calls.items():
+                totals = step["calls"].setdefault(name, _empty_call_totals())
+                for field, value in other.items():
+                    totals[field] = round(totals[field] + value, 4)
+
+    def summary(self) -> dict:
+        with self._lock:
+            return {
+                "run_id": self.run_id,
+                **self.labels,
+                "duration_seconds": round(time.time() - self.started_at, 4),
+                "steps": [dict(step) for step in self.steps],
+                "gauges": dict(self.gauges),
+            }
+
+    def to_prometheus(self) -> str:
+        """Renders the summary in the Prometheus text exposition format."""
+        summary = self.summary()
+        base = ",".join(f'{k}="{v}"' for k, v in sorted(self.labels.items()))
+        # Each metric family gets a single TYPE line followed by its samples
+        families = {}
+
+        def metric(name, value, metric_type, **labels):
+            label_str = ",".join(
+                [base] * bool(base) + [f'{k}="{v}"' for k, v in labels.items()]
+            )
+            samples = families.setdefault(name, (metric_type, []))[1]
+            samples.append(f"matrix_scraper_{name}{{{label_str}}} {value}")
+
+        metric("run_duration_seconds", summary["duration_seconds"], "gauge")
+        for step in summary["steps"]:
+            name = step["name"]
+            metric("step_duration_seconds", step["duration_seconds"] or 0, "gauge", step=name)
+            metric("step_success", int(step["status"] == "success"), "gauge", step=name)
+            for field in ("rows", "bytes", "pages"):
+                metric(f"step_{field}", step[field], "gauge", step=name)
+            for call, totals in step["calls"].items():
+                service, operation = call.split(".", 1)
+                labels = {"step": name, "service": service, "operation": operation}
+                metric("calls_total", totals["count"], "counter", **labels)
+                metric("call_seconds_total", totals["seconds"], "counter", **labels)
+                metric("call_bytes_total", totals["bytes"], "counter", **labels)
+                metric("call_retries_total", totals["retries"], "counter", **labels)
+                metric("call_errors_total", totals["errors"], "counter", **labels)
+        for name, value in summary["gauges"].items():
+            metric(name, value, "gauge")
+        lines = []
+        for name, (metric_type, samples) in families.items():
+            lines.append(f"# TYPE matrix_scraper_{name} {metric_type}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+    def to_statsd(self) -> list[str]:
+        """Renders the summary as StatsD lines."""
+        summary = self.summary()
+        lines = [f"matrix_scraper.run.duration:{summary['duration_seconds'] * 1000:.0f}|ms"]
+        for step in summary["steps"]:
+            prefix = f"matrix_scraper.step.{step['name']}"
+            lines.append(f"{prefix}.duration:{(step['duration_seconds'] or 0) * 1000:.0f}|ms")
+            for field in ("rows", "bytes", "pages"):
+                lines.append(f"{prefix}.{field}:{step[field]}|g")
+            for call, totals in step["calls"].items():
+                lines.append(f"{prefix}.{call}.count:{totals['count']}|c")
+                lines.append(f"{prefix}.{call}.duration:{totals['seconds'] * 1000:.0f}|ms")
+                lines.append(f"{prefix}.{call}.bytes:{totals['bytes']}|c")
+                lines.append(f"{prefix}.{call}.retries:{totals['retries']}|c")
+        for name, value in summary["gauges"].items():
+            lines.append(f"matrix_scraper.{name}:{value}|g")
+        return lines
+
+    def emit(
+        self,
+        path: str = None,
+        prometheus_textfile: str = None,
+        statsd_address: str = None,
+    ):
+        """
+        Logs the JSON summary for the run, and optionally writes it to a local
+        or s3 path, a Prometheus textfile and/or a StatsD server (host:port).
+        Failing to emit metrics never fails the run.
+        """
+        summary = self.summary()
+        body = json.dumps(summary, default=str)
+        logger.info(body, extra={"context": "METRICS"})
+        try:
+            if path:
+                write_text(path, body)
+            if prometheus_textfile:
+                tmp = f"{prometheus_textfile}.{os.getpid()}.tmp"
+                with open(tmp, "w") as f:
+                    f.write(self.to_prometheus())
+                os.replace(tmp, prometheus_textfile)
+            if statsd_address:
+                host, port = statsd_address.rsplit(":", 1)
+                with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                    for line in self.to_statsd():
+                        sock.sendto(line.encode("utf-8"), (host, int(port)))
+        except Exception as e:
+            logger.error(f"Failed to emit run metrics: {e}")
+
+
+def write_text(path: str, body: str):
+    """Writes text to a local path or an s3://bucket/key path."""
+    if path.startswith("s3://"):
+        from s3_utils import write_text_to_s3
+
+        write_text_to_s3(path, body)
+    else:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(body)
+
+
+# Shared by everything in the process
+run_metrics = RunMetrics()
@@ -0,0 +1,104 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
+
+
+def write_artefact(output: str, name: str, body: bytes):
+    """Writes one profile artefact to a local directory or an s3 prefix."""
+    path = f"{output.rstrip('/')}/{name}"
+    if output.startswith("s3://"):
+        from s3_utils import write_bytes_to_s3
+
+        write_bytes_to_s3(path, body)
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(body)
+    return path
+
+
+def hotspot_summary(
+    name: str,
+    profiler: cProfile.Profile,
+    snapshot: tracemalloc.Snapshot,
+    peak_bytes: int,
+    wall_seconds: float,
+    top_n: int,
+) -> str:
+    """Top-N functions by cumulative and own CPU time, and top-N lines by
+    memory still allocated at the end of the step."""
+    out = io.StringIO()
+    out.write(f"Profile of {name}\n")
+    out.write(f"Wall time: {wall_seconds:.3f}s\n")
+    out.write(f"Peak traced memory: {peak_bytes / 2**20:.1f} MiB\n\n")
+
+    for sort_key, label in (("cumulative", "cumulative"), ("tottime", "own")):
+        out.write(f"== Top {top_n} functions by {label} time ==\n")
+        stats = pstats.Stats(profiler, stream=out)
+        stats.strip_dirs().sort_stats(sort_key).print_stats(top_n)
+
+    out.write(f"== Top {top_n} allocations by line ==\n")
+    for stat in snapshot.statistics("lineno")[:top_n]:
+        out.write(f"{stat}\n")
+    return out.getvalue()
+
+
+@contextmanager
+def profile_step(name: str, output: str, top_n: int = 25):
+    """
+    Runs the enclosed block under cProfile and tracemalloc, then writes
+    `{name}.prof` (load with pstats or snakeviz), `{name}.tracemalloc`
+    (load with tracemalloc.Snapshot.load) and a readable
+    `{name}-hotspots.txt` to `output`, a local directory or s3 prefix.
+    """
+    profiler = cProfile.Profile()
+    already_tracing = tracemalloc.is_tracing()
+    if not already_tracing:
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        wall_seconds = time.perf_counter() - start
+        snapshot = tracemalloc.take_snapshot()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+        if not already_tracing:
+            tracemalloc.stop()
+
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                prof_file = os.path.join(tmp, f"{name}.prof")
+                profiler.dump_stats(prof_file)
+                snapshot_file = os.path.join(tmp, f"{name}.tracemalloc")
+                snapshot.dump(snapshot_file)
+                for file_path in (prof_file, snapshot_file):
+                    with open(file_path, "rb") as f:
+                        write_artefact(output, os.path.basename(file_path), f.read())
+
+            summary = hotspot_summary(
+                name, profiler, snapshot, peak_bytes, wall_seconds, top_n
+            )
+            summary_path = write_artefact(
+                output, f"{name}-hotspots.txt", summary.encode("utf-8")
+            )
+            logger.info(f"Profile for {name} written to {summary_path}")
+        except Exception as e:
+            logger.error(f"Failed to write profile for {name}: {e}")
+
+
+def maybe_profile(name: str, enabled: bool, output: str, top_n: int = 25):
+    """profile_step if profiling is enabled, otherwise a no-op context"""
+    if not enabled:
+        return nullcontext()
+    return profile_step(name, output, top_n)
@@ -0,0 +1,198 @@
+"""
+Client-side pacing of the requests made to the Matrix API.
+
+`AdaptiveRateLimiter` combines a token bucket, which caps the request rate,
+with an AIMD (additive increase, multiplicative decrease) limit on the
+number of requests in flight. Both start at their maximum, as most runs
+only make a handful of requests. A 429 or 503, or a run of responses much
+slower than the median of the recent ones, halves them, and every successful
+response that isn't slow nudges them back up. Scrape workers share one limiter, so together they
+settle at the throughput the API can sustain without having to be tuned by
+hand.
+"""
+import statistics
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import run_metrics
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket with an AIMD-adjusted rate and concurrency limit.
+
+    Parameters
+    ----------
+    min_rate, max_rate :
+        Bounds of the rate, in requests per second
+    max_concurrency :
+        Most requests allowed in flight at once
+    increase :
+        Requests per second added to the rate for every second's worth of
+        fast responses
+    decrease :
+        Factor the rate and concurrency limit are multiplied by on congestion
+    latency_tolerance :
+        A response is slow when it takes this many times longer than the
+        median of the recent responses
+    latency_window :
+        How many of the most recent successful responses the median is
+        taken over
+    slow_streak :
+        How many slow responses in a row are treated as a sign of congestion
+    name :
+        Prefix of the gauges written to the run metrics
+    """
+
+    def __init__(
+        self,
+        min_rate: float = 0.5,
+        max_rate: float = 20.0,
+        max_concurrency: int = 8,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        latency_tolerance: float = 4.0,
+        latency_window: int = 20,
+        slow_streak: int = 3,
+        name: str = "matrix",
+    ):
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.max_concurrency = max_concurrency
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_tolerance = latency_tolerance
+        self.latency_window = latency_window
+        self.slow_streak = slow_streak
+        self.name = name
+        self.rate = max_rate
+        self.concurrency = float(max_concurrency)
+        self._tokens = 1.0
+        self._refilled_at = time.monotonic()
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._decreased_at = 0.0
+        self._latencies = deque(maxlen=latency_window)
+        self._slow = 0
+        self._cond = threading.Condition()
+        self._publish()
+
+    def configure(self, **settings):
+        """Changes any of the constructor's settings. Until the limiter has
+        had to back off, the rate and concurrency limit follow the maximums."""
+        with self._cond:
+            for key, value in settings.items():
+                if not hasattr(self, key) or key.startswith("_"):
+                    raise ValueError(f"Unknown rate limiter setting {key}")
+                setattr(self, key, value)
+            if not self._decreased_at:
+                self.rate = self.max_rate
+                self.concurrency = float(self.max_concurrency)
+            self.rate = min(max(self.rate, self.min_rate), self.max_rate)
+            self.concurrency = min(self.concurrency, self.max_concurrency)
+            if self._latencies.maxlen != self.latency_window:
+                self._latencies = deque(self._latencies, maxlen=self.latency_window)
+            self._publish()
+            self._cond.notify_all()
+
+    def _publish(self):
+        run_metrics.gauge(f"{self.name}_request_rate", round(self.rate, 3))
+        run_metrics.gauge(f"{self.name}_concurrency_limit", int(self.concurrency))
+
+    def _refill(self, now: float):
+        # The bucket holds at most one second's worth of tokens
+        elapsed = now - self._refilled_at
+        self._tokens = min(max(self.rate, 1.0), self._tokens + elapsed * self.rate)
+        self._refilled_at = now
+
+    def acquire(self) -> float:
+        """Blocks until a request may be sent, and returns the time it was
+        let through"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self._paused_until:
+                    wait = self._paused_until - now
+                elif self._in_flight >= int(self.concurrency):
+                    wait = None
+                elif self._tokens < 1:
+                    wait = (1 - self._tokens) / self.rate
+                else:
+                    self._tokens -= 1
+                    self._in_flight += 1
+                    return now
+                self._cond.wait(wait)
+
+    def release(self, started_at: float, throttled: bool = False):
+        """Records the outcome of a request let through by acquire
+
+        Parameters
+        ----------
+        started_at :
+            What acquire returned
+        throttled : optional
+            Whether the API rejected the request with a 429 or 503
+        """
+        now = time.monotonic()
+        latency = now - started_at
+        with self._cond:
+            self._in_flight -= 1
+            slow = (
+                not throttled
+                and len(self._latencies) > 0
+                and latency > statistics.median(self._latencies) * self.latency_tolerance
+            )
+            if not throttled:
+                # The median follows the API's latency as it changes, so a
+                # lasting change stops counting as slow once it fills half
+                # the window
+                self._latencies.append(latency)
+                self._slow = self._slow + 1 if slow else 0
+            if throttled or self._slow >= self.slow_streak:
+                self._slow = 0
+                # Only back off once for requests that were already in flight
+                # when the last back off happened
+                if started_at >= self._decreased_at:
+                    self._decreased_at = now
+                    self.rate = max(self.min_rate, self.rate * self.decrease)
+                    self.concurrency = max(1.0, self.concurrency * self.decrease)
+                    logger.info(
+                        f"{'Throttled' if throttled else f'Slow responses ({latency:.2f}s)'}, "
+                        f"backing off to {self.rate:.2f} requests/s, "
+                        f"{int(self.concurrency)} at once"
+                    )
+            elif not slow:
+                self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+                self.concurrency = min(
+                    self.max_concurrency, self.concurrency + 1 / self.concurrency
+                )
+            self._publish()
+            self._cond.notify_all()
+
+    def pause(self, seconds: float):
+        """Holds back every request for `seconds`, e.g. for a Retry-After"""
+        with self._cond:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._cond.notify_all()
+
+    @contextmanager
+    def request(self):
+        """Paces one request. The caller sets `throttled` on the yielded dict
+        if the API rejected it."""
+        outcome = {"throttled": False}
+        started_at = self.acquire()
+        try:
+            yield outcome
+        finally:
+            self.release(started_at, throttled=outcome["throttled"])
+
+
+# Shared by every request to the Matrix API in the process
+matrix_limiter = AdaptiveRateLimiter()
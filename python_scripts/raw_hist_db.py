@@ -3,6 +3,8 @@ import boto3
 from mojap_metadata import Metadata
 from mojap_metadata.converters.glue_converter import GlueConverter
 
+from glue_schema import migrate_tables
+
 gc = GlueConverter()
 glue_client = boto3.client("glue", region_name='eu-west-1')
 s3_client = boto3.client("s3", region_name='eu-west-1')
@@ -35,12 +37,6 @@ location_schema = gc.generate_from_meta(
     table_location=location_data_folder)
 
 wr.catalog.create_database(name=db_name, exist_ok=True)
-glue_client.create_table(**booking_schema)
-glue_client.create_table(**location_schema)
-
-'''
-botocore.errorfactory.AlreadyExistsException: 
-An error occurred (AlreadyExistsException) 
-when calling the CreateTable operation: 
-Table already exists
-'''
\ No newline at end of file
+# Creates the tables the first time, and only adds new columns after that,
+# rather than failing with AlreadyExistsException
+migrate_tables([booking_schema, location_schema], glue_client=glue_client)
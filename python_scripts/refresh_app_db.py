@@ -1,25 +1,31 @@
-import pydbtools as pydb
+from athena import run_athena_query
 from s3_utils import delete_all_matching_s3_objects
 
 
-def refresh_app_db():
+def refresh_app_db(workgroup: str = None):
+    """Rebuilds matrixbooking_app_db, running the queries in `workgroup`
+    (by default $ATHENA_WORKGROUP, or Athena's default workgroup)"""
     print("refreshing app db")
     print("dropping db")
-    pydb.get_athena_query_response(
-        "drop database if exists matrixbooking_app_db cascade"
+    run_athena_query(
+        "drop database if exists matrixbooking_app_db cascade",
+        label="app_db_drop",
+        workgroup=workgroup,
     )
 
     print("delete db files in bucket")
     delete_all_matching_s3_objects("alpha-app-matrixbooking", "db")
 
     print("create database")
-    pydb.get_athena_query_response(
+    run_athena_query(
         """create database matrixbooking_app_db location
-        's3://alpha-app-matrixbooking/db/'"""
+        's3://alpha-app-matrixbooking/db/'""",
+        label="app_db_create",
+        workgroup=workgroup,
     )
 
     print("create bookings table")
-    pydb.get_athena_query_response(
+    run_athena_query(
         """
         create table if not exists matrixbooking_app_db.bookings
         with(external_location = 's3://alpha-app-matrixbooking/db/bookings/')
@@ -49,22 +55,26 @@ def refresh_app_db():
         on b.location_id = l.id
         inner join occupeye_db_live.sensors as s
         on l.id = s.location
-        """
+        """,
+        label="app_db_bookings",
+        workgroup=workgroup,
     )
 
     print("create locations table")
-    pydb.get_athena_query_response(
+    run_athena_query(
         """
         create table if not exists matrixbooking_app_db.locations
         with(external_location = 's3://alpha-app-matrixbooking/db/locations/')
         as select * from matrix_db.locations as l
                                    inner join occupeye_db_live.sensors as s
                                    on l.id = s.location
-        """
+        """,
+        label="app_db_locations",
+        workgroup=workgroup,
     )
 
     print("create sensor observations table")
-    pydb.get_athena_query_response(
+    run_athena_query(
         """
         create table if not exists matrixbooking_app_db.sensor_observations
         with(external_location =
@@ -76,11 +86,13 @@ def refresh_app_db():
         on so.survey_device_id = se.surveydeviceid
         inner join matrix_db.locations as l
         on l.id = se.location
-        """
+        """,
+        label="app_db_sensor_observations",
+        workgroup=workgroup,
     )
 
     print("create surveys table")
-    pydb.get_athena_query_response(
+    run_athena_query(
         """
         create table if not exists matrixbooking_app_db.surveys
         with(external_location = 's3://alpha-app-matrixbooking/db/surveys')
@@ -89,5 +101,7 @@ def refresh_app_db():
         from occupeye_db_live.surveys as su
         inner join matrixbooking_app_db.locations as l
         on l.survey_id = su.survey_id
-        """
+        """,
+        label="app_db_surveys",
+        workgroup=workgroup,
     )
@@ -0,0 +1,95 @@
+"""
+Record and replay of Matrix API responses.
+
+In `record` mode every response body fetched by `get_payload` is also saved,
+gzipped, under the cache root. In `replay` mode responses are served from the
+cache without touching the network or logging in, so a day can be
+reprocessed (e.g. after a metadata or rename change) from the pages fetched
+the first time, and the same files can be used as offline benchmark fixtures.
+
+Each response is stored at `{root}/{endpoint}/{hash}.json.gz`, where the
+endpoint is the URL path (so the cache doesn't depend on `--api-url`) and the
+hash is of the endpoint and the sorted query parameters. The root can be a
+local directory or an s3 prefix.
+"""
+import gzip
+import hashlib
+import json
+import os
+from urllib.parse import urlparse
+
+from botocore.exceptions import ClientError
+
+from s3_utils import read_bytes_from_s3, write_bytes_to_s3
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+CACHE_MODES = ("off", "record", "replay")
+
+
+class ResponseCache:
+    """
+    Parameters
+    ----------
+    root :
+        Local directory or s3 prefix to keep the responses under
+    mode :
+        "off", "record" or "replay"
+    """
+
+    def __init__(self, root: str = None, mode: str = "off"):
+        self.configure(root=root, mode=mode)
+
+    def configure(self, root: str = None, mode: str = "off"):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode {mode}, expected one of {CACHE_MODES}")
+        if mode != "off" and not root:
+            raise ValueError(f"A cache root is needed to {mode} responses")
+        self.root = root.rstrip("/") if root else root
+        self.mode = mode
+
+    @property
+    def recording(self) -> bool:
+        return self.mode == "record"
+
+    @property
+    def replaying(self) -> bool:
+        return self.mode == "replay"
+
+    def path(self, url: str, params: dict) -> str:
+        """Where the response to a GET of `url` with `params` is kept"""
+        endpoint = urlparse(url).path.strip("/")
+        query = sorted(
+            (str(key), str(value)) for key, value in (params or {}).items() if value is not None
+        )
+        digest = hashlib.sha256(json.dumps([endpoint, query]).encode("utf-8")).hexdigest()
+        return f"{self.root}/{endpoint}/{digest[:32]}.json.gz"
+
+    def get(self, url: str, params: dict) -> bytes:
+        """The cached response body, or None if there isn't one"""
+        path = self.path(url, params)
+        try:
+            if path.startswith("s3://"):
+                body = read_bytes_from_s3(path)
+            else:
+                with open(path, "rb") as f:
+                    body = f.read()
+        except (FileNotFoundError, ClientError):
+            return None
+        return gzip.decompress(body)
+
+    def put(self, url: str, params: dict, body: bytes):
+        path = self.path(url, params)
+        compressed = gzip.compress(body)
+        if path.startswith("s3://"):
+            write_bytes_to_s3(path, compressed)
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(compressed)
+
+
+# Shared by every request to the Matrix API in the process
+matrix_cache = ResponseCache()
@@ -2,9 +2,10 @@ import boto3
 import botocore
 from botocore.exceptions import NoCredentialsError, ClientError
 import logging
-import json
 import os
 from datetime import datetime, timedelta
+from fast_json import loads
+from metrics import run_metrics
 
 
 logging.basicConfig(
@@ -18,11 +19,74 @@ s3_resource = boto3.resource("s3")
 s3 = boto3.client("s3")
 
 
-def read_json_from_s3(s3_path):
+def read_bytes_from_s3(s3_path):
     bucket, key = s3_path_to_bucket_key(s3_path)
     obj = s3_resource.Object(bucket, key)
-    text = obj.get()["Body"].read().decode("utf-8")
-    return json.loads(text)
+    with run_metrics.call("s3", "get") as call:
+        body = obj.get()["Body"].read()
+        call["bytes"] = len(body)
+    return body
+
+
+def iter_lines_from_s3(s3_path):
+    """Yields the lines of an s3 object as bytes, without reading the whole
+    object into memory"""
+    bucket, key = s3_path_to_bucket_key(s3_path)
+    obj = s3_resource.Object(bucket, key)
+    with run_metrics.call("s3", "get") as call:
+        resp = obj.get()
+        call["bytes"] = resp["ContentLength"]
+    yield from resp["Body"].iter_lines()
+
+
+def read_json_from_s3(s3_path):
+    return loads(read_bytes_from_s3(s3_path))
+
+
+def write_bytes_to_s3(s3_path, body):
+    bucket, key = s3_path_to_bucket_key(s3_path)
+    with run_metrics.call("s3", "put") as call:
+        s3.put_object(Bucket=bucket, Key=key, Body=body)
+        call["bytes"] = len(body)
+
+
+def upload_file_to_s3(local_path, s3_path):
+    """Uploads a local file, in parts if it is large"""
+    bucket, key = s3_path_to_bucket_key(s3_path)
+    with run_metrics.call("s3", "put") as call:
+        s3.upload_file(local_path, bucket, key)
+        call["bytes"] = os.path.getsize(local_path)
+
+
+def write_text_to_s3(s3_path, text):
+    write_bytes_to_s3(s3_path, text.encode("utf-8"))
+
+
+def copy_s3_object(source_path, dest_path):
+    source_bucket, source_key = s3_path_to_bucket_key(source_path)
+    dest_bucket, dest_key = s3_path_to_bucket_key(dest_path)
+    with run_metrics.call("s3", "copy"):
+        s3.copy_object(
+            CopySource={"Bucket": source_bucket, "Key": source_key},
+            Bucket=dest_bucket,
+            Key=dest_key,
+        )
+
+
+def delete_s3_object(s3_path):
+    bucket, key = s3_path_to_bucket_key(s3_path)
+    with run_metrics.call("s3", "delete"):
+        s3.delete_object(Bucket=bucket, Key=key)
+
+
+def get_object_size(s3_path):
+    """Size in bytes of an s3 object, or None if it can't be found"""
+    bucket, key = s3_path_to_bucket_key(s3_path)
+    try:
+        with run_metrics.call("s3", "head"):
+            return s3.head_object(Bucket=bucket, Key=key)["ContentLength"]
+    except ClientError:
+        return None
 
 
 def s3_path_to_bucket_key(path):
@@ -59,7 +123,8 @@ def get_matching_s3_keys(bucket, prefix="", suffix=""):
 
         # The S3 API response is a large blob of metadata.
         # 'Contents' contains information about the listed objects.
-        resp = s3.list_objects_v2(**kwargs)
+        with run_metrics.call("s3", "list"):
+            resp = s3.list_objects_v2(**kwargs)
         if resp.get("Contents", None) is not None:
             for obj in resp.get("Contents", None):
                 key = obj["Key"]
@@ -0,0 +1,301 @@
+"""
+Rebuilds the database from the pass folder without taking it offline.
+
+`rebuild_database(delete_data=True)` followed by
+`rebuild_all_s3_data_from_raw` leaves `matrix_{env}` empty or partial until
+every day has been rewritten. This script writes the rebuild to a new version
+folder, `{db_location}/_versions/v={version}/{table}/`, instead, and registers
+it in a shadow database, `matrix_{env}_shadow`, where it can be queried
+before it goes live. The shadow tables use partition projection on
+scrape_date, so no partitions have to be registered. Days whose locations
+were reused from an earlier day have no pass file, so they are rewritten from
+that day's rebuilt partition (see functions/locations_fingerprint.py).
+
+The rows in every partition of the new version (from the parquet footers)
+are then checked against the rows read from the pass folder, and every day
+in the live table must be in the new version. If they match, each live table
+is repointed at its new version, with partition projection, in one
+`update_table` call, so queries see either the old or the new data, never a
+mix. The live table's previous definition is saved in the version folder, and
+`--rollback` restores it. The previous version is kept until the next build.
+Once a table has been compacted (see compaction.py), it's `{table}_daily`
+that is repointed, and the `{table}` view keeps reading the compacted months
+from `{table}_compacted`.
+
+Days processed after a swap are written to the new version (see
+functions/table_locations.py), so rerun them after a rollback.
+
+Usage:
+    # Rebuild, verify and swap in
+    python python_scripts/shadow_build.py --env prod
+
+    # Point the tables back at the previous version
+    python python_scripts/shadow_build.py --env prod --rollback
+"""
+import io
+import re
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import awswrangler as wr
+import boto3
+import pyarrow.parquet as pq
+from mojap_metadata import Metadata
+from mojap_metadata.converters.glue_converter import GlueConverter
+
+from constants import db_location, db_name, region_name
+from fast_json import dumps, loads
+from functions.data_validation import (
+    META_PATH,
+    list_s3_files,
+    rebuild_all_s3_data_from_raw,
+)
+from functions.general_helpers import get_command_line_arguments
+from functions.table_locations import daily_table, table_root
+from glue_schema import get_table, table_input
+from metrics import run_metrics
+from s3_utils import (
+    delete_all_matching_s3_objects,
+    read_bytes_from_s3,
+    s3_path_to_bucket_key,
+    write_bytes_to_s3,
+)
+
+from logging import getLogger
+
+logger = getLogger(__name__)
+
+TABLES = ("bookings", "locations")
+VERSIONS_ROOT = f"{db_location}/_versions"
+SHADOW_DB = f"{db_name}_shadow"
+
+glue_client = boto3.client("glue", region_name=region_name)
+
+
+def version_root(version: str) -> str:
+    return f"{VERSIONS_ROOT}/v={version}"
+
+
+def previous_definition_path(version: str, table: str) -> str:
+    return f"{version_root(version)}/previous/{table}.json"
+
+
+def version_of(location: str) -> str:
+    """The version a table location belongs to, or None if it isn't versioned"""
+    match = re.search(r"/_versions/v=([^/]+)/", f"{location}/")
+    return match.group(1) if match else None
+
+
+def projection_parameters(location: str, first_date: str) -> dict:
+    """Table parameters for partition projection on scrape_date"""
+    return {
+        "projection.enabled": "true",
+        "projection.scrape_date.type": "date",
+        "projection.scrape_date.format": "yyyy-MM-dd",
+        "projection.scrape_date.range": f"{first_date},NOW",
+        "projection.scrape_date.interval": "1",
+        "projection.scrape_date.interval.unit": "DAYS",
+        "storage.location.template": f"{location}/scrape_date=${{scrape_date}}",
+    }
+
+
+def shadow_schema(table: str, version: str, first_date: str) -> dict:
+    """create_table arguments for the shadow copy of `table`"""
+    metadata = Metadata.from_json(META_PATH[table])
+    metadata.partitions = ["scrape_date"]
+    location = f"{version_root(version)}/{table}"
+    schema = GlueConverter().generate_from_meta(
+        metadata, database_name=SHADOW_DB, table_location=location
+    )
+    schema["TableInput"]["Parameters"] = {
+        **schema["TableInput"].get("Parameters", {}),
+        **projection_parameters(location, first_date),
+    }
+    return schema
+
+
+def create_shadow_tables(version: str, first_date: str):
+    with run_metrics.call("glue", "create_database"):
+        wr.catalog.create_database(name=SHADOW_DB, exist_ok=True)
+    for table in TABLES:
+        if get_table(glue_client, SHADOW_DB, table) is not None:
+            with run_metrics.call("glue", "delete_table"):
+                glue_client.delete_table(DatabaseName=SHADOW_DB, Name=table)
+        with run_metrics.call("glue", "create_table"):
+            glue_client.create_table(**shadow_schema(table, version, first_date))
+        logger.info(f"{SHADOW_DB}.{table} reads from {version_root(version)}/{table}")
+
+
+def partition_row_counts(location: str) -> dict:
+    """Rows in each scrape_date partition under `location`, from the parquet
+    footers"""
+    files = [f for f in list_s3_files(f"{location}/") if f.endswith(".parquet")]
+
+    def num_rows(path):
+        return pq.read_metadata(io.BytesIO(read_bytes_from_s3(path))).num_rows
+
+    counts = defaultdict(int)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for path, rows in zip(files, executor.map(num_rows, files)):
+            match = re.search(r"scrape_date=(\d{4}-\d{2}-\d{2})/", path)
+            if match:
+                counts[match.group(1)] += rows
+    return dict(counts)
+
+
+def partition_dates(location: str) -> set:
+    return {
+        match.group(1)
+        for path in list_s3_files(f"{location}/")
+        for match in [re.search(r"scrape_date=(\d{4}-\d{2}-\d{2})/", path)]
+        if match
+    }
+
+
+def verify_shadow(version: str, expected: dict):
+    """Checks the rows in each partition of the new version against the rows
+    read from the pass folder, and that no day of the live table is missing
+
+    Parameters
+    ----------
+    version :
+        Version that was built
+    expected :
+        Rows written for each day, by table, as returned by
+        rebuild_all_s3_data_from_raw
+    """
+    problems = []
+    for table in TABLES:
+        actual = partition_row_counts(f"{version_root(version)}/{table}")
+        wrong = {
+            day: (rows, actual.get(day))
+            for day, rows in expected[table].items()
+            if actual.get(day) != rows
+        }
+        missing = sorted(partition_dates(table_root(table)) - set(actual))
+        if wrong:
+            problems.append(f"{table} rows (expected, found): {wrong}")
+        if missing:
+            problems.append(f"{table} days in the live table but not rebuilt: {missing}")
+        run_metrics.gauge(f"shadow_{table}_rows", sum(actual.values()))
+        run_metrics.gauge(f"shadow_{table}_partitions", len(actual))
+        logger.info(
+            f"{SHADOW_DB}.{table}: {sum(actual.values())} rows in {len(actual)} partitions"
+        )
+    assert not problems, logger.error(
+        f"Shadow build {version} failed verification: {'; '.join(problems)}"
+    )
+
+
+def swap_in(version: str):
+    """Points each live table at its new version
+
+    Each table changes in one update_table call. The definition it replaces
+    is saved first, for rollback.
+    """
+    for table in TABLES:
+        name = daily_table(table)
+        shadow = {**table_input(get_table(glue_client, SHADOW_DB, table)), "Name": name}
+        live = get_table(glue_client, db_name, name)
+        if live is None:
+            with run_metrics.call("glue", "create_table"):
+                glue_client.create_table(DatabaseName=db_name, TableInput=shadow)
+        else:
+            write_bytes_to_s3(
+                previous_definition_path(version, table), dumps(table_input(live))
+            )
+            with run_metrics.call("glue", "update_table"):
+                glue_client.update_table(DatabaseName=db_name, TableInput=shadow)
+        logger.info(f"{db_name}.{name} now reads from {version_root(version)}/{table}")
+
+
+def rollback():
+    """Restores the table definitions a swap replaced"""
+    for table in TABLES:
+        name = daily_table(table)
+        live = get_table(glue_client, db_name, name)
+        version = version_of(live["StorageDescriptor"]["Location"]) if live else None
+        assert version, logger.error(
+            f"{db_name}.{name} isn't a shadow build, nothing to roll back"
+        )
+        previous = loads(read_bytes_from_s3(previous_definition_path(version, table)))
+        # The table may have been moved by compaction since the swap
+        previous["Name"] = name
+        with run_metrics.call("glue", "update_table"):
+            glue_client.update_table(DatabaseName=db_name, TableInput=previous)
+        logger.info(
+            f"{db_name}.{name} rolled back to {previous['StorageDescriptor']['Location']}"
+        )
+
+
+def prune_versions():
+    """Deletes the data of versions that are neither live nor kept for
+    rollback, including the original unversioned folders once they have been
+    replaced twice"""
+    keep = set()
+    for table in TABLES:
+        live = get_table(glue_client, db_name, daily_table(table))
+        if live is None:
+            continue
+        location = live["StorageDescriptor"]["Location"].rstrip("/")
+        keep.add(location)
+        version = version_of(location)
+        if version:
+            previous = loads(read_bytes_from_s3(previous_definition_path(version, table)))
+            keep.add(previous["StorageDescriptor"]["Location"].rstrip("/"))
+    if not keep:
+        return
+
+    kept_versions = {version_of(location) for location in keep} - {None}
+    bucket, prefix = s3_path_to_bucket_key(VERSIONS_ROOT)
+    versions = {
+        match.group(1)
+        for path in list_s3_files(f"{VERSIONS_ROOT}/")
+        for match in [re.search(r"/_versions/v=([^/]+)/", path)]
+        if match
+    }
+    for version in sorted(versions - kept_versions):
+        logger.info(f"Deleting old version {version_root(version)}")
+        with run_metrics.call("s3", "delete"):
+            delete_all_matching_s3_objects(bucket, f"{prefix}/v={version}/")
+    for table in TABLES:
+        original = f"{db_location}/{table}"
+        if original not in keep:
+            bucket, key = s3_path_to_bucket_key(original)
+            logger.info(f"Deleting old version {original}")
+            with run_metrics.call("s3", "delete"):
+                delete_all_matching_s3_objects(bucket, f"{key}/")
+
+
+def build_and_swap() -> str:
+    """Rebuilds both tables into a new version, verifies it and swaps it in
+
+    Returns
+    -------
+        The new version
+    """
+    version = datetime.now().strftime("%Y%m%dT%H%M%S")
+    with run_metrics.step("prune_versions"):
+        prune_versions()
+    with run_metrics.step("rebuild_shadow"):
+        expected = rebuild_all_s3_data_from_raw(db_root=version_root(version))
+    days = [day for rows in expected.values() for day in rows]
+    assert days, logger.error("Nothing in the pass folder to rebuild from")
+    with run_metrics.step("create_shadow_tables"):
+        create_shadow_tables(version, min(days))
+    with run_metrics.step("verify_shadow"):
+        verify_shadow(version, expected)
+    with run_metrics.step("swap_in"):
+        swap_in(version)
+    return version
+
+
+if __name__ == "__main__":
+    args = get_command_line_arguments()
+    if args.rollback:
+        with run_metrics.step("rollback"):
+            rollback()
+    else:
+        build_and_swap()
+    run_metrics.emit(args.metrics_path, args.prometheus_textfile, args.statsd)
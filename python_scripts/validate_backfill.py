@@ -0,0 +1,32 @@
+"""
+Validates the raw files for a range of scrape dates, e.g. after a backfill
+has written them to land.
+
+Both tables are validated for every day. Days are grouped into data_linter
+runs of --days-per-run days, and --validate-workers runs go at once, each in
+its own process.
+
+Usage:
+    python python_scripts/validate_backfill.py --env prod --scrape_date 2024-01-01 --end-date 2024-01-31
+"""
+from datetime import datetime
+
+from constants import metrics_path, prometheus_textfile, scrape_date, statsd_address
+from functions.data_validation import validate_days
+from functions.general_helpers import get_command_line_arguments
+from metrics import run_metrics
+from s3_utils import generate_date_strings
+
+if __name__ == "__main__":
+    args = get_command_line_arguments()
+    end_date = datetime.strptime(args.end_date or scrape_date, "%Y-%m-%d").strftime("%Y-%m-%d")
+    run_metrics.set_labels(scrape_date=scrape_date, end_date=end_date)
+    try:
+        with run_metrics.step("validate_backfill"):
+            validate_days(
+                generate_date_strings(scrape_date, end_date),
+                days_per_run=args.days_per_run,
+                max_workers=args.validate_workers,
+            )
+    finally:
+        run_metrics.emit(metrics_path, prometheus_textfile, statsd_address)